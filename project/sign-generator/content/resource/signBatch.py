@@ -0,0 +1,330 @@
+import argparse
+import io
+import multiprocessing
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from importlib import import_module
+from itertools import chain
+from json import dumps, load
+
+SIGN_TYPES = {
+    "环岛式": ("signGenerator", "RoundaboutSign"),
+    "堆叠式": ("signGenerator", "StackedCrossingSign"),
+    "分向行驶": ("signGenerator", "LineSign"),
+    "车道预告": ("signGenerator", "LinePlaceSign"),
+    "入口预告": ("signGenerator", "HighwayEnterSign"),
+    "出口方向": ("signGenerator", "HignwayExitDirection"),
+    "出口编号": ("signGenerator", "ExitSign"),
+    "高速编号": ("signGenerator", "HighwayNoSign"),
+    "道路编号": ("signGenerator", "RoadNoSign"),
+    "辅助标牌": ("signGenerator", "AidSign"),
+    "通用标牌": ("signGeneral", "SignGeneral"),
+}
+""" The sign type names (saved by the GUI) and their <code>(module, class)</code> """
+STORED_FORMATS = {"png", "tif"}
+""" The formats already compressed, stored in a zip archive without deflating """
+_renderCaches: dict[tuple[str, int], object] = {}
+
+def getSignClass(signType: str):
+    """ Get the Sign class of the type name """
+    if signType not in SIGN_TYPES:
+        raise ValueError(f"Unknown sign type: {signType}")
+    moduleName, className = SIGN_TYPES[signType]
+    return getattr(import_module(moduleName), className)
+
+def createSign(signType: str, info: dict[str,]|None = None, scale: int = 10):
+    """ Create and render the sign of the type name with info """
+    sign = getSignClass(signType)(scale, info=info)
+    if sign.img is None:
+        sign.update()
+    return sign
+
+def createLayout(signType: str, info: dict[str,]|None = None, scale: int = 10):
+    """ Create the sign of the type name with info at a small scale (the constructors draw), to be drawn again at scale by another backend """
+    return getSignClass(signType)(min(scale, 4), info=info)
+
+def prewarmWorker():
+    """ Import the sign modules and load the font data and the stroke table (the pool initializer, already done in the parent if the workers are forked) """
+    for moduleName in set([moduleName for moduleName, _ in SIGN_TYPES.values()]):
+        import_module(moduleName)
+    import_module("textGenerator").prewarm()
+
+def getRenderCache(directory: str, maxBytes: int):
+    """ The <code>signCache.RenderCache</code> of the directory in this process """
+    cache = _renderCaches.get((directory, maxBytes))
+    if cache is None:
+        from signCache import RenderCache
+        cache = _renderCaches[(directory, maxBytes)] = RenderCache(directory, maxBytes, 0)
+    return cache
+
+def loadArgs(path: str) -> dict[str,]:
+    """ Load a sign parameter file <code>{"version", "type", "info"}</code> """
+    with open(path, "r", encoding="utf-8") as file:
+        argDict = load(file)
+    if not isinstance(argDict, dict) or "type" not in argDict or "info" not in argDict:
+        raise ValueError(f"Not a sign parameter file: {path}")
+    return argDict
+
+def collectFiles(paths: list[str]) -> list[str]:
+    """ Get the parameter files from directories, manifests (json list or text lines) and parameter files """
+    fileList = []
+    for path in paths:
+        if os.path.isdir(path):
+            fileList += [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(".json")]
+        elif path.lower().endswith(".json"):
+            with open(path, "r", encoding="utf-8") as file:
+                content = load(file)
+            if isinstance(content, list):
+                fileList += [os.path.join(os.path.dirname(path), str(name)) for name in content]
+            else:
+                fileList.append(path)
+        else:
+            with open(path, "r", encoding="utf-8") as file:
+                fileList += [os.path.join(os.path.dirname(path), line.strip()) for line in file if line.strip() != "" and not line.startswith("#")]
+    return fileList
+
+def finishPinyin(result: tuple[str, str|None, float, str|None]) -> tuple[str, str|None, float, str|None]:
+    """ Save the new transliterations of a rendered sign to the pinyin table (dropped if it failed), return the result """
+    signGenerator = sys.modules.get("signGenerator")
+    if signGenerator is not None:
+        if result[3] is None:
+            signGenerator.savePinyin()
+        else:
+            signGenerator.discardPinyin()
+    return result
+
+def outputName(path: str) -> str:
+    """ The output file name of the parameter file without the extension (the stem of its name) """
+    return os.path.splitext(os.path.basename(path))[0]
+
+def checkOutputNames(fileList: list[str]):
+    """ Raise ValueError if the parameter files have the same output name (e.g. the same file name in different directories), they would overwrite each other """
+    pathDict: dict[str, list[str]] = {}
+    for path in fileList:
+        pathDict.setdefault(os.path.normcase(outputName(path)), []).append(path)
+    repeated = [pathList for pathList in pathDict.values() if len(pathList) > 1]
+    if len(repeated) > 0:
+        raise ValueError("Parameter files with the same output name: " + "; ".join([", ".join(pathList) for pathList in repeated]) + " (rename them or render them to different directories)")
+
+def renderFile(path: str, outDir: str, scale: int = 10, format: str = "png", tile: int = 0, supersample: int = 1, cacheDir: str|None = None, cacheBytes: int = 1024 * 1024 * 1024, threads: int = 1) -> tuple[str, str|None, float, str|None]:
+    """
+        <h4>Render a parameter file to png (or tif / svg / pdf), return <code>(path, output path, seconds, error)</code></h4>
+        <p>By tiles of the pixel size if tile, painted at supersample times the size and downsampled once if supersample > 1 (laid out at scale), painted by bands with threads if threads > 1</p>
+        <p>A png of the same type, info and scale is copied from the render cache in cacheDir if given (whole canvas only)</p>
+    """
+    start = time.perf_counter()
+    try:
+        argDict = loadArgs(path)
+        os.makedirs(outDir, exist_ok=True)
+        outPath = os.path.join(outDir, outputName(path) + "." + format)
+        if format in ("svg", "pdf"):
+            from signVector import saveVector
+            saveVector(createLayout(argDict["type"], argDict["info"], scale), outPath, scale)
+            return finishPinyin((path, outPath, time.perf_counter() - start, None))
+        if tile > 0 or format == "tif":
+            from signTiled import saveTiled
+            saveTiled(createLayout(argDict["type"], argDict["info"], scale), outPath, scale, tile if tile > 0 else 512)
+            return finishPinyin((path, outPath, time.perf_counter() - start, None))
+        cache, key = None, None
+        if cacheDir is not None and format == "png":
+            from signCache import renderKey
+            cache = getRenderCache(cacheDir, cacheBytes)
+            key = renderKey(SIGN_TYPES[argDict["type"]][1] if argDict["type"] in SIGN_TYPES else argDict["type"], argDict["info"], scale, supersample=supersample)
+            cachePath = cache.getFile(key)
+            if cachePath is not None:
+                shutil.copyfile(cachePath, outPath)
+                return finishPinyin((path, outPath, time.perf_counter() - start, None))
+        if supersample > 1:
+            from signDisplay import renderSupersampled
+            sign = createLayout(argDict["type"], argDict["info"], scale).scaledCopy(scale)
+            renderSupersampled(sign, supersample)
+        elif threads > 1:
+            from signDisplay import renderParallel
+            sign = createLayout(argDict["type"], argDict["info"], scale).scaledCopy(scale)
+            renderParallel(sign, threads)
+        else:
+            sign = createSign(argDict["type"], argDict["info"], scale)
+        if sign.img is None:
+            raise ValueError(f"Nothing rendered for {argDict["type"]}")
+        sign.save(outPath)
+        if cache is not None:
+            cache.putFile(key, outPath)
+        return finishPinyin((path, outPath, time.perf_counter() - start, None))
+    except Exception as e:
+        return finishPinyin((path, None, time.perf_counter() - start, f"{type(e).__name__}: {e}"))
+
+class SignArchive:
+    """
+        <h4>Write the rendered signs and their parameter files to a zip or tar archive as they finish</h4>
+        <p>The kind is chosen by the extension: <code>.zip</code>, <code>.tar</code>, <code>.tar.gz</code> / <code>.tgz</code> or <code>.tar.xz</code></p>
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.names: set[str] = set()
+        lowerPath = path.lower()
+        if lowerPath.endswith(".zip"):
+            self.zip, self.tar = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED), None
+        elif lowerPath.endswith((".tar.gz", ".tgz")):
+            self.zip, self.tar = None, tarfile.open(path, "w:gz")
+        elif lowerPath.endswith(".tar.xz"):
+            self.zip, self.tar = None, tarfile.open(path, "w:xz")
+        elif lowerPath.endswith(".tar"):
+            self.zip, self.tar = None, tarfile.open(path, "w")
+        else:
+            raise ValueError(f"Unknown archive type: {path}")
+    def uniqueName(self, stem: str, extensions: list[str]) -> str:
+        """ The stem, with a number appended if a file of the stem is already in the archive """
+        name, i = stem, 1
+        while any([f"{name}.{extension}" in self.names for extension in extensions]):
+            i += 1
+            name = f"{stem}-{i}"
+        self.names.update([f"{name}.{extension}" for extension in extensions])
+        return name
+    def addFile(self, sourcePath: str, name: str):
+        """ Copy a file into the archive by chunks """
+        if self.zip is not None:
+            self.zip.write(sourcePath, name, zipfile.ZIP_STORED if os.path.splitext(name)[1][1:] in STORED_FORMATS else zipfile.ZIP_DEFLATED)
+        else:
+            self.tar.add(sourcePath, name, recursive=False)
+    def addBytes(self, data: bytes, name: str):
+        if self.zip is not None:
+            self.zip.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), data, zipfile.ZIP_DEFLATED)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size, info.mtime = len(data), int(time.time())
+            self.tar.addfile(info, io.BytesIO(data))
+    def close(self):
+        (self.zip if self.zip is not None else self.tar).close()
+
+def imageSize(path: str) -> tuple[int, int]|None:
+    """ The pixel size of a png or tif file (only the header is read), None for vector files """
+    if os.path.splitext(path)[1][1:].lower() not in STORED_FORMATS:
+        return None
+    from PIL import Image
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except OSError:
+        return None
+
+def boundedResults(executor: ProcessPoolExecutor, taskList: list[tuple], pending: int):
+    """ Submit <code>renderFile(*task)</code> for the tasks with at most pending in flight, yield the results as they finish """
+    taskIter = iter(taskList)
+    futureSet = set()
+    while True:
+        for task in taskIter:
+            futureSet.add(executor.submit(renderFile, *task))
+            if len(futureSet) >= pending:
+                break
+        if len(futureSet) == 0:
+            return
+        done, futureSet = wait(futureSet, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def renderBatch(fileList: list[str], outDir: str, scale: int = 10, workers: int|None = None, format: str = "png", tile: int = 0, supersample: int = 1, cacheDir: str|None = None, cacheBytes: int = 1024 * 1024 * 1024, threads: int = 1,
+                archive: str|None = None, manifest: bool = False, pending: int|None = None) -> list[tuple[str, str|None, float, str|None]]:
+    """
+        <h4>Render the parameter files with a process pool and print the timing of each sign</h4>
+        <p>Forked workers start from the parent warmed by <code>prewarmWorker</code> and the first sign (its glyph masks are shared copy-on-write), spawned workers warm up in the initializer</p>
+        <p>At most pending files (twice the workers by default) are submitted at once, the next ones wait for the results to be taken</p>
+        <p>With archive, each finished sign and its parameter json are moved into the zip / tar archive (outDir is not used), only the pending signs are on disk then (each in its own staging directory, the file names may repeat). The manifest <code>manifest.json</code> lists the size and the render time of each sign</p>
+        <p>Without archive, ValueError is raised before rendering if two files have the same output name</p>
+    """
+    results = []
+    manifestList = []
+    executor = None
+    signArchive = None
+    stagingDir = None
+    if archive is not None:
+        if os.path.dirname(archive) != "":
+            os.makedirs(os.path.dirname(archive), exist_ok=True)
+        signArchive = SignArchive(archive)
+        stagingDir = tempfile.TemporaryDirectory(prefix=".signBatch-", dir=os.path.dirname(os.path.abspath(archive)))
+        outDir = stagingDir.name
+    else:
+        checkOutputNames(fileList)
+        os.makedirs(outDir, exist_ok=True)
+    taskList = [(path, outDir if signArchive is None else os.path.join(outDir, str(i)), scale, format, tile, supersample, cacheDir, cacheBytes, threads) for i, path in enumerate(fileList)]
+    try:
+        if workers == 1 or len(fileList) <= 1:
+            resultIter = (renderFile(*task) for task in taskList)
+        else:
+            firstResults = []
+            if multiprocessing.get_start_method() == "fork":
+                prewarmWorker()
+                firstResults.append(renderFile(*taskList[0]))
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=prewarmWorker)
+            resultIter = chain(firstResults, boundedResults(executor, taskList[len(firstResults):], pending or 2 * (workers or os.cpu_count() or 1)))
+        for i, result in enumerate(resultIter):
+            path, outPath, seconds, error = result
+            if signArchive is not None and error is None:
+                name = signArchive.uniqueName(outputName(path), [format, "json"])
+                size = os.path.getsize(outPath)
+                pixelSize = imageSize(outPath) if manifest else None
+                try:
+                    argDict = loadArgs(path)
+                    signArchive.addFile(outPath, f"{name}.{format}")
+                    signArchive.addBytes(dumps(argDict).encode("utf-8"), f"{name}.json")
+                finally:
+                    os.remove(outPath)
+                    os.rmdir(os.path.dirname(outPath))
+                outPath = f"{archive}:{name}.{format}"
+                result = (path, outPath, seconds, error)
+                manifestList.append({"source": path, "name": f"{name}.{format}", "parameters": f"{name}.json", "type": argDict["type"], "bytes": size, "seconds": round(seconds, 3)})
+                if pixelSize is not None:
+                    manifestList[-1]["width"], manifestList[-1]["height"] = pixelSize
+            elif signArchive is not None:
+                manifestList.append({"source": path, "error": error, "seconds": round(seconds, 3)})
+            if error is None:
+                print(f"[{i + 1}/{len(fileList)}] {path} -> {outPath} ({seconds:.3f}s)")
+            else:
+                print(f"[{i + 1}/{len(fileList)}] {path} failed ({seconds:.3f}s): {error}")
+            results.append(result)
+        if signArchive is not None and manifest:
+            signArchive.addBytes(dumps({"scale": scale, "format": format, "signs": manifestList}, ensure_ascii=False, indent=1).encode("utf-8"), "manifest.json")
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if signArchive is not None:
+            signArchive.close()
+            stagingDir.cleanup()
+    return results
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(description="Render sign parameter files (saved by the GUI) to png, tif, svg or pdf without Qt")
+    parser.add_argument("inputs", nargs="+", help="parameter files, directories of them, or manifests (json list / one path per line)")
+    parser.add_argument("-o", "--output", default=".", help="output directory")
+    parser.add_argument("-s", "--scale", type=int, default=10, help="pixels per unit (the coordinate precision of svg / pdf)")
+    parser.add_argument("-f", "--format", choices=["png", "tif", "svg", "pdf"], default="png", help="output format, svg and pdf are drawn without a canvas, tif is tiled (needs tifffile)")
+    parser.add_argument("-t", "--tile", type=int, default=0, help="render by tiles of the pixel size and stream the rows to the file (0: whole canvas)")
+    parser.add_argument("-a", "--supersample", type=int, default=1, help="paint png at this factor of the size and downsample once (the same layout and text, antialiased shapes)")
+    parser.add_argument("-c", "--cache", help="render cache directory, unchanged png signs are copied from it instead of rendered")
+    parser.add_argument("--cache-size", type=int, default=1024, help="size limit of the render cache in MiB (least recently used files are removed)")
+    parser.add_argument("-p", "--threads", type=int, default=1, help="paint each png by bands with this many threads (for a few large signs, use workers for many signs)")
+    parser.add_argument("-z", "--archive", help="write the signs and their parameter files to this zip / tar (.tar.gz, .tar.xz) archive as they finish, instead of the output directory")
+    parser.add_argument("-m", "--manifest", action="store_true", help="add manifest.json with the size and the render time of each sign to the archive")
+    parser.add_argument("--pending", type=int, default=0, help="number of signs submitted to the workers at once (0: twice the workers)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    args = parser.parse_args(argv)
+    fileList = collectFiles(args.inputs)
+    start = time.perf_counter()
+    if args.archive is None:
+        try:
+            checkOutputNames(fileList)
+        except ValueError as e:
+            parser.error(str(e))
+    results = renderBatch(fileList, args.output, args.scale, max(1, args.workers or 1), args.format, args.tile, max(1, args.supersample), args.cache, args.cache_size * 1024 * 1024, max(1, args.threads),
+                          args.archive, args.manifest, max(0, args.pending) or None)
+    failed = sum([1 for result in results if result[3] is not None])
+    print(f"Rendered {len(results) - failed}/{len(results)} signs in {time.perf_counter() - start:.3f}s (render time {sum([result[2] for result in results]):.3f}s)")
+    return 1 if failed > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+import argparse
+import cProfile
+import contextlib
+import os
+import platform
+import pstats
+import sys
+import time
+import tracemalloc
+from json import dump, load
+
+import numpy as np
+import PIL
+import signTemplate
+import textGenerator
+from signBatch import SIGN_TYPES, getSignClass
+
+PLACES = ["合肥", "庐江", "巢湖", "马鞍山", "芜湖", "六安", "安庆", "铜陵", "池州", "黄山", "滁州", "蚌埠"]
+""" Canned place names """
+ROADS = ["G3#NH", "S226#NW", "G4201#NH", "长江路#B", "G206#NW", "S22#NH"]
+""" Canned road numbers and boxed names """
+
+def places(count: int, start: int = 0, sep: str = " ") -> str:
+    """ Join the canned place names """
+    return sep.join([PLACES[(start + i) % len(PLACES)] for i in range(count)])
+
+def buildCases() -> dict[str, dict[str, list[tuple[str,]]]]:
+    """ The <code>(key, value)</code> settings of each sign type and text load (<code>"small"</code>, <code>"medium"</code>, <code>"large"</code>) """
+    cases: dict[str, dict[str, list[tuple[str,]]]] = {}
+    loads = {"small": 1, "medium": 3, "large": 6}
+    headings = [-6, -3, 0, 3, 6, 9]
+    arrows = ["←", "↖", "↑", "↗", "→", "↱"]
+    laneArrows = [{"↶": True, "↰": True, "↑": False, "↱": False}, {"↶": False, "↰": False, "↑": True, "↱": False}, {"↶": False, "↰": False, "↑": True, "↱": True}]
+    for level, (load_, n) in enumerate(loads.items()):
+        cases.setdefault("环岛式", {})[load_] = [("english scale", 0.5), ("direction", "北"), ("crossing name", places(1, n) + "路口"), ("num", n)] + \
+            [(f"direction{i + 1}", {"heading": headings[i], "text": places(1 + i % 2, i) + ("#D北" if i == 0 else ""), "textEn": "Hefei", "next": ROADS[i % len(ROADS)] if i % 2 == 0 else ""}) for i in range(n)]
+        cases.setdefault("堆叠式", {})[load_] = [("english scale", 0.4), ("num", n)] + \
+            [(f"direction{i + 1}", {"arrow": arrows[i], "text": places(1, i) + " " + ROADS[i % len(ROADS)], "textEn": "Changjiang Rd."}) for i in range(n)]
+        cases.setdefault("分向行驶", {})[load_] = [("num", n + 1)] + [(f"line{i + 1}", laneArrows[i % len(laneArrows)]) for i in range(n + 1)]
+        cases.setdefault("车道预告", {})[load_] = [("num", n + 1)] + \
+            [(f"line{i + 1}", dict(laneArrows[i % len(laneArrows)], text=places(1, i), textEn="")) for i in range(n + 1)]
+        cases.setdefault("入口预告", {})[load_] = [("No", " ".join([road.split("#", 1)[0] for road in ROADS[:n]])), ("distance", "500m")]
+        cases.setdefault("出口方向", {})[load_] = [("direction", "北"), ("arrow", "↱"), ("distance", "1km"), ("text", "\\n".join([places(1, i) + (" " + ROADS[0] if i == 0 else "") for i in range(n)]))]
+        cases.setdefault("出口编号", {})[load_] = [("No", ["3", "125A", "2101B"][level])]
+        cases.setdefault("高速编号", {})[load_] = [("No", ["G3", "G4201", "S22#NHH"][level]), ("name", places(1, n) + "绕城" if n > 1 else "")]
+        cases.setdefault("道路编号", {})[load_] = [("text", ["S22", "G206", "S1226"][level])]
+        cases.setdefault("辅助标牌", {})[load_] = [("text", "\\n".join(["前方施工", "减速慢行#TT", "Slow Down 123.45km", "注意安全", "车辆慢行#Tt", "Drive Carefully"][:n]))]
+        cases.setdefault("通用标牌", {})[load_] = [("layers", 2 * n)] + [(f"layer{2 * i + 1}", {"priority": 0, "x": 30, "y": 40 + 70 * i, "type": "text", "text": places(2, i) + " " + ROADS[i % len(ROADS)], "height": 50, "textType": "A", "gap": 0.1}) for i in range(n)] + \
+            [(f"layer{2 * i + 2}", {"priority": 0, "x": 450, "y": 40 + 70 * i, "type": "arrowS", "arrowS": arrows[i], "width": 50, "height": 50, "color": "W"}) for i in range(n)]
+    return cases
+
+CASES = buildCases()
+
+def clearCaches():
+    """ Clear every cache registered by the loaded modules (<code>textGenerator.registerCache</code>) """
+    textGenerator.clearCaches()
+
+def createSign(signType: str, settings: list[tuple[str,]], scale: int):
+    """ Create the sign and set the settings without drawing """
+    sign = getSignClass(signType)(scale)
+    for key, value in settings:
+        sign.autoSet(key, value, False)
+    return sign
+
+def timeRender(sign, cold: bool) -> float:
+    """ The seconds of one <code>update()</code> """
+    if cold:
+        clearCaches()
+    start = time.perf_counter()
+    sign.update()
+    return time.perf_counter() - start
+
+def measureCase(signType: str, load_: str, scale: int, cold: bool, repeat: int = 5, top: int = 15) -> dict[str,]:
+    """ Measure the wall time, peak memory and call counts of a case (the warnings printed while drawing are hidden) """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return measureRenders(signType, load_, scale, cold, repeat, top)
+
+def measureRenders(signType: str, load_: str, scale: int, cold: bool, repeat: int = 5, top: int = 15) -> dict[str,]:
+    settings = CASES[signType][load_]
+    sign = createSign(signType, settings, scale)
+    if not cold:
+        sign.update()
+    times = [timeRender(sign, cold) for _ in range(repeat)]
+    # Peak memory of one render (traced separately to keep the timing clean)
+    if cold:
+        clearCaches()
+    tracemalloc.start()
+    sign.update()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Call counts of the repo functions
+    if cold:
+        clearCaches()
+    profile = cProfile.Profile()
+    profile.runcall(sign.update)
+    stats = pstats.Stats(profile).stats
+    resourceDir = os.path.dirname(os.path.abspath(__file__))
+    calls = {f"{os.path.basename(file)}:{func}": value[1] for (file, _, func), value in stats.items() if os.path.dirname(os.path.abspath(file)) == resourceDir}
+    return {
+        "type": signType,
+        "class": SIGN_TYPES[signType][1],
+        "load": load_,
+        "scale": scale,
+        "cache": "cold" if cold else "warm",
+        "size": list(sign.img.size) if sign.img is not None else None,
+        "times": times,
+        "min": min(times),
+        "median": float(np.median(times)),
+        "peakMemory": peak,
+        "totalCalls": sum([value[1] for value in stats.values()]),
+        "calls": dict(sorted(calls.items(), key=lambda item: -item[1])[:top]),
+    }
+
+def caseName(result: dict[str,]) -> str:
+    return f"{result["class"]}/{result["load"]}/x{result["scale"]}/{result["cache"]}"
+
+def compareResults(results: list[dict[str,]], baseline: list[dict[str,]], threshold: float = 1.2) -> list[str]:
+    """ Get the cases whose median time is more than threshold times of the baseline """
+    baseDict = {caseName(result): result for result in baseline}
+    slowList = []
+    for result in results:
+        base = baseDict.get(caseName(result))
+        if base is not None and result["median"] > base["median"] * threshold:
+            slowList.append(f"{caseName(result)}: {base["median"] * 1000:.1f}ms -> {result["median"] * 1000:.1f}ms")
+    return slowList
+
+def checkCacheKey() -> list[str]:
+    """ Signs differing only outside the info (the sharp tag of the number, a constructor setting) get different render keys """
+    from signCache import signKey
+    errors = []
+    plain, tagged = createSign("高速编号", [("No", "G1501")], 3), createSign("高速编号", [("No", "G1501#NHH")], 3)
+    if plain.info != tagged.info or signKey(plain) == signKey(tagged):
+        errors.append(f"G1501 and G1501#NHH: same info {plain.info == tagged.info}, same key {signKey(plain) == signKey(tagged)}")
+    plain.update()
+    tagged.update()
+    if plain.img.size == tagged.img.size:
+        errors.append(f"G1501 and G1501#NHH render at the same size {plain.img.size}")
+    small, large = getSignClass("辅助标牌")(3, 30, info={"text": "前方施工"}), getSignClass("辅助标牌")(3, 40, info={"text": "前方施工"})
+    if signKey(small) == signKey(large):
+        errors.append("AidSign text_height 30 and 40: same key")
+    return errors
+
+def checkVectorOutline(tolerance: float = 1.5) -> list[str]|None:
+    """ The vector outline of a text covers the same box as its raster mask (within the tolerance, the stroke and the thinning of the mask the outline cannot follow), None without fontTools """
+    import signVector
+    if signVector.TTFont is None:
+        return None
+    errors = []
+    for text, font_type, height in [("G15", "B", 100), ("S226", "C", 60), ("合肥", "A", 100), ("Exit 12", "A", 40)]:
+        commands, stroke = signVector.buildOutline(text, font_type, height, None, 4)
+        xs = [value for command in commands for value in command[1::2]]
+        ys = [value for command in commands for value in command[2::2]]
+        size = height * 4
+        current = textGenerator.tableStrokeWidth(text, font_type, size) if textGenerator.strokeTableEnabled else None
+        if current is None:
+            current = textGenerator.strokeWidth(textGenerator.rasterizeText(text, textGenerator.getFont(font_type, size), size))
+        target = signVector.STROKE_RATIOS[font_type] * size
+        thinning = max(1, min(int((current - target) / 2), 15)) * height / size if current > target else 0
+        mask = textGenerator.generateFontMaskArray(text, font_type, height)
+        rows, cols = np.nonzero(mask.max(1) > 127)[0], np.nonzero(mask.max(0) > 127)[0]
+        outlineBox = (min(xs), min(ys), max(xs), max(ys))
+        maskBox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+        if any([abs(a - b) > tolerance + stroke + thinning for a, b in zip(outlineBox, maskBox)]):
+            errors.append(f"{text} {font_type} {height}: outline {tuple([round(value, 1) for value in outlineBox])}, mask {maskBox}")
+    return errors
+
+def checkTiled(size: int = 64, scale: int = 3) -> list[str]:
+    """ Every case painted by small tiles (<code>signTiled.iterBands</code>) is the same as <code>update()</code> """
+    from signTiled import iterBands, recordSign
+    errors = []
+    for signType, loads in CASES.items():
+        for load_, settings in loads.items():
+            sign = createSign(signType, settings, scale)
+            sign.update()
+            if sign.img is None:
+                continue
+            expected = np.asarray(sign.img)
+            tiled = np.empty_like(expected)
+            for y, band in iterBands(recordSign(sign), size):
+                tiled[y: y + band.shape[0]] = band
+            diff = np.nonzero(np.any(tiled != expected, axis=2))
+            if len(diff[0]) > 0:
+                errors.append(f"{SIGN_TYPES[signType][1]}/{load_}/x{scale}: {len(diff[0])} pixels differ, the first at ({diff[1][0]}, {diff[0][0]})")
+    return errors
+
+def checkColdCaches(scale: int = 3) -> list[str]:
+    """ <code>clearCaches</code> removes the sprites of the arrows (<code>signTemplate.arrowCached</code>) with the other sprites, and a cold render is the same as a warm one """
+    arrowNames = set([name for name, value in vars(signTemplate.Sign).items() if getattr(value, "__wrapped__", None) is not None and name.startswith("draw") and "Arrow" in name])
+    countArrows = lambda: len([key for key in signTemplate.spriteCache.keys() if key[0] in arrowNames])
+    errors = []
+    for signType in ["分向行驶", "车道预告", "堆叠式"]:
+        sign = createSign(signType, CASES[signType]["large"], scale)
+        sign.update()
+        sign.update()
+        warm, warmCount = np.asarray(sign.img).copy(), countArrows()
+        clearCaches()
+        if warmCount == 0 or countArrows() > 0:
+            errors.append(f"{SIGN_TYPES[signType][1]}: {warmCount} arrow sprites when warm, {countArrows()} after clearCaches")
+        sign.update()
+        if not np.array_equal(np.asarray(sign.img), warm):
+            errors.append(f"{SIGN_TYPES[signType][1]}: the cold render differs from the warm one")
+    return errors
+
+def checkSupersampled(factor: int = 2, scale: int = 3, size: int = 64, tolerance: float = 8) -> list[str]:
+    """ Every case by <code>signDisplay.renderSupersampled</code> has the size of <code>update()</code>, the same pixels away from the shape edges and a mean difference below tolerance near them """
+    from signDisplay import layoutSign, renderSupersampled
+    errors = []
+    for signType, loads in CASES.items():
+        for load_, settings in loads.items():
+            sign = createSign(signType, settings, scale)
+            sign.update()
+            if sign.img is None:
+                continue
+            expected = np.asarray(sign.img).astype(np.int16)
+            supersampled = createSign(signType, settings, scale)
+            renderSupersampled(supersampled, factor)
+            name = f"{SIGN_TYPES[signType][1]}/{load_}/x{scale}"
+            if supersampled.img is None or supersampled.img.size != sign.img.size:
+                errors.append(f"{name}: {None if supersampled.img is None else supersampled.img.size} instead of {sign.img.size}")
+                continue
+            edges = np.repeat(np.repeat(layoutSign(sign).edgeTiles(size), size, 0), size, 1)[: expected.shape[0], : expected.shape[1]]
+            diff = np.abs(np.asarray(supersampled.img).astype(np.int16) - expected).max(axis=2)
+            if diff[~edges].any():
+                errors.append(f"{name}: {np.count_nonzero(diff[~edges])} pixels away from the shape edges differ")
+            elif edges.any() and diff[edges].mean() > tolerance:
+                errors.append(f"{name}: mean difference {diff[edges].mean():.2f} near the shape edges")
+    return errors
+
+CHECKS = {"cacheKey": checkCacheKey, "vectorOutline": checkVectorOutline, "tiled": checkTiled, "coldCaches": checkColdCaches, "supersampled": checkSupersampled}
+""" The consistency checks run by <code>--check</code>, each returns the error messages (None if skipped) """
+
+def runChecks(names: list[str]) -> int:
+    """ Run the checks and print the errors, return the number of failed checks """
+    failed = 0
+    for name in names:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            errors = CHECKS[name]()
+        print(f"{name}: {"skipped" if errors is None else "ok" if len(errors) == 0 else "FAILED"}")
+        for error in errors or []:
+            print("   ", error)
+        failed += errors is not None and len(errors) > 0
+    return failed
+
+def main(argv: list[str]|None = None):
+    parser = argparse.ArgumentParser(description="Benchmark the rendering of every sign type")
+    parser.add_argument("-t", "--types", nargs="+", default=list(CASES.keys()), choices=list(CASES.keys()), help="sign type names")
+    parser.add_argument("-l", "--loads", nargs="+", default=["small", "medium", "large"], choices=["small", "medium", "large"], help="text loads")
+    parser.add_argument("-s", "--scales", nargs="+", type=int, default=[2, 5, 10], help="pixels per unit")
+    parser.add_argument("-c", "--cache", choices=["cold", "warm", "both"], default="both", help="clear the caches before each render (cold) or not (warm)")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="timed renders of each case")
+    parser.add_argument("-o", "--output", help="write the results to the json file")
+    parser.add_argument("--compare", help="baseline json to compare the median times with")
+    parser.add_argument("--threshold", type=float, default=1.2, help="slowdown ratio reported as a regression")
+    parser.add_argument("--check", nargs="*", choices=list(CHECKS.keys()), help="run the consistency checks (all by default) instead of the benchmark")
+    args = parser.parse_args(argv)
+    if args.check is not None:
+        return 1 if runChecks(args.check or list(CHECKS.keys())) > 0 else 0
+    coldList = {"cold": [True], "warm": [False], "both": [True, False]}[args.cache]
+    results = []
+    for signType in args.types:
+        for load_ in args.loads:
+            for scale in args.scales:
+                for cold in coldList:
+                    result = measureCase(signType, load_, scale, cold, max(1, args.repeat))
+                    results.append(result)
+                    print(f"{caseName(result)}: median {result["median"] * 1000:.1f}ms, min {result["min"] * 1000:.1f}ms, peak {result["peakMemory"] / 2**20:.1f}MiB, {result["totalCalls"]} calls")
+    report = {
+        "meta": {"python": sys.version.split()[0], "platform": platform.platform(), "numpy": np.__version__, "pillow": PIL.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            dump(report, file, ensure_ascii=False, indent=1)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            slowList = compareResults(results, load(file)["results"], args.threshold)
+        for slow in slowList:
+            print("Slower:", slow)
+        return 1 if len(slowList) > 0 else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
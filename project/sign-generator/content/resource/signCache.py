@@ -0,0 +1,224 @@
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from json import dumps
+
+import cv2
+import numpy as np
+import PIL
+from PIL import Image
+import textGenerator
+from textGenerator import FONT_FILES, LRUCache, getFilePath
+from signDisplay import layoutKey
+from signTemplate import Sign
+
+RENDERER_FILES = ["signTemplate.py", "textGenerator.py", "signGenerator.py", "signGeneral.py", "signDisplay.py"]
+""" The code drawing the signs, the cached images are invalid when any of them changes """
+_versionLock = threading.Lock()
+_fileHashes: dict[tuple[str, int, int], str] = {}
+_rendererVersion: str|None = None
+
+def fileHash(path: str) -> str:
+    """ The sha256 of the file, computed once for each size and modification time """
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _fileHashes.get(key)
+    if digest is None:
+        with open(path, "rb") as file:
+            digest = hashlib.file_digest(file, "sha256").hexdigest()
+        _fileHashes[key] = digest
+    return digest
+
+def rendererVersion() -> str:
+    """ The hash of the renderer code, the font files and the versions of the raster libraries """
+    global _rendererVersion
+    with _versionLock:
+        if _rendererVersion is None:
+            parts = [f"{name}:{fileHash(getFilePath(name))}" for name in RENDERER_FILES if os.path.exists(getFilePath(name))]
+            parts += [f"font{font_type}:{fileHash(getFilePath(name))}" for font_type, name in sorted(FONT_FILES.items()) if os.path.exists(getFilePath(name))]
+            parts += [f"PIL:{PIL.__version__}", f"cv2:{cv2.__version__}", f"numpy:{np.__version__}"]
+            _rendererVersion = hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+        return _rendererVersion
+
+def renderKey(className: str, info: dict[str,], scale: int, **options) -> str:
+    """ The content address of a render: the hash of the sign class, the canonical info, the scale, the options, <code>textGenerator.strokeTableEnabled</code> and <code>rendererVersion()</code> <p>Enough for a sign created from the info alone (a parameter file), see <code>signKey</code> for a sign changed by its setters</p> """
+    content = dumps({"class": className, "info": info, "scale": scale, "options": options, "strokeTable": textGenerator.strokeTableEnabled, "renderer": rendererVersion()},
+                    sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def signKey(sign: Sign, **options) -> str:
+    """ The content address of the sign drawn by <code>update()</code> with its current info and the plain settings outside the info (e.g. the sharp tags of the number, the colors), the same as <code>signDisplay.layoutKey</code> <p>Computed before drawing, the values set by the drawing (e.g. a width from the text) only make it miss</p> """
+    return renderKey(type(sign).__name__, sign.info, sign.scale, settings=layoutKey(sign)[2], **options)
+
+class RenderCache:
+    """
+        <h4>Rendered sign images addressed by <code>renderKey</code></h4>
+        <p>The PNG files on disk are bounded by bytes and evicted by the last use (the modification time), the decoded RGBA arrays are kept in memory in front of them</p>
+        <p>Several processes can share the directory, a file is written to a temporary name and renamed. Without a directory the images are only kept in memory</p>
+    """
+    def __init__(self, directory: str|None = None, maxBytes: int = 1024 * 1024 * 1024, memoryBytes: int = 256 * 1024 * 1024, background: bool = False, maxPending: int = 4):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.memory = LRUCache(None, memoryBytes, lambda canvas: canvas.nbytes)
+        """ The RGBA arrays (read-only) keyed by the render key """
+        self.bytes: int|None = None
+        """ The bytes of the files on disk, scanned on the first write """
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(1) if background else None
+        self.maxPending = maxPending
+        """ The most images waiting for the background writer, the oldest one is not written if more are added """
+        self._pending: dict[str, np.ndarray] = {}
+        self._draining = False
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".png")
+    def getFile(self, key: str) -> str|None:
+        """ The cached PNG file of the key (marked as recently used), None if not cached """
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+    def get(self, key: str) -> np.ndarray|None:
+        """ The cached RGBA array of the key, None if not cached """
+        canvas = self.memory.get(key)
+        if canvas is None:
+            path = self.getFile(key)
+            if path is not None:
+                try:
+                    with Image.open(path) as img:
+                        canvas = np.asarray(img.convert("RGBA"))
+                except OSError:
+                    canvas = None  # Removed by another process or cut by an interrupted write
+            if canvas is not None:
+                self.memory.put(key, canvas)
+        with self._lock:
+            if canvas is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return canvas
+    def put(self, key: str, img: Image.Image):
+        """ Add the rendered image, the PNG is written in the background if the cache is created with background (at most <code>maxPending</code> waiting, the oldest ones are only kept in memory) """
+        canvas = np.array(img.convert("RGBA"))
+        canvas.setflags(write=False)
+        self.memory.put(key, canvas)
+        if self.directory is None:
+            return
+        if self._writer is None:
+            self.write(key, canvas)
+            return
+        with self._lock:
+            self._pending.pop(key, None)
+            self._pending[key] = canvas
+            while len(self._pending) > max(1, self.maxPending):
+                self._pending.pop(next(iter(self._pending)))
+            if self._draining:
+                return
+            self._draining = True
+        self._writer.submit(self.drain)
+    def drain(self):
+        """ Write the pending images in the background, oldest first """
+        while True:
+            with self._lock:
+                if len(self._pending) == 0:
+                    self._draining = False
+                    return
+                key = next(iter(self._pending))
+                canvas = self._pending.pop(key)
+            self.write(key, canvas)
+    def putFile(self, key: str, path: str):
+        """ Add a PNG file already written (copied, not decoded) """
+        self.store(key, lambda tempPath: shutil.copyfile(path, tempPath))
+    def write(self, key: str, canvas: np.ndarray):
+        self.store(key, lambda tempPath: Image.fromarray(canvas, "RGBA").save(tempPath, "PNG"))
+    def store(self, key: str, writeFile):
+        """ Write the file of the key by <code>writeFile(temporary path)</code> and evict the old files (ignored on read-only installs or without a directory) """
+        if self.directory is None:
+            return
+        path = self.path(key)
+        tempPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            writeFile(tempPath)
+            os.replace(tempPath, path)
+            size = os.path.getsize(path)
+        except OSError:
+            try:
+                os.remove(tempPath)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if self.bytes is None:
+                self.bytes = sum([size for _, size, _ in self.files()])
+            else:
+                self.bytes += size
+            if self.bytes > self.maxBytes:
+                self.evict()
+    def files(self) -> list[tuple[str, int, float]]:
+        """ The cached files <code>(path, bytes, last use)</code> """
+        fileList = []
+        if self.directory is None:
+            return fileList
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".png"):
+                    try:
+                        stat = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    fileList.append((os.path.join(root, name), stat.st_size, stat.st_mtime))
+        return fileList
+    def evict(self):
+        """ Remove the least recently used files until the directory fits in 90% of <code>maxBytes</code> (rescanned, other processes may share it) """
+        fileList = sorted(self.files(), key=lambda item: item[2])
+        self.bytes = sum([size for _, size, _ in fileList])
+        for path, size, _ in fileList:
+            if self.bytes <= self.maxBytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                self.bytes -= size
+            except OSError:
+                pass
+    def flush(self):
+        """ Wait for the background writes """
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+    def clear(self):
+        """ Remove all the cached images """
+        self.flush()
+        self.memory.clear()
+        with self._lock:
+            if self.directory is not None:
+                shutil.rmtree(self.directory, ignore_errors=True)
+            self.bytes = 0
+    def stats(self) -> dict[str,]:
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.bytes, "memory": self.memory.stats()}
+
+def loadCached(sign: Sign, cache: RenderCache, key: str|None = None) -> bool:
+    """ Copy the cached render of the key (<code>signKey</code> by default) to the canvas of the sign, return False if not cached <p>The sign has no <code>baseCanvas</code> then, a partial refresh should draw the whole sign</p> """
+    canvas = cache.get(signKey(sign) if key is None else key)
+    if canvas is None:
+        return False
+    sign.newCanvas((canvas.shape[1], canvas.shape[0]))
+    if sign.canvas is not None:
+        sign.canvas[:] = canvas
+    return True
+
+def updateCached(sign: Sign, cache: RenderCache) -> bool:
+    """ Draw the sign by <code>update()</code> and add it to the cache, or copy the cached render (return True) """
+    key = signKey(sign)
+    if loadCached(sign, cache, key):
+        return True
+    sign.update()
+    if sign.canvas is not None:
+        cache.put(key, sign.img)
+    return False
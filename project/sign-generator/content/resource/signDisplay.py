@@ -0,0 +1,389 @@
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+from json import dumps
+from math import floor, ceil
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw
+import textGenerator
+from textGenerator import LRUCache, registerCache, getColor, fontMaskSize, generateFontMaskArray, renderFontMask, maskCache, pasteMask, placeTextRun, downsampleArea
+from signTemplate import Sign, flatXY, isOverlap, unionBox
+
+SUPERSAMPLE_HEIGHT = 512
+""" Taller text masks are rasterized with less supersampling (the glyph edges are already smooth at this size) """
+MAX_MASK_HEIGHT = 2048
+""" Taller text masks are rasterized at this height and enlarged, so that huge text does not need a huge raster """
+
+def shiftXY(flat: list[float], origin: tuple[int, int]) -> list[float]:
+    x0, y0 = origin
+    if x0 == 0 and y0 == 0:
+        return flat
+    return [value - (x0 if i % 2 == 0 else y0) for i, value in enumerate(flat)]
+
+def pointsBox(flat: list[float], pad: float = 1) -> tuple[int, int, int, int]:
+    """ The pixel bounding box of the points <code>[x0, y0, x1, y1, ...]</code> """
+    xList = flat[0::2]
+    yList = flat[1::2]
+    return (floor(min(xList) - pad), floor(min(yList) - pad), ceil(max(xList) + 1 + pad), ceil(max(yList) + 1 + pad))
+
+def textMask(text: str, font_type: str, font_height: float, maxLen: int|None = None, large: bool = True) -> np.ndarray:
+    """ The text mask, the tall ones are rasterized with less supersampling and enlarged from <code>MAX_MASK_HEIGHT</code> if large (otherwise the same as <code>update()</code>) """
+    height = round(font_height)
+    if height <= SUPERSAMPLE_HEIGHT or not large:
+        return generateFontMaskArray(text, font_type, font_height, maxLen=maxLen)
+    key = ("large", text, font_type, height, maxLen, textGenerator.strokeTableEnabled)
+    mask = maskCache.get(key)
+    if mask is None:
+        size = fontMaskSize(text, font_type, height, maxLen=maxLen)
+        maskHeight = min(height, MAX_MASK_HEIGHT)
+        mask = renderFontMask(text, font_type, maskHeight, max(1, 4 * SUPERSAMPLE_HEIGHT // maskHeight), None if maxLen is None else max(1, round(maxLen * maskHeight / height)))
+        if mask.shape != size:
+            mask = cv2.resize(mask, (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+        mask.setflags(write=False)
+        maskCache.put(key, mask)
+    return mask
+
+def isInside(box: tuple[int, int, int, int], region: tuple[int, int, int, int]) -> bool:
+    return region[0] <= box[0] and region[1] <= box[1] and box[2] <= region[2] and box[3] <= region[3]
+
+def drawItem(draw: ImageDraw.ImageDraw, item: tuple, origin: tuple[int, int], fill = None, outline = None):
+    """ Draw the shape item relative to origin (with other colors if given) """
+    kind, _, *args = item
+    if kind == "arc":
+        xy, start, end, itemFill, lineWidth = args
+        draw.arc(shiftXY(xy, origin), start, end, itemFill if fill is None else fill, lineWidth)
+    elif kind == "circle":
+        xy, radius, itemFill, itemOutline, lineWidth = args
+        draw.circle(shiftXY(xy, origin), radius, itemFill if fill is None or itemFill is None else fill, itemOutline if outline is None or itemOutline is None else outline, lineWidth)
+    else:
+        xy, itemFill, itemOutline, lineWidth = args
+        if kind == "rectangle" and origin != (0, 0):
+            # PIL truncates the rectangle coordinates toward zero, truncate them before the shift like the full render
+            xy = [int(value) for value in xy]
+        getattr(draw, kind)(shiftXY(xy, origin), itemFill if fill is None or itemFill is None else fill, itemOutline if outline is None or itemOutline is None else outline, lineWidth)
+
+def scaleItem(item: tuple, factor: int) -> tuple:
+    """ The shape item drawn at factor times the size: the boxes cover the same pixel blocks, the points are moved to the centers of the blocks """
+    kind, box, *args = item
+    scaleBox = lambda flat: tuple([value * factor + (factor - 1 if i % 4 >= 2 else 0) for i, value in enumerate(flat)])
+    scalePoints = lambda flat: tuple([value * factor + (factor - 1) / 2 for value in flat])
+    if kind == "arc":
+        xy, start, end, fill, lineWidth = args
+        return (kind, box, scaleBox(xy), start, end, fill, lineWidth * factor)
+    if kind == "circle":
+        xy, radius, fill, outline, lineWidth = args
+        return (kind, box, scalePoints(xy), radius * factor + (factor - 1) / 2, fill, outline, lineWidth * factor)
+    xy, fill, outline, lineWidth = args
+    return (kind, box, scalePoints(xy) if kind == "polygon" else scaleBox(xy), fill, outline, lineWidth * factor)
+
+class DisplayDraw:
+    """ An <code>ImageDraw</code> replacement recording the calls to a <code>DisplayList</code> """
+    def __init__(self, displayList: "DisplayList"):
+        self.displayList = displayList
+    def rectangle(self, xy, fill=None, outline=None, width=1):
+        flat = tuple(flatXY(xy))
+        self.displayList.add("rectangle", pointsBox(flat, width), flat, fill, outline, width)
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        flat = tuple(flatXY(xy))
+        self.displayList.add("ellipse", pointsBox(flat, width), flat, fill, outline, width)
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        flat = tuple(flatXY(xy))
+        self.displayList.add("polygon", pointsBox(flat, width), flat, fill, outline, width)
+    def arc(self, xy, start, end, fill=None, width=1):
+        flat = tuple(flatXY(xy))
+        self.displayList.add("arc", pointsBox(flat, width), flat, start, end, fill, width)
+    def circle(self, xy, radius, fill=None, outline=None, width=1):
+        x, y = flatXY(xy)
+        self.displayList.add("circle", pointsBox([x - radius, y - radius, x + radius, y + radius], width), (x, y), radius, fill, outline, width)
+
+class DisplayList:
+    """
+        <h4>Record the drawing of a sign as positioned primitives and paint any region of it later</h4>
+        <p>Set it as <code>sign.backend</code> before <code>update()</code> (or use <code>layoutSign</code>), a region painted with an origin aligned to 8 pixels is the same as the full render</p>
+    """
+    def __init__(self):
+        self.size: tuple[int, int] = (0, 0)
+        self.background: tuple = (0, 0, 0, 0)
+        self.items: list[tuple]|tuple[tuple, ...] = []
+        """ <code>(kind, pixel box, *arguments)</code> in the drawing order, a tuple of hashable items once frozen """
+        self.elements: list[str|None]|tuple[str|None, ...] = []
+        """ The info key of the element drawing each item (see <code>Sign.drawElement</code>) """
+        self.element: str|None = None
+        """ The info key of the element being drawn """
+        self.shapeMasks = LRUCache(None, 64 * 1024 * 1024, lambda value: value[1].nbytes)
+        """ The unclipped masks of the shapes crossing the painted regions, keyed by the item index """
+    def begin(self, size: tuple[int, int], color: tuple = (0, 0, 0, 0)):
+        """ Start a new drawing (called by <code>Sign.newCanvas</code>) """
+        self.size = size
+        self.background = getColor(color)
+        self.items = []
+        self.elements = []
+        self.shapeMasks.clear()
+    def draw(self) -> DisplayDraw:
+        return DisplayDraw(self)
+    def add(self, kind: str, box: tuple[int, int, int, int], *args):
+        self.items.append((kind, box, *args))
+        self.elements.append(self.element)
+    def placeText(self, pos: tuple[int, int], text: str, font_type: str, font_height: float, color: tuple, maxLen: int|None = None):
+        height, width = fontMaskSize(text, font_type, font_height, maxLen=maxLen)
+        x, y = int(pos[0]), int(pos[1])
+        self.add("text", (x, y, x + width, y + height), (x, y), ((0, text),), font_type, font_height, color, maxLen)
+    def placeTextRun(self, pos: tuple[int, int], glyphList: list[tuple[int, str]], font_type: str, font_height: float, color: tuple):
+        glyphList = tuple([(dx, text) for dx, text in glyphList if len(text) > 0])
+        if len(glyphList) == 0:
+            return
+        sizeList = [(dx, fontMaskSize(text, font_type, font_height)) for dx, text in glyphList]
+        x, y = int(pos[0]), int(pos[1])
+        self.add("text", (x, y, x + max([dx + size[1] for dx, size in sizeList]), y + sizeList[0][1][0]), (x, y), glyphList, font_type, font_height, color, None)
+    def freeze(self) -> "DisplayList":
+        """ Make the items immutable after the drawing (they can be cached, compared and shared) """
+        self.items = tuple(self.items)
+        self.elements = tuple(self.elements)
+        return self
+    def diff(self, old: "DisplayList") -> list[tuple[int, int, int, int]]|None:
+        """ The pixel boxes to repaint to turn the painting of old into this one, None if the size or the background changed """
+        if old.size != self.size or old.background != self.background:
+            return None
+        boxList = []
+        for tag, i0, i1, j0, j1 in SequenceMatcher(None, old.items, self.items, autojunk=False).get_opcodes():
+            if tag != "equal":
+                box = None
+                for item in old.items[i0: i1] + self.items[j0: j1]:
+                    box = unionBox(box, item[1])
+                if box is not None:
+                    boxList.append(box)
+        return boxList
+    def repaint(self, canvas: np.ndarray, old: "DisplayList") -> list[tuple[int, int, int, int]]|None:
+        """ Update the RGBA array painted from old to this drawing by repainting the changed regions only, return the regions (None for all) """
+        boxList = self.diff(old) if canvas.shape[:2] == (self.size[1], self.size[0]) else None
+        if boxList is None:
+            self.paint(canvas)
+            return None
+        regionList = []
+        for x0, y0, x1, y1 in boxList:
+            # The origin of a region is aligned to 8 like the tiles
+            x0, y0 = max(0, x0 - x0 % 8), max(0, y0 - y0 % 8)
+            x1, y1 = min(self.size[0], x1), min(self.size[1], y1)
+            if x0 < x1 and y0 < y1:
+                canvas[y0: y1, x0: x1] = self.paint(np.empty((y1 - y0, x1 - x0, 4), np.uint8), (x0, y0))
+                regionList.append((x0, y0, x1, y1))
+        return regionList
+    def hitTest(self, x: int, y: int) -> list[tuple[int, str, str|None]]:
+        """ The items <code>(index, kind, element)</code> drawn at the pixel, the top one first """
+        hitList = []
+        for index in range(len(self.items) - 1, -1, -1):
+            kind, box, *_ = self.items[index]
+            if not (box[0] <= x < box[2] and box[1] <= y < box[3]):
+                continue
+            if kind not in ("text", "rectangle"):
+                (x0, y0), mask = self.shapeMask(index)
+                if not (0 <= y - y0 < mask.shape[0] and 0 <= x - x0 < mask.shape[1]) or mask[y - y0, x - x0] == 0:
+                    continue
+            hitList.append((index, kind, self.elements[index]))
+        return hitList
+    def replay(self, backend):
+        """ Draw the items by another backend (e.g. <code>signVector.VectorBackend</code>) """
+        backend.begin(self.size, self.background)
+        draw = backend.draw()
+        for item in self.items:
+            kind, _, *args = item
+            if kind == "text":
+                pos, glyphList, font_type, font_height, color, maxLen = args
+                if len(glyphList) == 1 and glyphList[0][0] == 0:
+                    backend.placeText(pos, glyphList[0][1], font_type, font_height, color, maxLen)
+                else:
+                    backend.placeTextRun(pos, list(glyphList), font_type, font_height, color)
+            else:
+                drawItem(draw, item, (0, 0))
+        return backend
+    def paint(self, canvas: np.ndarray, origin: tuple[int, int] = (0, 0), largeText: bool = True):
+        """ Paint the region of the sign at origin on the RGBA array (filled with the background first), the tall text is rasterized by <code>textMask</code> with large """
+        canvas[:] = self.background
+        height, width = canvas.shape[:2]
+        region = (origin[0], origin[1], origin[0] + width, origin[1] + height)
+        img = Image.frombuffer("RGBA", (width, height), canvas, "raw", "RGBA", 0, 1)
+        img.readonly = 0
+        draw = ImageDraw.Draw(img)
+        for index, (kind, box, *args) in enumerate(self.items):
+            if not isOverlap(box, region):
+                continue
+            if kind not in ("text", "rectangle") and not isInside(box, region):
+                # PIL rasterizes a clipped shape differently, so draw the whole shape and copy the region
+                self.paintShape(canvas, region, index)
+            elif kind == "text":
+                pos, glyphList, font_type, font_height, color, maxLen = args
+                pos = (pos[0] - origin[0], pos[1] - origin[1])
+                if len(glyphList) == 1 and glyphList[0][0] == 0:
+                    pasteMask(canvas, pos, textMask(glyphList[0][1], font_type, font_height, maxLen, largeText), color, False)
+                elif round(font_height) <= SUPERSAMPLE_HEIGHT or not largeText:
+                    placeTextRun(canvas, pos, glyphList, font_type, font_height, color, False)
+                else:
+                    for dx, text in glyphList:
+                        pasteMask(canvas, (pos[0] + dx, pos[1]), textMask(text, font_type, font_height), color, False)
+            else:
+                drawItem(draw, self.items[index], origin)
+        return canvas
+    def edgeTiles(self, size: int) -> np.ndarray:
+        """ Whether each tile of the pixel size is near an edge of a shape (found on <code>shapeMask</code>), the rectangles on whole pixels are the same at any factor """
+        width, height = self.size
+        tiles = np.zeros((ceil(height / size), ceil(width / size)), bool)
+        kernel = np.ones((5, 5), np.uint8)
+        for index, (kind, box, *args) in enumerate(self.items):
+            if kind == "text" or not isOverlap(box, (0, 0, width, height)):
+                continue
+            if kind == "rectangle" and all([value == int(value) for value in args[0]]) and args[3] == int(args[3]):
+                continue
+            (x0, y0), mask = self.shapeMask(index)
+            if mask.size == 0:
+                continue
+            ys, xs = np.nonzero(cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, kernel))
+            tiles[(ys + y0) // size, (xs + x0) // size] = True
+        return tiles
+    def paintScaled(self, region: tuple[int, int, int, int], factor: int, maskBytes: int = 16 * 1024 * 1024) -> np.ndarray:
+        """ Paint the region on a new RGBA array of factor times the size, the shapes are drawn by <code>scaleItem</code> (the whole shape if its mask is at most maskBytes) and the text masks are enlarged by repeating the pixels """
+        x0, y0, x1, y1 = region
+        canvas = np.empty(((y1 - y0) * factor, (x1 - x0) * factor, 4), np.uint8)
+        canvas[:] = self.background
+        img = Image.frombuffer("RGBA", (canvas.shape[1], canvas.shape[0]), canvas, "raw", "RGBA", 0, 1)
+        img.readonly = 0
+        draw = ImageDraw.Draw(img)
+        for index, item in enumerate(self.items):
+            kind, box, *args = item
+            if not isOverlap(box, region):
+                continue
+            if kind not in ("text", "rectangle") and not isInside(box, region) and not self.shapeNear(index, region):
+                continue
+            if kind not in ("text", "rectangle") and not isInside(box, region) and (box[2] - box[0]) * (box[3] - box[1]) * factor * factor <= maskBytes:
+                # PIL rasterizes a clipped shape differently (see paint)
+                self.paintShape(canvas, (x0 * factor, y0 * factor, x1 * factor, y1 * factor), index, factor)
+            elif kind == "text":
+                pos, glyphList, font_type, font_height, color, maxLen = args
+                for dx, text in glyphList:
+                    left, top = pos[0] + dx, pos[1]
+                    mask = generateFontMaskArray(text, font_type, font_height, maxLen=maxLen)
+                    # Only the part of the mask in the region is enlarged
+                    mask = mask[max(0, y0 - top): max(0, y1 - top), max(0, x0 - left): max(0, x1 - left)]
+                    if mask.size > 0:
+                        mask = cv2.resize(mask, (mask.shape[1] * factor, mask.shape[0] * factor), interpolation=cv2.INTER_NEAREST)
+                        pasteMask(canvas, ((max(left, x0) - x0) * factor, (max(top, y0) - y0) * factor), mask, color, False)
+            else:
+                drawItem(draw, scaleItem(item, factor), (x0 * factor, y0 * factor))
+        return canvas
+    def paintSupersampled(self, canvas: np.ndarray, factor: int, size: int = 64) -> np.ndarray:
+        """
+            <h4>Paint the whole sign on the RGBA array with antialiased shape edges, by bands of the pixel size</h4>
+            <p>The runs of tiles near the edges of the shapes (<code>edgeTiles</code>) are painted at factor times the size and downsampled by area, the others are painted by <code>paint</code>. The text and the rectangles on whole pixels are the same as <code>update()</code></p>
+        """
+        size = max(8, size - size % 8)
+        width, height = self.size
+        tiles = self.edgeTiles(size)
+        for row, y in enumerate(range(0, height, size)):
+            y1 = min(y + size, height)
+            x = 0
+            while x < width:
+                # A run of the tiles painted the same way
+                x1 = x + size
+                while x1 < width and tiles[row, x1 // size] == tiles[row, x // size]:
+                    x1 += size
+                x1 = min(x1, width)
+                if tiles[row, x // size]:
+                    canvas[y: y1, x: x1] = downsampleArea(self.paintScaled((x, y, x1, y1), factor), factor, (x1 - x, y1 - y))
+                else:
+                    canvas[y: y1, x: x1] = self.paint(np.empty((y1 - y, x1 - x, 4), np.uint8), (x, y), False)
+                x = x1
+        return canvas
+    def shapeMask(self, index: int, factor: int = 1) -> tuple[tuple[int, int], np.ndarray]:
+        """ The <code>(origin, mask)</code> of the whole shape (clipped by the sign like the full render) at factor times the size (<code>scaleItem</code>), 1 for the fill and 2 for the outline """
+        value = self.shapeMasks.get(index if factor == 1 else (index, factor))
+        if value is None:
+            box = self.items[index][1]
+            origin = (max(0, box[0] - box[0] % 8) * factor, max(0, box[1] - box[1] % 8) * factor)
+            mask = Image.new("L", (max(0, min(box[2], self.size[0]) * factor - origin[0]), max(0, min(box[3], self.size[1]) * factor - origin[1])), 0)
+            drawItem(ImageDraw.Draw(mask), self.items[index] if factor == 1 else scaleItem(self.items[index], factor), origin, 1, 2)
+            value = (origin, np.asarray(mask))
+            self.shapeMasks.put(index if factor == 1 else (index, factor), value)
+        return value
+    def paintBands(self, canvas: np.ndarray, workers: int|None = None, size: int = 256, largeText: bool = True) -> np.ndarray:
+        """
+            <h4>Paint the whole sign on the RGBA array by bands of rows in a thread pool</h4>
+            <p>Each band paints the items crossing it in the drawing order, the band height is aligned to 8 so the result is the same as <code>paint</code></p>
+        """
+        size = max(8, size - size % 8)
+        with ThreadPoolExecutor(workers) as executor:
+            # A band of whole rows is contiguous, it is painted in place
+            for _ in executor.map(lambda y: self.paint(canvas[y: y + size], (0, y), largeText), range(0, canvas.shape[0], size)):
+                pass
+        return canvas
+    def render(self) -> Image.Image:
+        """ Paint the whole sign on a new image """
+        canvas = np.empty((self.size[1], self.size[0], 4), np.uint8)
+        return Image.fromarray(self.paint(canvas), "RGBA")
+    def shapeNear(self, index: int, region: tuple[int, int, int, int], pad: int = 2) -> bool:
+        """ Whether the shape (<code>shapeMask</code>) has pixels within pad pixels of the region """
+        (x0, y0), mask = self.shapeMask(index)
+        return bool(mask[max(0, region[1] - pad - y0): max(0, region[3] + pad - y0), max(0, region[0] - pad - x0): max(0, region[2] + pad - x0)].any())
+    def paintShape(self, canvas: np.ndarray, region: tuple[int, int, int, int], index: int, factor: int = 1):
+        kind, box, *args = self.items[index]
+        (x0, y0), mask = self.shapeMask(index, factor)
+        left, top = max(region[0], x0), max(region[1], y0)
+        right, bottom = min(region[2], x0 + mask.shape[1]), min(region[3], y0 + mask.shape[0])
+        if left >= right or top >= bottom:
+            return
+        area = canvas[top - region[1]: bottom - region[1], left - region[0]: right - region[0]]
+        maskArea = mask[top - y0: bottom - y0, left - x0: right - x0]
+        colors = [args[3]] if kind == "arc" else [args[-3], args[-2]]
+        for value, color in enumerate(colors, 1):
+            if color is not None:
+                np.copyto(area, np.array(getColor(color), np.uint8), where=(maskArea == value)[..., None])
+
+layoutCache = LRUCache(32)
+""" Frozen display lists keyed by <code>layoutKey</code> """
+registerCache("layout", layoutCache.clear)
+LAYOUT_STATE = {"size", "origin", "clip", "recordOnly", "drawBox", "tracking"}
+""" The sign attributes changed by drawing, not part of the layout key """
+
+def layoutKey(sign: Sign) -> tuple:
+    """ The class, the info and the plain settings of the sign """
+    settings = tuple(sorted([(name, value) for name, value in vars(sign).items()
+                             if isinstance(value, (int, float, str, bool, tuple)) and not name.startswith("_") and name not in LAYOUT_STATE]))
+    return (type(sign).__name__, dumps(sign.info, sort_keys=True, ensure_ascii=False, default=str), settings)
+
+def layoutSign(sign: Sign, cache: bool = True) -> DisplayList:
+    """
+        <h4>The layout phase: record the drawing of the sign as a frozen display list without painting</h4>
+        <p>The sign is not changed, the display lists are cached by the settings of the sign</p>
+    """
+    key = layoutKey(sign) if cache else None
+    displayList = layoutCache.get(key) if cache else None
+    if displayList is None:
+        recordedSign = sign.scaledCopy(sign.scale)
+        recordedSign.cancelCheck = None
+        recordedSign.backend = DisplayList()
+        recordedSign.update()
+        displayList = recordedSign.backend.freeze()
+        if cache:
+            layoutCache.put(key, displayList)
+    return displayList
+
+def renderParallel(sign: Sign, workers: int|None = None, size: int = 256) -> Image.Image:
+    """
+        <h4>Draw the sign by its layout painted by bands in a thread pool (see <code>DisplayList.paintBands</code>)</h4>
+        <p>The same image as <code>update()</code>, the sign has no <code>baseCanvas</code> then (a partial refresh draws the whole sign)</p>
+    """
+    displayList = layoutSign(sign)
+    sign.newCanvas(displayList.size, displayList.background)
+    if sign.canvas is not None:
+        displayList.paintBands(sign.canvas, workers, size, False)
+    return sign.img
+
+def renderSupersampled(sign: Sign, factor: int = 4) -> Image.Image:
+    """
+        <h4>Draw the sign by its layout at the scale of the sign with the shape edges antialiased by factor (see <code>DisplayList.paintSupersampled</code>)</h4>
+        <p>The same size and text as <code>update()</code>, the sign has no <code>baseCanvas</code> then</p>
+    """
+    displayList = layoutSign(sign)
+    sign.newCanvas(displayList.size, displayList.background)
+    if sign.canvas is not None:
+        displayList.paintSupersampled(sign.canvas, factor)
+    return sign.img
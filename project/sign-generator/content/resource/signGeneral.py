@@ -1,5 +1,4 @@
-from signTemplate import Color, Sign
-from PIL import Image
+from signTemplate import Color, Sign, unionBox, isOverlap
 
 class SignGeneral(Sign):
     """ A general sign with position setting """
@@ -25,37 +24,46 @@ class SignGeneral(Sign):
         self.arrowSComboList = ["←", "↖", "↑", "↗", "→", "↘", "↓", "↙", "↶", "↰", "↱"]
         self.arrowCComboList = ["↫", "↰", "↱"]
     def update(self):
-        self.img = Image.new("RGBA", (round(self.info["BGwidth"] * self.scale), round(self.info["BGheight"] * self.scale)), (255, 255, 255, 0))
+        self.newCanvas((round(self.info["BGwidth"] * self.scale), round(self.info["BGheight"] * self.scale)), (255, 255, 255, 0))
         self.drawTriRoundRect(None, self.text_height * 0.1, self.bgcolor, self.bglinecolor)
-        layerList: list[dict[str,]] = []
+        if self.canvas is not None:
+            self.baseCanvas = self.canvas.copy()
+        for key, layerInfo in self.getLayers():
+            self.drawElement(key, self.drawLayer, key, layerInfo)
+    def getLayers(self) -> list[tuple[str, dict[str,]]]:
+        """ Get the layers in drawing order """
+        layerList: list[tuple[str, dict[str,]]] = []
         for i in range(self.num):
             key = f"layer{i + 1}"
             if key not in self.info:
                 continue
-            layerList.append(self.info[key])
-        layerList.sort(key=lambda x: x.get("priority", 0))
-        for layerInfo in layerList:
-            pos = (layerInfo.get("x", 0), layerInfo.get("y", 0))
-            try:
-                if layerInfo["type"] == "text":
-                    self.putAutoText(layerInfo["text"], pos, layerInfo.get("height", self.text_height), layerInfo.get("textType", "A"), layerInfo.get("gap", 0.1))
-                elif layerInfo["type"] == "textC":
-                    self.putAutoCentralText(layerInfo["text"], pos, layerInfo.get("height", self.text_height), layerInfo.get("textType", "A"), layerInfo.get("gap", 0.1))
-                else:
-                    colorList = Color.getDefaultColor(layerInfo.get("color", ""))
-                    if len(colorList) == 0:
-                        colorList = [(255)]
-                    if layerInfo["type"] == "arc":
-                        self.drawHArcBar(pos, (layerInfo.get("endX", 0), layerInfo.get("endY", 0)), self.text_height, layerInfo.get("lineWidth", self.text_height * 0.4) / self.text_height, colorList[0])
-                    elif layerInfo["type"] == "roundRect":
-                        x2 = pos[0] + layerInfo["width"]
-                        y2 = pos[1] + layerInfo["height"]
-                        self.drawRoundRect((*pos, x2, y2), layerInfo.get("rad", self.text_height * 0.1), colorList[0])
-                    elif layerInfo["type"] == "arrowS":
-                        self.drawAutoStraightArrow(layerInfo["arrowS"], pos, layerInfo.get("width", self.text_height), layerInfo.get("height", None), fill=colorList[0])
-                    elif layerInfo["type"] == "arrowC":
-                        self.drawAutoCurveArrow(layerInfo["arrowC"], pos, layerInfo.get("width", self.text_height), layerInfo.get("height", None), fill=colorList[0])
-            except:
+            layerList.append((key, self.info[key]))
+        layerList.sort(key=lambda x: x[1].get("priority", 0))
+        return layerList
+    def drawLayer(self, key: str, layerInfo: dict[str,]):
+        """ Draw a layer """
+        pos = (layerInfo.get("x", 0), layerInfo.get("y", 0))
+        try:
+            if layerInfo["type"] == "text":
+                self.putAutoText(layerInfo["text"], pos, layerInfo.get("height", self.text_height), layerInfo.get("textType", "A"), layerInfo.get("gap", 0.1))
+            elif layerInfo["type"] == "textC":
+                self.putAutoCentralText(layerInfo["text"], pos, layerInfo.get("height", self.text_height), layerInfo.get("textType", "A"), layerInfo.get("gap", 0.1))
+            else:
+                colorList = Color.getDefaultColor(layerInfo.get("color", ""))
+                if len(colorList) == 0:
+                    colorList = [(255)]
+                if layerInfo["type"] == "arc":
+                    self.drawHArcBar(pos, (layerInfo.get("endX", 0), layerInfo.get("endY", 0)), self.text_height, layerInfo.get("lineWidth", self.text_height * 0.4) / self.text_height, colorList[0])
+                elif layerInfo["type"] == "roundRect":
+                    x2 = pos[0] + layerInfo["width"]
+                    y2 = pos[1] + layerInfo["height"]
+                    self.drawRoundRect((*pos, x2, y2), layerInfo.get("rad", self.text_height * 0.1), colorList[0])
+                elif layerInfo["type"] == "arrowS":
+                    self.drawAutoStraightArrow(layerInfo["arrowS"], pos, layerInfo.get("width", self.text_height), layerInfo.get("height", None), fill=colorList[0])
+                elif layerInfo["type"] == "arrowC":
+                    self.drawAutoCurveArrow(layerInfo["arrowC"], pos, layerInfo.get("width", self.text_height), layerInfo.get("height", None), fill=colorList[0])
+        except:
+            if not self.recordOnly:
                 print("Error:", f"Cannot draw {key} ({layerInfo["type"]})")
     def setLayer(self, key: str, value: dict[str,], refresh = True):
         """ Change the setting of a layer """
@@ -75,25 +83,44 @@ class SignGeneral(Sign):
                 return
             self.info[key] = value
         if refresh:
-            self.update()
+            self.refresh([key])
+    def refresh(self, keys: list[str]):
+        """ Redraw the changed layers in their old and new areas only """
+        if self.baseCanvas is None or self.canvas is None or any([not (len(key) > 5 and key[:5] == "layer" and key[5:].isdigit()) for key in keys]):
+            return self.update()
+        box = None
+        for key in keys:
+            box = unionBox(box, self.elementBox.pop(key, None))
+            if key in self.info and int(key[5:]) <= self.num:
+                box = unionBox(box, self.trackBox(self.drawLayer, key, self.info[key], recordOnly=True))
+        if box is not None:
+            self.redrawRegion(box, self.redrawLayers, keys)
+    def redrawLayers(self, keys: list[str]):
+        """ Redraw the changed layers and the layers over the redrawn region """
+        for key, layerInfo in self.getLayers():
+            if key in keys or isOverlap(self.elementBox.get(key), self.clip):
+                self.drawElement(key, self.drawLayer, key, layerInfo)
     def setNum(self, num: int, refresh = True):
         """ Set the number of lines """
         if num >= 0:
             self.info["layers"] = num
+            keys = []
             if self.num < num:
                 while self.num < num:
                     self.num += 1
                     self.info[f"layer{self.num}"] = {}
                     self.setLayer(f"layer{self.num}", {"type": "text"}, False)
+                    keys.append(f"layer{self.num}")
                 if refresh:
-                    self.update()
+                    self.refresh(keys)
             elif self.num > num:
                 while self.num > num:
                     if f"layer{self.num}" in self.info:
                         self.info.pop(f"layer{self.num}")
+                    keys.append(f"layer{self.num}")
                     self.num -= 1
                 if refresh:
-                    self.update()
+                    self.refresh(keys)
     def autoSet(self, key: str, value, refresh = True):
         """ Set data based on infomation """
         if key == "BGcolor":
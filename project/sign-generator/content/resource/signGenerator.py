@@ -1,20 +1,23 @@
-from signTemplate import Color, Sign
-from textGenerator import placeText, fontLen
-from PIL import Image, ImageDraw
-from pypinyin import slug as toPinyin
+from signTemplate import Color, Sign, isAlpha, parseSharp, splitSharp
+from textGenerator import LRUCache, registerCache, fontLen
+import json
 import os
+import threading
 
 def getFilePath(path: str):
     """ Return the path from the code file """
     return os.path.join(os.path.dirname(__file__), path)
 
-def isAlpha(string: str):
-    return all(["A"<= char <= "z" and char.isalpha() for char in string])
+def toPinyin(text: str, separator: str = "-") -> str:
+    """ The pinyin slug of the text, pypinyin is imported on the first call (its dictionaries take most of the import time) """
+    from pypinyin import slug
+    return slug(text, separator=separator)
 
 def isHighway(name: str):
-    if "#N" in name:
-        return "#NH" in name
-    name = name.split("#", 1)[0]
+    parsed = parseSharp(name)
+    if parsed.has("N"):
+        return parsed.has("NH")
+    name = parsed.text
     if name == "":
         return False
     if len(name) == 1:
@@ -33,63 +36,146 @@ def getAutoSharp(numNo: str|list[str]):
         return numNo if "#" in numNo else numNo + ("#NH" if isHighway(numNo) else "#NW")
     return [num if "#" in num else num + ("#NH" if isHighway(num) else "#NW") for num in numNo]
 
-def splitSharp(string: str):
-    """ Split string to text and sharp infomation """
-    aid = ""
-    if "#" in string:
-        string, aid = string.split("#", 1)
-        aid = "#" + aid
-    return (string, aid)
+EN_START = {"避险车道": "Truck Escape Ramp", "下一出口": "Next Exit", "爬坡车道": "Climbing Lane", "超限检测站": "Weight Station"}
+""" The English of the prefixes """
+EN_END = {"道路交通信息": "Traffic Information", "城区": "Urban", "收费站": "Toll Station", "隧道": "Tunnel", "入口": "Entrance", "出口": "Exit", "收费": "Toll", "服务区": "Service Area", "停车区": "Rest Area", "服务站": "Service Area", "停车点": "Rest Area", "起点": "Begin", "结束": "end", "方向": "Direction", 
+          "桥": "Bridge", "站": "Station", "地铁": "Subway", "火车": "Railway", "高铁": "Highspeed Railway", "河": "River", "公园": "Park", "森林": "Forest", "飞机场": "Airport", "机场": "Airport", "港": "Port", "国际": "International", "环路": "Ring Rd.", "环": "Ring Rd.", "高速": "Highway", "线": "Highway", "路": "Rd.", "街": "St.", "大道": "Ave.", "大街": "Ave.", 
+          "一": "1st", "二": "2nd", "三": "3rd", "四": "4th", "五": "5th", "六": "6th", "七": "7th", "八": "8th", "九": "9th", "东": "East", "西": "West", "南": "South", "北": "North", "中": "Middle"}
+""" The English of the suffixes """
+PINYIN_TABLE_FILE = "pinyinTable.jsonl"
+""" The transliterations saved next to the code, one <code>[text, pinyin]</code> per line (appended, shared by all the processes) """
+PINYIN_TABLE_SIZE = 65536
+""" The most transliterations kept in memory and in the sidecar, the least recently used ones are dropped """
+pinyinTableEnabled = True
+""" Keep the transliterations in the table file """
+_pinyinTable: LRUCache|None = None
+_newPinyin: dict[str, str] = {}
+""" The transliterations not saved yet, saved by <code>savePinyin</code> when the render using them is finished """
+_pinyinLock = threading.Lock()
+enCache = LRUCache(4096)
+""" The English of the lines keyed by the Chinese line """
+registerCache("en", enCache.clear)
 
-def getSharpText(aidStr: str, getType: str):
-    """ Get the infomation of the aidStr """
-    if getType == "BC":
-        if "#BC" in aidStr:
-            colorStr = aidStr[aidStr.find("#BC") + 2:].split("#", 1)[0][1:]
-            return [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
-        return []
-    if getType == "C":
-        if "#C" in aidStr:
-            colorStr = aidStr[aidStr.find("#C") + 1:].split("#", 1)[0][1:]
-            return [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
-        return []
-    if getType == "D":
-        if "#D" in aidStr:
-            aid = aidStr[aidStr.find("#D") + 2:]
-            if aid != "":
-                return aid[0]
-        return ""
-    if getType == "H":
-        if "#H" in aidStr:
-            return aidStr[aidStr.find("#H") + 2:].split("#")[0]
-        return ""
+def loadPinyinTable() -> LRUCache:
+    """ Load the transliteration table from the sidecar next to the code, the sidecar is compacted if it has repeated, cut or too many lines """
+    global _pinyinTable
+    with _pinyinLock:
+        if _pinyinTable is None:
+            items: dict[str, str] = {}
+            lineCount = 0
+            try:
+                with open(getFilePath(PINYIN_TABLE_FILE), "r", encoding="utf-8") as file:
+                    for line in file:
+                        lineCount += 1
+                        try:
+                            text, pinyin = json.loads(line)
+                            items.pop(text, None)
+                            items[text] = pinyin
+                        except (ValueError, TypeError):
+                            pass  # A line cut by an interrupted write
+            except OSError:
+                pass
+            itemList = list(items.items())[-PINYIN_TABLE_SIZE:]
+            if lineCount > len(itemList):
+                writePinyin(itemList)
+            _pinyinTable = LRUCache(PINYIN_TABLE_SIZE)
+            for text, pinyin in itemList:
+                _pinyinTable.put(text, pinyin)
+        return _pinyinTable
 
-def chToEn(ch: str):
-    """ Translate from Chinese to English """
-    if ch == "":
-        return ""
-    ch = ch.split("#", 1)[0]
-    start = {"避险车道": "Truck Escape Ramp", "下一出口": "Next Exit", "爬坡车道": "Climbing Lane", "超限检测站": "Weight Station"}
-    end = {"道路交通信息": "Traffic Information", "城区": "Urban", "收费站": "Toll Station", "隧道": "Tunnel", "入口": "Entrance", "出口": "Exit", "收费": "Toll", "服务区": "Service Area", "停车区": "Rest Area", "服务站": "Service Area", "停车点": "Rest Area", "起点": "Begin", "结束": "end", "方向": "Direction", 
-           "桥": "Bridge", "站": "Station", "地铁": "Subway", "火车": "Railway", "高铁": "Highspeed Railway", "河": "River", "公园": "Park", "森林": "Forest", "飞机场": "Airport", "机场": "Airport", "港": "Port", "国际": "International", "环路": "Ring Rd.", "环": "Ring Rd.", "高速": "Highway", "线": "Highway", "路": "Rd.", "街": "St.", "大道": "Ave.", "大街": "Ave.", 
-           "一": "1st", "二": "2nd", "三": "3rd", "四": "4th", "五": "5th", "六": "6th", "七": "7th", "八": "8th", "九": "9th", "东": "East", "西": "West", "南": "South", "北": "North", "中": "Middle"}
-    enList = []
-    for line in ch.split("\\n"):
-        if "#N" in line:
-            enList.append("")
+def unloadPinyinTable():
+    """ Forget the loaded table, it is loaded from the sidecar again when needed """
+    global _pinyinTable
+    with _pinyinLock:
+        _pinyinTable = None
+
+registerCache("pinyin", unloadPinyinTable)
+
+def writePinyin(items: list[tuple[str, str]]):
+    """ Replace the sidecar by the transliterations (ignored on read-only installs, lines appended by another process meanwhile are transliterated again later) """
+    path = getFilePath(PINYIN_TABLE_FILE)
+    try:
+        with open(f"{path}.{os.getpid()}.tmp", "w", encoding="utf-8") as file:
+            file.write("".join([json.dumps([text, pinyin], ensure_ascii=False) + "\n" for text, pinyin in items]))
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+    except OSError:
+        pass
+
+def savePinyin() -> int:
+    """ Append the new transliterations to the sidecar (ignored on read-only installs), return the number of them """
+    with _pinyinLock:
+        items = list(_newPinyin.items())
+        _newPinyin.clear()
+    if pinyinTableEnabled and len(items) > 0:
+        try:
+            with open(getFilePath(PINYIN_TABLE_FILE), "a", encoding="utf-8") as file:
+                file.write("".join([json.dumps([text, pinyin], ensure_ascii=False) + "\n" for text, pinyin in items]))
+        except OSError:
+            pass
+    return len(items)
+
+def discardPinyin():
+    """ Do not save the new transliterations (e.g. of the text typed in the GUI before a newer render), they are only kept in memory """
+    with _pinyinLock:
+        _newPinyin.clear()
+
+def cachedPinyin(text: str, save: bool = True) -> str:
+    """ The pinyin of the text from the table, a new one is added (and saved by the next <code>savePinyin</code> if save) """
+    if not pinyinTableEnabled:
+        return toPinyin(text, separator="")
+    table = loadPinyinTable()
+    pinyin = table.get(text)
+    if pinyin is None:
+        pinyin = toPinyin(text, separator="")
+        table.put(text, pinyin)
+        if save:
+            with _pinyinLock:
+                _newPinyin[text] = pinyin
+                if len(_newPinyin) > PINYIN_TABLE_SIZE:
+                    _newPinyin.pop(next(iter(_newPinyin)))
+    return pinyin
+
+def lineToEn(line: str, save: bool = True) -> str:
+    """ Translate a line from Chinese to English """
+    en = enCache.get(line)
+    if en is None:
+        text = line
+        if "#N" in text:
+            en = ""
         else:
             startEn = ""
-            for chStr, enStr in start.items():
-                if len(line) >= len(chStr) and line[:len(chStr)] == chStr:
-                    line = line[len(chStr):]
+            for chStr, enStr in EN_START.items():
+                if len(text) >= len(chStr) and text[:len(chStr)] == chStr:
+                    text = text[len(chStr):]
                     startEn += enStr + " "
             endEn = ""
-            for chStr, enStr in end.items():
-                if len(line) >= len(chStr) and line[-len(chStr):] == chStr:
-                    line = line[:-len(chStr)]
+            for chStr, enStr in EN_END.items():
+                if len(text) >= len(chStr) and text[-len(chStr):] == chStr:
+                    text = text[:-len(chStr)]
                     endEn = " " + enStr + endEn
-            enList.append(startEn + toPinyin(line, separator="").capitalize() + endEn)
-    return "\\n".join(enList)
+            en = startEn + cachedPinyin(text, save).capitalize() + endEn
+        enCache.put(line, en)
+    return en
+
+def chToEn(ch: str):
+    """ Translate from Chinese to English """
+    if ch == "":
+        return ""
+    ch = ch.split("#", 1)[0]
+    return "\\n".join([lineToEn(line) for line in ch.split("\\n")])
+
+def prewarmChToEn(path: str) -> int:
+    """
+        <h4>Translate the place names of a gazetteer and save the new transliterations at once</h4>
+        <p>The file has one name per line (or is a json list of names), return the number of new transliterations</p>
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        names = json.load(file) if path.lower().endswith(".json") else [line.strip() for line in file if line.strip() != ""]
+    for name in names:
+        name = str(name).split("#", 1)[0]
+        for line in name.split("\\n"):
+            lineToEn(line)
+    return savePinyin()
 
 class RoundaboutSign(Sign):
     """ A preview sign for roundabout """
@@ -122,9 +208,9 @@ class RoundaboutSign(Sign):
                         bbox[1] -= shiftY
         width = max(1.6 * self.text_height, bbox[2] - bbox[0]) + self.text_height
         height = max(0.4 * self.text_height, -bbox[1]) + max((1.6 if self.info["crossing name"] == "" else 2.2) * self.text_height, bbox[3]) + self.text_height
-        self.img = Image.new("RGBA", (round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
+        self.newCanvas((round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 0.1 * self.text_height, Color.BLUE, (255))
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         if self.info["direction"] != "":
             draw.rectangle([pos * self.scale for pos in (0.2 * self.text_height, 0.2 * self.text_height, 1.1 * self.text_height, 1.1 * self.text_height)], fill= Color.getRGBAColor((255)))
             self.putCentralString(self.info["direction"], (0.6 * self.text_height, 0.2 * self.text_height), "A", 0.8 * self.text_height, Color.BLUE)
@@ -193,9 +279,9 @@ class StackedCrossingSign(Sign):
         self.update()
     def update(self):
         width = max([3 * self.text_height] + [(3 if self.info[f"direction{i + 1}"]["arrow"] in {"←", "→"} else 2.6) * self.text_height + self.getAutoLen(self.info[f"direction{i + 1}"]["text"], self.text_height, "A", 0.2) for i in range(self.num) if f"direction{i + 1}" in self.info])
-        self.img = Image.new("RGBA", (round(width * self.scale), round((0.3 * self.text_height + sum([Sign.getAutoHeight(self.info[f"direction{i + 1}"]["text"], self.text_height, self.english_scale, 0.2) + 0.9 * self.text_height for i in range(self.num) if f"direction{i + 1}" in self.info]) if self.num > 0 else 0.8 * self.text_height) * self.scale)), (0, 0, 0, 0))
+        self.newCanvas((round(width * self.scale), round((0.3 * self.text_height + sum([Sign.getAutoHeight(self.info[f"direction{i + 1}"]["text"], self.text_height, self.english_scale, 0.2) + 0.9 * self.text_height for i in range(self.num) if f"direction{i + 1}" in self.info]) if self.num > 0 else 0.8 * self.text_height) * self.scale)), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 0.1 * self.text_height, Color.BLUE, (255))
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         y = 0.6 * self.text_height
         for i in range(self.num):
             if f"direction{i + 1}" in self.info:
@@ -277,9 +363,9 @@ class LineSign(Sign):
         self.arrowComboList = ("↶", "↰", "↑", "↱")
         self.update()
     def update(self):
-        self.img = Image.new("RGBA", ((75 * self.num + 25) * self.scale, self.height * self.scale), (0, 0, 0, 0))
+        self.newCanvas(((75 * self.num + 25) * self.scale, self.height * self.scale), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 2.5, Color.BLUE, (255))
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         x = 10
         draw.rectangle([pos * self.scale for pos in (x, 10, x + 5, self.height - 10)], Color.getRGBAColor((255)))
         for i in range(self.num):
@@ -352,9 +438,9 @@ class LinePlaceSign(Sign):
         self.arrowComboList = ("↶", "↰", "↑", "↱", "text", "textEn")
         self.update()
     def update(self):
-        self.img = Image.new("RGBA", ((75 * self.num + 25) * self.scale, self.height * self.scale), (0, 0, 0, 0))
+        self.newCanvas(((75 * self.num + 25) * self.scale, self.height * self.scale), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 2.5, Color.BLUE, (255))
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         x = 10
         draw.rectangle([pos * self.scale for pos in (x, 10, x + 5, self.height - 10)], Color.getRGBAColor((255)))
         for i in range(self.num):
@@ -473,22 +559,22 @@ class HighwayNoSign(Sign):
         self.width = 25
         self.update()
     def putCentralString(self, string, centralPos, font_type, height, color = 255):
-        if "#NHH" in self.sharpStr or len(string) < 5:
+        if parseSharp(self.sharpStr).has("NHH") or len(string) < 5:
             super().putCentralString(string, centralPos, font_type, height, color)
         else:
             bigStr = string[:3]
             smallStr = string[3:]
             halfTextLen = (fontLen([bigStr], font_type, height, self.scale) + fontLen([smallStr], font_type, height * 2/3, self.scale)) / 2
-            placeText(self.img, (round((centralPos[0] - halfTextLen) * self.scale), centralPos[1] * self.scale), bigStr, font_type, height * self.scale, color)
-            placeText(self.img, (round(centralPos[0] - halfTextLen + fontLen([bigStr], font_type, height, self.scale)) * self.scale, round(centralPos[1] + height / 3) * self.scale), smallStr, font_type, height * 2/3 * self.scale, color)
+            self.placeText((round((centralPos[0] - halfTextLen) * self.scale), centralPos[1] * self.scale), bigStr, font_type, height * self.scale, color)
+            self.placeText((round(centralPos[0] - halfTextLen + fontLen([bigStr], font_type, height, self.scale)) * self.scale, round(centralPos[1] + height / 3) * self.scale), smallStr, font_type, height * 2/3 * self.scale, color)
     def update(self):
-        if "#NHH" in self.sharpStr:
+        if parseSharp(self.sharpStr).has("NHH"):
             self.width = max(75 + fontLen(self.info["No"], "B", self.text_height, self.scale), self.getTextLen(self.info["type"], "A", 10, 10 / self.scale) + 30)
         else:
             self.width = max(50 + len(self.info["No"]) * 25 if len(self.info["No"]) < 5 else round(57.5 + 22.5 * len(self.info["No"])), self.getTextLen(self.info["type"], "A", 10, 10 / self.scale) + 30)
         if self.hasName:
             self.width = max(self.width, round(self.getTextLen(self.info["name"], "A", 20, 0.25) + 30))
-        self.img = Image.new("RGBA", (int(self.width * self.scale), (120 if self.hasName else 100) * self.scale), (0, 0, 0, 0))
+        self.newCanvas((int(self.width * self.scale), (120 if self.hasName else 100) * self.scale), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 3, Color.GREEN, (255))
         self.drawhalfRoundRect((6, 6, self.width - 6, 26), 6, 3, self.headColor)
         self.putCentralText(self.info["type"], (self.width / 2, 11), "A", 10, 10 / self.scale, (255) if self.info["type"] == "国家高速" else (0))
@@ -558,7 +644,7 @@ class HighwayEnterSign(Sign):
         height = 2.8 * self.text_height + sum([0] + [0.2 * self.text_height + Sign.getAutoHeight(line, self.text_height) for line in self.info["No"].split("\\n") if line != ""]) + \
                 (max(sum([0] + [0.4 * self.text_height + Sign.getAutoHeight(line, self.text_height, self.english_scale, 0.2) for line in self.info["nameL"].split("\\n") if line != ""]), sum([0] + [0.4 * self.text_height + Sign.getAutoHeight(line, self.text_height, self.english_scale, 0.2) for line in self.info["nameR"].split("\\n") if line != ""])) if self.hasLine 
                     else sum([0] + [0.4 * self.text_height + Sign.getAutoHeight(line, self.text_height, self.english_scale, 0.2) for line in self.info["name"].split("\\n") if line != ""]))
-        self.img = Image.new("RGBA", (round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
+        self.newCanvas((round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 0.1 * self.text_height, Color.GREEN, (255))
         y = 0.6 * self.text_height
         if self.noNo:
@@ -584,7 +670,7 @@ class HighwayEnterSign(Sign):
                     y += self.english_scale * self.text_height + 0.4 * self.text_height
             x += len1 / 2 + 0.4 * self.text_height
             y = yTop + (maxH - len(self.info["nameR"])) * 0.7 * self.text_height
-            draw = ImageDraw.Draw(self.img)
+            draw = self.getDraw()
             if maxH > 0.4:
                 draw.rectangle((round(x) * self.scale, round(yTop) * self.scale, round(x + 0.2 * self.text_height) * self.scale, round(yTop + maxH * (1.4 if self.english_scale is None else 1.6 + self.english_scale) * self.text_height - 0.4 * self.text_height) * self.scale), fill=Color.getRGBAColor(255))
             x += 0.6 * self.text_height + len2 / 2
@@ -628,7 +714,7 @@ class HighwayEnterSign(Sign):
         for line in noList:
             nameList = []
             for name in line.split(" "):
-                if ("#N" in name or len(name) > 0 and (isAlpha(name[0]) or name[0].isdigit()) and (len(name) == 1 or isAlpha(name[1]) or name[-1].isdigit or name[-1] in {"东", "西", "南", "北"}) and (len(name) < 4 or name[2:-1].isdigit())):
+                if (parseSharp(name).has("N") or len(name) > 0 and (isAlpha(name[0]) or name[0].isdigit()) and (len(name) == 1 or isAlpha(name[1]) or name[-1].isdigit or name[-1] in {"东", "西", "南", "北"}) and (len(name) < 4 or name[2:-1].isdigit())):
                     nameList.append(getAutoSharp(name))
                 else:
                     nameList.append(name)
@@ -742,14 +828,14 @@ class HignwayExitDirection(Sign):
                     + (0 if self.english_scale is None else sum([Sign.getAutoEnHeight(line, self.text_height, self.english_scale) for line in self.info["textEn"].split("\\n")]))
         if textHeight + 1.2 * self.text_height > height:
             height = textHeight + 1.2 * self.text_height
-        self.img = Image.new("RGBA", (round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
+        self.newCanvas((round(width * self.scale), round(height * self.scale)), (0, 0, 0, 0))
         self.drawTriRoundRect(None, 0.1 * self.text_height, Color.GREEN, (255))
         x = width / 2 + (0.9 if self.isLeft else -0.9) * self.text_height
         y = (height - textHeight) / 2
         textList = self.info["text"].split("\\n")
         enList = self.info["textEn"].split("\\n")
         for i, name in enumerate(textList):
-            if "#Tt" in textList[i]:
+            if parseSharp(name).has("Tt"):
                 self.putCentralString(name, (x, y), "A", self.text_height, maxLen=textLen)
                 y += Sign.getAutoHeight(name, self.text_height) + 0.2 * self.text_height
                 if self.english_scale is not None and i < len(enList) and enList[i] != "":
@@ -838,18 +924,18 @@ class ExitSign(Sign):
         y *= self.scale
         for char in text:
             if font_type != "B" or char.isdigit():
-                placeText(self.img, (round(x), round(y)), char, font_type, height * self.scale, color)
+                self.placeText((round(x), round(y)), char, font_type, height * self.scale, color)
                 x += (fontLen(char, "B", 50, self.scale) + height / 10) * self.scale
             else:
-                placeText(self.img, (round(x), round(y + height * self.scale / 3)), char, font_type, height * 2/3 * self.scale, color)
+                self.placeText((round(x), round(y + height * self.scale / 3)), char, font_type, height * 2/3 * self.scale, color)
                 x += (fontLen(char, "B", 100/3, self.scale) + height * 2/3 / 10) * self.scale
     def update(self):
         noLen = self.noLen()
         width = noLen * 1.281  # 8/sqrt(39)
         width = round(105 + width) if width > 130 else 235
-        self.img = Image.new('RGBA', (width * self.scale, 100 * self.scale), (255, 255, 255, 0))
+        self.newCanvas((width * self.scale, 100 * self.scale), (255, 255, 255, 0))
         self.drawTriRoundRect((0, 0, width, 100), 3, fill1=Color.GREEN, fill2=(255))
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.ellipse([93 * self.scale, 10 * self.scale, (width - 12) * self.scale, 90 * self.scale], fill=(255, 255, 255, 255))
         self.putText(self.info["No"], (width / 2 + 40 - noLen / 2, 25), "B", 50, Color.GREEN)
         if self.isLeft:
@@ -878,22 +964,21 @@ class AidSign(Sign):
             self.info.update(info)
         self.update()
     def update(self):
-        width = max([0] + [fontLen([line.split("#", 1)[0]], "A", self.text_height, self.scale) if "#TT" in line 
-                           else self.getAutoLen(line.split("#", 1)[0], self.text_height, "A", self.gap) for line in self.info["text"].split("\\n") if "#Tt" not in line]) + 1.2 * self.text_height
-        self.img = Image.new("RGBA", (round(width * self.scale), round((self.info["text"].count("\\n") * 1.4 + 2.2) * self.text_height * self.scale)), (255, 255, 255, 0))
-        if "#C" in self.info["text"]:
-            colorStr = self.info["text"][self.info["text"].find("#C") + 1:].split("#", 1)[0][1:]
-            if len(colorStr) >= 2:
-                self.color1, self.color2, *_ = [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
+        lineList = [parseSharp(line) for line in self.info["text"].split("\\n")]
+        width = max([0] + [fontLen([line.text], "A", self.text_height, self.scale) if line.has("TT") 
+                           else self.getAutoLen(line.text, self.text_height, "A", self.gap) for line in lineList if not line.has("Tt")]) + 1.2 * self.text_height
+        self.newCanvas((round(width * self.scale), round((self.info["text"].count("\\n") * 1.4 + 2.2) * self.text_height * self.scale)), (255, 255, 255, 0))
+        if len(colors := parseSharp(self.info["text"]).colors) >= 2:
+            self.color1, self.color2, *_ = colors
         self.drawTriRoundRect(None, self.text_height * 0.1, self.color1, self.color2)
         y = 0.6 * self.text_height
-        for line in self.info["text"].split("\\n"):
-            if "#TT" in line:
-                self.putCentralString(line.split("#", 1)[0], (width / 2, y), "A", self.text_height, self.color2)
-            elif "#Tt" in line:
-                self.putCentralString(line.split("#", 1)[0], (width / 2, y), "A", self.text_height, self.color2, maxLen=width - 1.2 * self.text_height)
+        for line in lineList:
+            if line.has("TT"):
+                self.putCentralString(line.text, (width / 2, y), "A", self.text_height, self.color2)
+            elif line.has("Tt"):
+                self.putCentralString(line.text, (width / 2, y), "A", self.text_height, self.color2, maxLen=width - 1.2 * self.text_height)
             else:
-                self.putCentralText(line.split("#", 1)[0], (width / 2, y), "A", self.text_height, self.gap, self.color2)
+                self.putCentralText(line.text, (width / 2, y), "A", self.text_height, self.gap, self.color2)
             y += 1.4 * self.text_height
     def setText(self, text: str):
         """ Set the text of the sign """
@@ -905,11 +990,9 @@ class RoadNoSign(AidSign):
     def __init__(self, scale: int, text_height: int = 30, /, info: dict[str,]|None = None):
         super().__init__(scale, text_height, 0.1, (255), (0), info=info)
     def update(self):
-        if "#C" in self.info["text"]:
-            colorStr = self.info["text"][self.info["text"].find("#C") + 1:].split("#", 1)[0][1:]
-            if len(colorStr) >= 2:
-                self.color1, self.color2, *_ = [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
-        self.img = Image.new("RGBA", (4 * self.text_height * self.scale, 2 * self.text_height * self.scale), (255, 255, 255, 0))
+        if len(colors := parseSharp(self.info["text"]).colors) >= 2:
+            self.color1, self.color2, *_ = colors
+        self.newCanvas((4 * self.text_height * self.scale, 2 * self.text_height * self.scale), (255, 255, 255, 0))
         self.drawTriRoundRect((0, 0, 4 * self.text_height, 2 * self.text_height), self.text_height * 0.1, self.color1, self.color2)
         if len(self.info["text"]) > 0:
             self.putCentralString(self.info["text"], (2 * self.text_height, round(0.5 * self.text_height)), "B", self.text_height, self.color2)
@@ -1,30 +1,55 @@
 import os
 import sys
+import time
+_startTime = time.perf_counter()
 from PyQt5.QtWidgets import QApplication, QMainWindow, QDialog, QFileDialog, QAction, \
                             QWidget, QSplitter, QStackedWidget, QScrollArea, QGroupBox, QTreeWidget, QTreeWidgetItem, QLabel, QTextBrowser, QCheckBox, QComboBox, QSpinBox, QDoubleSpinBox, QLineEdit, \
                             QVBoxLayout, QHBoxLayout, QFormLayout, QStyle
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QStandardPaths, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QIcon, QImage, QPixmap
-try:
-    import signGenerator
-    from signGenerator import Sign
-    SIGN_TEMPLATES = True
-except:
-    SIGN_TEMPLATES = False
-try:
-    import signGeneral
-    from signGeneral import Sign
-    SIGN_GENERAL = True
-except:
-    SIGN_GENERAL = False
 from copy import deepcopy
+from importlib import import_module
+from importlib.util import find_spec
 from json import dump, load, loads
+from threading import Condition
+from typing import TYPE_CHECKING
 from PIL import Image, ImageDraw, ImageFont
+if TYPE_CHECKING:
+    from signTemplate import Sign
+
+# The sign modules (numpy, cv2, pypinyin...) are imported when a sign type is chosen
+SIGN_TEMPLATES = find_spec("signGenerator") is not None
+SIGN_GENERAL = find_spec("signGeneral") is not None
+SIGN_VECTOR = find_spec("signVector") is not None
+startupTimes: dict[str, float] = {"导入 PyQt5 / PIL": time.perf_counter() - _startTime}
+""" The seconds of the startup steps and the deferred imports """
+DEFERRED_MODULES = ["signGenerator", "signGeneral", "signVector", "signDisplay", "signCache", "signTemplate", "textGenerator", "pypinyin", "cv2", "numpy"]
+""" The heavy modules not imported at startup """
+RENDER_CACHE_BYTES = 128 * 1024 * 1024
+""" The size limit of the PNG files of the finished renders in the user cache directory (0 to keep them only in memory) """
+SHAPE_NAMES = {"text": "文字", "rectangle": "矩形", "ellipse": "椭圆", "polygon": "多边形", "arc": "弧线", "circle": "圆"}
+""" The names of the display list items shown with the mouse position """
+
+def loadModule(name: str):
+    """ Import the module on first use and record the time """
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = import_module(name)
+        startupTimes[f"导入 {name}"] = time.perf_counter() - start
+    return module
 
 def getFilePath(*paths: str):
     """ Get the path from the code file """
     return os.path.join(os.path.dirname(__file__), *paths)
 
+def renderCacheDir() -> str|None:
+    """ The directory of the render cache in the user cache location, None to keep the renders only in memory """
+    location = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+    if RENDER_CACHE_BYTES <= 0 or location == "":
+        return None
+    return os.path.join(location, "renderCache")
+
 class TrackableImageLabel(QLabel):
     """ Display image and mouse position """
     mouseMoved = pyqtSignal(int, int)  # send pos
@@ -98,7 +123,7 @@ class SignGeneratorGUI(QMainWindow):
     """ The GUI """
     info = {}
     """ The infomation of the sign """
-    sign: Sign = None
+    sign: "Sign" = None
     """ The sign """
     def __init__(self):
         super().__init__()
@@ -150,10 +175,21 @@ class SignGeneratorGUI(QMainWindow):
         sharpHelpAction = QAction("可用井号(#)列表", self)
         sharpHelpAction.triggered.connect(self.helpSharpDialog.show)
         helpMenu.addAction(sharpHelpAction)
+        debugMenu = menuBar.addMenu("调试")
+        startupAction = QAction("启动耗时", self)
+        startupAction.triggered.connect(self.showStartupTimes)
+        debugMenu.addAction(startupAction)
+        self.startupDialog: TextDialog = None
         # Load data
         self.scale_factor = 10
+        self.preview_scale = 2
+        """ The scale of the quick preview before rendering with <code>scale_factor</code> """
         self.isGenerate = False
-        self.generator: Generator = None
+        self.previewShown = False
+        self.scheduler = RenderScheduler(self)
+        self.scheduler.preview.connect(self.signPreview)
+        self.scheduler.finish.connect(self.signUpdateFinished)
+        self.scheduler.start()
         self.sign_type: str = None
         self.noEn = False
         self.straightArrow = ["←", "↖", "↑", "↗", "→", "↘", "↓", "↙", "↶", "↰", "↱"]
@@ -173,6 +209,8 @@ class SignGeneratorGUI(QMainWindow):
         self.setWindowIcon(QIcon(getFilePath("icon/icon.png")))
         self.load_selection()
         self.stacked_widget.setCurrentIndex(0)
+        startupTimes["创建应用和窗口"] = time.perf_counter() - _startTime - sum(startupTimes.values())
+        QTimer.singleShot(0, lambda: startupTimes.setdefault("显示窗口 (总计)", time.perf_counter() - _startTime))
     def load_selection(self):
         """ Load selection nodes """
         self.tree.clear()
@@ -231,16 +269,27 @@ class SignGeneratorGUI(QMainWindow):
     def saveImg(self):
         """ Save the current sign """
         if self.sign:
-            filePath, _ = QFileDialog.getSaveFileName(self, "保存图片", getFilePath("sign.png"), "PNG文件(*.png);;所有文件 (*)")
+            filePath, _ = QFileDialog.getSaveFileName(self, "保存图片", getFilePath("sign.png"), "PNG文件(*.png);;SVG文件(*.svg);;PDF文件(*.pdf);;所有文件 (*)" if SIGN_VECTOR else "PNG文件(*.png);;所有文件 (*)")
             if filePath:
                 if not "." in filePath:
                     filePath += ".png"
-                self.sign.save(filePath)
+                if SIGN_VECTOR and os.path.splitext(filePath)[1].lower() in (".svg", ".pdf"):
+                    loadModule("signVector").saveVector(self.sign, filePath, self.scale_factor)
+                else:
+                    self.sign.save(filePath)
         else:
             print("No sign!")
     def setSign(self, signType: str, /, info: dict|None = None):
         """ Set sign with info """
         self.sign_type = signType
+        try:
+            if self.sign_type == "通用标牌":
+                signGeneral = loadModule("signGeneral")
+            else:
+                signGenerator = loadModule("signGenerator")
+        except Exception as e:
+            print("Sign module error:", e)
+            return self.stacked_widget.setCurrentIndex(0)
         if False:
             pass
         elif self.sign_type == "环岛式":
@@ -269,20 +318,11 @@ class SignGeneratorGUI(QMainWindow):
             return self.stacked_widget.setCurrentIndex(0)
         self.noEn = ("english scale" in self.sign.info and self.sign.info["english scale"] == 0)
         self.changeInfo()
-        if self.isGenerate:
-            if self.generator is not None:
-                self.generator.deleteLater()
-            self.generator = Updator(self)
-        else:
+        if not self.isGenerate:
             self.isGenerate = True
             self.signRefresh()
-            '''self.loader = ImageLoader(self)
-            self.loader.refreshFunc.connect(self.signRefresh)
-            self.loader.start()'''
-            generator = Updator(self)
-            generator.finish.connect(self.signUpdateFinished)
-            generator.start()
-            self.stacked_widget.setCurrentIndex(1)
+        self.scheduler.submit(self.sign, self.info.copy())
+        self.stacked_widget.setCurrentIndex(1)
     def changeInfo(self):
         """ Set the info boxes """
         vPos = self.sign_info.verticalScrollBar().value()
@@ -427,23 +467,47 @@ class SignGeneratorGUI(QMainWindow):
         if vPos > 0:
             bar = self.sign_info.verticalScrollBar()
             bar.setValue(min(vPos, bar.maximum()))
+    def getValues(self) -> dict[str,]:
+        """ Get the values of the info widgets """
+        values: dict[str,] = {}
+        for key, widget in self.info_widgets.items():
+            value = None
+            if isinstance(widget, dict):
+                value: dict[str,] = {}
+                for k, v in widget.items():
+                    if isinstance(v, QCheckBox):
+                        value[k] = v.isChecked()
+                    elif isinstance(v, QSpinBox):
+                        value[k] = v.value()
+                    elif isinstance(v, QDoubleSpinBox):
+                        value[k] = v.value()
+                    elif isinstance(v, QComboBox):
+                        value[k] = v.currentText()
+                    elif isinstance(v, QLineEdit):
+                        value[k] = v.text()
+            elif isinstance(widget, QCheckBox):
+                value = widget.isChecked()
+            elif isinstance(widget, QSpinBox):
+                value = widget.value()
+            elif isinstance(widget, QDoubleSpinBox):
+                value = widget.value()
+            elif isinstance(widget, QComboBox):
+                value = widget.currentText()
+            elif isinstance(widget, QLineEdit):
+                value = widget.text()
+            values[key] = value
+        return values
     def signUpdate(self):
         """ Update changing data to sign """
-        if self.isGenerate:
-            if self.generator is not None:
-                self.generator.deleteLater()
-            self.generator = Generator(self)
-        else:
+        if not self.isGenerate:
             self.isGenerate = True
             self.signRefresh()
-            generator = Generator(self)
-            '''self.loader = ImageLoader(self)
-            self.loader.refreshFunc.connect(self.signRefresh)
-            self.loader.start()'''
-            generator.finish.connect(self.signUpdateFinished)
-            generator.start()
-    def signUpdateFinished(self, newInfo: dict[str,]|None = None, change: list[str]|None = None):
+        self.scheduler.submit(self.sign, self.info.copy(), self.getValues())
+    def signUpdateFinished(self, newInfo: dict[str,]|None = None, change: list[str]|None = None, generation: int|None = None):
         """ Set the data for finished update """
+        if generation is not None and self.scheduler.isStale(generation):
+            return
+        self.isGenerate = False
         noEn = ("english scale" in self.sign.info and self.sign.info["english scale"] == 0)
         if newInfo is not None:
             if "line" in self.info and self.info["line"] != newInfo["line"]:
@@ -458,18 +522,10 @@ class SignGeneratorGUI(QMainWindow):
             self.noEn = noEn
             self.changeInfo()
             return self.signRefresh()
-        if self.generator is not None:
-            generator = self.generator
-            self.generator = None
-            generator.finish.connect(self.signUpdateFinished)
-            generator.start()
-            return self.signRefresh()
-        self.isGenerate = False
         if change is not None:
             for item in change:
                 if item in {"num", "layers"} or "#ALL" in item:
-                    if self.generator is None:
-                        self.changeInfo()
+                    self.changeInfo()
                     return self.signRefresh()
             for key, widget in self.info_widgets.items():
                 key = key.split("#", 1)[0]
@@ -507,12 +563,19 @@ class SignGeneratorGUI(QMainWindow):
                     else:
                         widget.setValue(value)
         self.signRefresh()
+    def signPreview(self, img: Image.Image, scale: int, generation: int):
+        """ Show the low resolution preview """
+        if self.scheduler.isStale(generation):
+            return
+        self.previewShown = True
+        self.image_label.setImage(img, scale)
     def signRefresh(self, img: Image.Image|None = None):
         """ Refresh QLabel image """
         if img is None:
             if self.sign and self.sign.img:
                 img = self.sign.img
         if img is not None:
+            self.previewShown = False
             if self.isGenerate:
                 # 创建半透明阴影层 (50% 不透明度)
                 shadow = Image.new("RGBA", img.size, (0, 0, 0, 128))
@@ -530,10 +593,36 @@ class SignGeneratorGUI(QMainWindow):
                 text_position = ((width - text_width) // 2, (height - text_height) // 2)
                 draw.text(text_position, text, fill="white", font=self.font)
             self.image_label.setImage(img, self.sign.scale)
+    def closeEvent(self, event):
+        """ Stop the render thread """
+        self.scheduler.stop()
+        self.scheduler.wait()
+        super().closeEvent(event)
+    def showStartupTimes(self):
+        """ Show the startup steps and the import time breakdown of the sign modules (measured in a new interpreter) """
+        lines = ["启动步骤:"] + [f"  {name}: {seconds * 1000:.1f}ms" for name, seconds in startupTimes.items()]
+        lines += ["", "延迟导入: " + ", ".join([f"{name}({'已加载' if name in sys.modules else '未加载'})" for name in DEFERRED_MODULES])]
+        try:
+            timeList = loadModule("signProfiler").importTimes(["signGenerator", "signGeneral"])
+            lines += ["", "模块导入耗时 (-X importtime, 累计/自身):"] + [f"  {cumulative / 1000:8.1f}ms {selfTime / 1000:8.1f}ms  {name}" for name, selfTime, cumulative in timeList]
+        except Exception as e:
+            lines += ["", f"无法测量导入耗时: {e}"]
+        if self.startupDialog is None:
+            self.startupDialog = TextDialog(self, title="调试", headText="启动耗时")
+            self.startupDialog.widget.setStyleSheet("font-family: monospace;")
+        self.startupDialog.setText("\n".join(lines))
+        self.startupDialog.show()
     def updatePosDisplay(self, x, y):
         """ Refresh pos bar display """
         if x >= 0 and y >= 0:
-            self.coord_label.setText(f"坐标: ({x}, {y})")
+            text = f"坐标: ({x}, {y})"
+            layout = self.scheduler.layout
+            if layout is not None and self.sign is not None:
+                hitList = layout.hitTest(x * self.sign.scale, y * self.sign.scale)
+                if len(hitList) > 0:
+                    _, kind, element = hitList[0]
+                    text += f" {element if element is not None else SHAPE_NAMES.get(kind, kind)}"
+            self.coord_label.setText(text)
         else:
             self.coord_label.setText("坐标: (-, -)")
 
@@ -593,54 +682,92 @@ r'''class ImageLoader(QThread):
         #self.parent_.signRefresh()
         self.quit()'''
 
-class Updator(QThread):
-    """ run sign.update method """
-    finish = pyqtSignal()  # connect to finish
+class RenderScheduler(QThread):
+    """ Render the latest requested sign state on a single worker thread """
+    preview = pyqtSignal(object, int, int)  # connect to preview (image, scale, generation)
+    finish = pyqtSignal(object, object, int)  # connect to finish (info, change, generation)
     def __init__(self, parent: SignGeneratorGUI):
         super().__init__(parent)
         self.parent_ = parent
+        self.condition = Condition()
+        self.job: dict[str,]|None = None
+        """ The latest request, replaced by newer requests before rendering """
+        self.generation = 0
+        """ Increased by each request, results of older generations are stale """
+        self.running = True
+        self.sign: "Sign" = None
+        self.staleKeys: list[str]|None = None
+        """ The changed info keys not yet rendered with <code>scale_factor</code> (None for the whole sign) """
+        self.renderCache = None
+        """ The <code>signCache.RenderCache</code> of the finished renders (created on the first render) """
+        self.layout = None
+        """ The display list of the last finished render (<code>signDisplay.layoutSign</code>), used to hit-test the mouse position """
+    def submit(self, sign: "Sign", info: dict[str,], values: dict[str,]|None = None) -> int:
+        """ Request rendering the sign with the widget values (None to render the whole sign), return the generation """
+        with self.condition:
+            self.generation += 1
+            self.job = {"sign": sign, "info": info, "values": values, "generation": self.generation}
+            self.condition.notify()
+            return self.generation
+    def isStale(self, generation: int) -> bool:
+        """ Whether the generation is replaced by a newer request """
+        return generation != self.generation
+    def stop(self):
+        """ Cancel the render and stop the thread """
+        with self.condition:
+            self.running = False
+            self.generation += 1
+            self.condition.notify()
     def run(self):
-        self.parent_.sign.update()
-        self.finish.emit()
-        self.quit()
-
-class Generator(QThread):
-    """ run the generating sign.update method with change """
-    finish = pyqtSignal(dict, list)  # connect to finish
-    def __init__(self, parent: SignGeneratorGUI):
-        super().__init__(parent)
-        self.parent_ = parent
-    def run(self):
-        sign = self.parent_.sign
-        info = self.parent_.info.copy()
-        info_widgets = self.parent_.info_widgets
+        while True:
+            with self.condition:
+                while self.running and self.job is None:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                job, self.job = self.job, None
+            sign: "Sign" = job["sign"]
+            generation: int = job["generation"]
+            sign.cancelCheck = lambda: self.isStale(generation)
+            self.layout = None
+            RenderCancelled = loadModule("signTemplate").RenderCancelled
+            info, change, keys = None, None, None
+            try:
+                if job["values"] is not None:
+                    info, change, keys = self.setValues(sign, job["info"], job["values"])
+                self.render(sign, keys, generation)
+                self.layout = self.layoutSign(sign)
+                self.finishPinyin(not self.isStale(generation))
+            except RenderCancelled:
+                self.finishPinyin(False)
+                continue
+            except Exception as e:
+                print("Render error:", e)
+                self.staleKeys = None
+                self.finishPinyin(False)
+            finally:
+                sign.cancelCheck = None
+            self.finish.emit(info, change, generation)
+    def finishPinyin(self, save: bool):
+        """ Save the new transliterations to the pinyin table if the render is finished and current, drop those of the intermediate text otherwise """
+        signGenerator = sys.modules.get("signGenerator")
+        if signGenerator is not None:
+            if save:
+                signGenerator.savePinyin()
+            else:
+                signGenerator.discardPinyin()
+    def layoutSign(self, sign: "Sign"):
+        """ Record the display list of the rendered sign, None if it fails """
+        try:
+            return loadModule("signDisplay").layoutSign(sign)
+        except Exception:
+            return None
+    def setValues(self, sign: "Sign", info: dict[str,], values: dict[str,]) -> tuple[dict[str,], list[str], list[str]]:
+        """ Set the changed widget values to the sign without drawing, return the new info, the changes and the changed keys """
         change: list[str] = []
-        for key, widget in info_widgets.items():
+        keys: list[str] = []
+        for key, value in values.items():
             if key in sign.info:
-                value = None
-                if isinstance(widget, dict):
-                    value: dict[str,] = {}
-                    for k, v in widget.items():
-                        if isinstance(v, QCheckBox):
-                            value[k] = v.isChecked()
-                        elif isinstance(v, QSpinBox):
-                            value[k] = v.value()
-                        elif isinstance(v, QDoubleSpinBox):
-                            value[k] = v.value()
-                        elif isinstance(v, QComboBox):
-                            value[k] = v.currentText()
-                        elif isinstance(v, QLineEdit):
-                            value[k] = v.text()
-                elif isinstance(widget, QCheckBox):
-                    value = widget.isChecked()
-                elif isinstance(widget, QSpinBox):
-                    value = widget.value()
-                elif isinstance(widget, QDoubleSpinBox):
-                    value = widget.value()
-                elif isinstance(widget, QComboBox):
-                    value = widget.currentText()
-                elif isinstance(widget, QLineEdit):
-                    value = widget.text()
                 if key in info:
                     if isinstance(value, str) and isinstance(sign.info[key], list|dict):
                         try:
@@ -657,13 +784,15 @@ class Generator(QThread):
                                         change.append(f"{key}#ALL")
                                         change_.insert(0, "break")
                                     change_.append(f"{key}#{k}")
-                            sign.autoSet(key, value)
+                            sign.autoSet(key, value, False)
+                            keys.append(key)
                             if len(change_) > 0 and change_[0] != "break":
                                 change += change_
                     elif info[key] != value:
                         info[key] = value
                         change.append(key)
-                        sign.autoSet(key, value)
+                        sign.autoSet(key, value, False)
+                        keys.append(key)
                 else:
                     info[key] = value
                     change.append(key)
@@ -673,10 +802,44 @@ class Generator(QThread):
                         except Exception:
                             print(f"Not json: {value}")
                     if key in sign.info and sign.info[key] != value:
-                        sign.autoSet(key, value)
-        self.finish.emit(info, change)
-        self.quit()
-
+                        sign.autoSet(key, value, False)
+                        keys.append(key)
+        return (info, change, keys)
+    def render(self, sign: "Sign", keys: list[str]|None, generation: int):
+        """ Copy the render of the same info from the cache, or emit a low resolution preview, then render the changed keys (None for the whole sign) and add it to the cache """
+        if sign is not self.sign:
+            self.sign = sign
+            self.staleKeys = None
+        if keys is None or self.staleKeys is None:
+            self.staleKeys = None
+        else:
+            self.staleKeys += keys
+        signCache = loadModule("signCache")
+        if self.renderCache is None:
+            self.renderCache = signCache.RenderCache(renderCacheDir(), RENDER_CACHE_BYTES, background=True)
+        key = signCache.signKey(sign)
+        if signCache.loadCached(sign, self.renderCache, key):
+            # Reopened or undone, there is no base canvas for a partial refresh of the next change
+            self.staleKeys = None
+            return
+        previewScale = self.parent_.preview_scale
+        if previewScale < sign.scale:
+            previewSign = sign.scaledCopy(previewScale)
+            previewSign.update()
+            if previewSign.img is not None:
+                self.preview.emit(previewSign.img, previewSign.scale, generation)
+        sign.checkCancel()
+        try:
+            if self.staleKeys is None:
+                sign.update()
+            else:
+                sign.refresh(self.staleKeys)
+        except loadModule("signTemplate").RenderCancelled:
+            self.staleKeys = None  # Partly drawn
+            raise
+        self.staleKeys = []
+        if sign.canvas is not None and not self.isStale(generation):
+            self.renderCache.put(key, sign.img)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
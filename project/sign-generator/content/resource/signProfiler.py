@@ -0,0 +1,167 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from json import dump
+
+import textGenerator
+from signTemplate import Sign
+
+FUNCTIONS = ["placeText", "placeTextRun", "generateFontMask", "generateFontMaskArray", "fontLen"]
+""" The <code>textGenerator</code> functions to instrument (also replaced where they are imported by name) """
+MASK_FUNCTIONS = {"generateFontMask", "generateFontMaskArray"}
+""" The functions returning a mask, the area is the size of the mask """
+METHODS = ["placeText", "placeTextRun", "drawRoundRect", "drawHArcBar", "putDirection"]
+""" The <code>Sign</code> methods to instrument, <code>update</code> of every sign class is instrumented as well """
+
+enabled = False
+""" Whether the hooks are installed, nothing is wrapped when disabled """
+records: dict[str, dict[str,]] = {}
+""" <code>{name: {"count", "time", "area", "sites": {site: {"count", "time", "area"}}}}</code>, time in seconds and area in pixels """
+traceEvents: list[dict[str,]] = []
+""" Chrome trace events (when enabled with trace) """
+_trace = False
+_patches: list[tuple[object, str, object]] = []
+_lock = threading.Lock()
+_start = time.perf_counter_ns()
+
+def callSite(depth: int = 2) -> str:
+    """ The caller <code>"file:line function"</code> """
+    frame = sys._getframe(depth)
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+def record(name: str, site: str, start: int, end: int, area: int):
+    """ Add a call to the records """
+    with _lock:
+        item = records.setdefault(name, {"count": 0, "time": 0.0, "area": 0, "sites": {}})
+        siteItem = item["sites"].setdefault(site, {"count": 0, "time": 0.0, "area": 0})
+        for value in (item, siteItem):
+            value["count"] += 1
+            value["time"] += (end - start) / 1e9
+            value["area"] += area
+        if _trace:
+            traceEvents.append({"name": name, "cat": "sign", "ph": "X", "ts": (start - _start) / 1000, "dur": (end - start) / 1000,
+                                "pid": os.getpid(), "tid": threading.get_ident(), "args": {"site": site, "area": area}})
+
+def resultArea(result) -> int:
+    """ The pixel area of a returned mask """
+    if hasattr(result, "shape"):
+        return int(result.shape[0] * result.shape[1])
+    if hasattr(result, "size") and isinstance(result.size, tuple):
+        return result.size[0] * result.size[1]
+    return 0
+
+def wrapFunction(name: str, func):
+    """ Instrument a function, the area is the size of the returned mask (for <code>MASK_FUNCTIONS</code>) """
+    isMask = name in MASK_FUNCTIONS
+    def wrapper(*args, **kwargs):
+        site = callSite()
+        start = time.perf_counter_ns()
+        result = func(*args, **kwargs)
+        record(name, site, start, time.perf_counter_ns(), resultArea(result) if isMask else 0)
+        return result
+    wrapper.__wrapped__ = func
+    return wrapper
+
+def wrapMethod(name: str, func):
+    """ Instrument a <code>Sign</code> method, the area is the bounding box of what it draws """
+    def wrapper(sign: Sign, *args, **kwargs):
+        site = callSite()
+        oldBox, oldTracking = sign.drawBox, sign.tracking
+        sign.drawBox, sign.tracking = None, True
+        start = time.perf_counter_ns()
+        try:
+            result = func(sign, *args, **kwargs)
+            box = sign.drawBox
+        finally:
+            end = time.perf_counter_ns()
+            sign.drawBox, sign.tracking = oldBox, oldTracking
+        sign.markBox(box)
+        record(name, site, start, end, 0 if box is None else max(0, box[2] - box[0]) * max(0, box[3] - box[1]))
+        return result
+    wrapper.__wrapped__ = func
+    return wrapper
+
+def signClasses(cls: type = Sign) -> list[type]:
+    """ The sign class and all its subclasses """
+    classList = [cls]
+    for subclass in cls.__subclasses__():
+        classList += [c for c in signClasses(subclass) if c not in classList]
+    return classList
+
+def patch(owner, attr: str, wrapper):
+    _patches.append((owner, attr, owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)))
+    setattr(owner, attr, wrapper)
+
+def enable(trace: bool = False):
+    """ Install the hooks, record Chrome trace events if trace """
+    global enabled, _trace
+    _trace = trace
+    if enabled:
+        return
+    enabled = True
+    modules = [module for module in sys.modules.values() if getattr(module, "__file__", None) and os.path.dirname(os.path.abspath(module.__file__)) == os.path.dirname(os.path.abspath(__file__))]
+    for name in FUNCTIONS:
+        func = getattr(textGenerator, name)
+        wrapper = wrapFunction(name, func)
+        for module in modules:
+            if module.__dict__.get(name) is func:
+                patch(module, name, wrapper)
+    for name in METHODS:
+        patch(Sign, name, wrapMethod(f"Sign.{name}", Sign.__dict__[name]))
+    for cls in signClasses():
+        if "update" in cls.__dict__:
+            patch(cls, "update", wrapMethod(f"{cls.__name__}.update", cls.__dict__["update"]))
+
+def disable():
+    """ Remove the hooks (the records are kept) """
+    global enabled
+    while len(_patches) > 0:
+        owner, attr, original = _patches.pop()
+        setattr(owner, attr, original)
+    enabled = False
+
+def reset():
+    """ Clear the records and trace events """
+    with _lock:
+        records.clear()
+        traceEvents.clear()
+
+def report() -> dict[str, dict[str,]]:
+    """ A copy of the records, sorted by the total time """
+    with _lock:
+        return {name: dict(item, sites=dict(sorted(item["sites"].items(), key=lambda site: -site[1]["time"])))
+                for name, item in sorted(records.items(), key=lambda item: -item[1]["time"])}
+
+def saveTrace(path: str):
+    """ Save the trace events as Chrome trace json (for <code>chrome://tracing</code> or Perfetto) """
+    with _lock:
+        events = list(traceEvents)
+    with open(path, "w", encoding="utf-8") as file:
+        dump({"traceEvents": events, "displayTimeUnit": "ms"}, file, ensure_ascii=False)
+
+def importTimes(modules: list[str], top: int = 20) -> list[tuple[str, int, int]]:
+    """ Import the modules in a new interpreter with <code>-X importtime</code>, return the slowest <code>(module, self, cumulative)</code> in microseconds """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + ", ".join(modules)],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    timeList = []
+    for line in result.stderr.splitlines():
+        parts = line.removeprefix("import time:").split("|")
+        if line.startswith("import time:") and len(parts) == 3 and parts[0].strip().isdigit():
+            timeList.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return sorted(timeList, key=lambda item: -item[2])[:top]
+
+def profileRender(sign: Sign, tracePath: str|None = None) -> dict[str, dict[str,]]:
+    """ Render the sign with the hooks and return the report of this render, save the Chrome trace if tracePath """
+    wasEnabled = enabled
+    reset()
+    enable(tracePath is not None)
+    try:
+        sign.update()
+    finally:
+        if not wasEnabled:
+            disable()
+    if tracePath is not None:
+        saveTrace(tracePath)
+    return report()
@@ -1,40 +1,113 @@
-from textGenerator import placeText, fontLen
-from math import sin, cos, tan, asin, atan, pi as PI
+import textGenerator
+from textGenerator import LRUCache, registerCache, fontMaskSize, placeText, placeTextRun, fontLen
+from math import sin, cos, tan, asin, atan, floor, ceil, pi as PI
 from PIL import Image, ImageDraw
+from copy import copy, deepcopy
+from functools import wraps
+from inspect import signature
+from typing import NamedTuple
+import numpy as np
+
+measureCache = LRUCache(8192)
+""" Measured text lengths keyed by <code>(kind, text, height, font_type, gap, scale)</code>, shared by all signs """
+registerCache("measure", measureCache.clear)
 
 def isAlpha(string: str):
     return all(["A"<= char <= "z" and char.isalpha() for char in string])
 
+SHARP_FLAGS = ("B", "BC", "C", "D", "H", "N", "NH", "NHH", "NW", "T", "TT", "Tt")
+""" The tag prefixes checked by the drawing, a prefix matches the longer tags (<code>"NH"</code> matches <code>#NHH</code>) """
+
+class SharpText(NamedTuple):
+    """ A string parsed by the sharp (#) tags, shared by <code>parseSharp</code> (do not modify) """
+    string: str
+    text: str
+    """ The text before the first <code>#</code> """
+    sharp: str
+    """ The sharp infomation from the first <code>#</code> (empty if none) """
+    tags: tuple[str, ...]
+    """ The tags after each <code>#</code> """
+    flags: frozenset[str]
+    """ The prefixes in <code>SHARP_FLAGS</code> starting any of the tags """
+    boxColors: tuple[tuple, ...]
+    """ The colors of <code>#BC</code> """
+    colors: tuple[tuple, ...]
+    """ The colors of <code>#C</code> """
+    direction: str
+    """ The character of <code>#D</code> """
+    head: str
+    """ The name of <code>#H</code> """
+    def has(self, flag: str) -> bool:
+        """ Whether a tag starts with flag (one of <code>SHARP_FLAGS</code>) """
+        return flag in self.flags
+
+sharpCache = LRUCache(8192)
+""" Parsed strings keyed by the string """
+registerCache("sharp", sharpCache.clear)
+
+def parseSharp(string: str) -> SharpText:
+    """ Parse the sharp (#) tags of the string once, the result is cached """
+    parsed = sharpCache.get(string)
+    if parsed is None:
+        text, sharp = string, ""
+        if "#" in string:
+            text, sharp = string.split("#", 1)
+            sharp = "#" + sharp
+        tags = tuple(sharp.split("#")[1:])
+        flags = frozenset([flag for flag in SHARP_FLAGS if any([tag.startswith(flag) for tag in tags])])
+        boxColors, colors, direction, head = (), (), "", ""
+        if "BC" in flags:
+            boxColors = tuple([Color.getRGBAColor(color) for color in Color.getDefaultColor(sharp[sharp.find("#BC") + 2:].split("#", 1)[0][1:])])
+        if "C" in flags:
+            colors = tuple([Color.getRGBAColor(color) for color in Color.getDefaultColor(sharp[sharp.find("#C") + 1:].split("#", 1)[0][1:])])
+        if "D" in flags and (aid := sharp[sharp.find("#D") + 2:]) != "":
+            direction = aid[0]
+        if "H" in flags:
+            head = sharp[sharp.find("#H") + 2:].split("#")[0]
+        parsed = SharpText(string, text, sharp, tags, flags, boxColors, colors, direction, head)
+        sharpCache.put(string, parsed)
+    return parsed
+
 def splitSharp(string: str):
     """ Split string to text and sharp infomation """
-    aid = ""
-    if "#" in string:
-        string, aid = string.split("#", 1)
-        aid = "#" + aid
-    return (string, aid)
+    parsed = parseSharp(string)
+    return (parsed.text, parsed.sharp)
 
 def getSharpText(aidStr: str, getType: str):
     """ Get the infomation of the aidStr """
+    parsed = parseSharp(aidStr)
     if getType == "BC":
-        if "#BC" in aidStr:
-            colorStr = aidStr[aidStr.find("#BC") + 2:].split("#", 1)[0][1:]
-            return [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
-        return []
+        return list(parsed.boxColors)
     if getType == "C":
-        if "#C" in aidStr:
-            colorStr = aidStr[aidStr.find("#C") + 1:].split("#", 1)[0][1:]
-            return [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
-        return []
+        return list(parsed.colors)
     if getType == "D":
-        if "#D" in aidStr:
-            aid = aidStr[aidStr.find("#D") + 2:]
-            if aid != "":
-                return aid[0]
-        return ""
+        return parsed.direction
     if getType == "H":
-        if "#H" in aidStr:
-            return aidStr[aidStr.find("#H") + 2:].split("#")[0]
-        return ""
+        return parsed.head
+
+def flatXY(xy) -> list[float]:
+    """ Flatten the coordinates <code>[x0, y0, x1, y1, ...]</code> or <code>[(x0, y0), (x1, y1), ...]</code> """
+    flat = []
+    for value in xy:
+        if isinstance(value, (tuple, list)):
+            flat += value
+        else:
+            flat.append(value)
+    return flat
+
+def unionBox(box1: tuple[int, int, int, int]|None, box2: tuple[int, int, int, int]|None) -> tuple[int, int, int, int]|None:
+    """ The bounding box of both boxes <code>(x0, y0, x1, y1)</code> """
+    if box1 is None:
+        return box2
+    if box2 is None:
+        return box1
+    return (min(box1[0], box2[0]), min(box1[1], box2[1]), max(box1[2], box2[2]), max(box1[3], box2[3]))
+
+def isOverlap(box1: tuple[int, int, int, int]|None, box2: tuple[int, int, int, int]|None) -> bool:
+    """ Whether the boxes <code>(x0, y0, x1, y1)</code> overlap """
+    if box1 is None or box2 is None:
+        return False
+    return box1[0] < box2[2] and box2[0] < box1[2] and box1[1] < box2[3] and box2[1] < box1[3]
 
 def splitDSharpInfo(string: str) -> tuple[str, str]:
     """ Split 1 <code>#D</code> in string """
@@ -86,12 +159,288 @@ class Color:
             color = (*color, 255)
         return color
 
+class RenderCancelled(Exception):
+    """ Raised while drawing when the render is cancelled """
+
+SPRITE_SEEN = "seen"
+""" The sprite cache value of a composite element drawn once (the sprite is made when it is drawn again) """
+spriteCache = LRUCache(None, 64 * 1024 * 1024, lambda sprite: sprite[2].nbytes + (0 if sprite[1] is None else sprite[1].nbytes) if isinstance(sprite, tuple) else 0)
+"""
+    <h4>Pre-rendered composite elements and arrow masks (see <code>Sign.drawSprite</code>), bounded by bytes</h4>
+    <p>Keyed by <code>(method, arguments, scale, textGenerator.strokeTableEnabled, pixel offsets of the coordinates from the 8-aligned origin)</code></p>
+    <p>A value is <code>(box from the origin, RGBA pixels as uint32 or None for a mask of one color, drawn mask)</code>, <code>SPRITE_SEEN</code>, or False if the element blends with what is under it</p>
+"""
+registerCache("sprite", spriteCache.clear)
+spriteCacheEnabled = True
+
+def spriteCached(method):
+    """ Draw the composite element by <code>Sign.drawSprite</code>, the second argument of the method is the position """
+    @wraps(method)
+    def wrapper(self: "Sign", first, pos: tuple[float, float], *args, **kwargs):
+        key = (method.__name__, repr((first, args, sorted(kwargs.items()))))
+        return self.drawSprite(key, pos, None, method, self, first, pos, *args, **kwargs)
+    return wrapper
+
+def arrowCached(method):
+    """ Draw the arrow of one fill color by <code>Sign.drawSprite</code> as a mask, the first argument of the method (<code>xy</code> or <code>pos</code>) places it and the fill is not in the key """
+    methodSignature = signature(method)
+    @wraps(method)
+    def wrapper(self: "Sign", *args, **kwargs):
+        bound = methodSignature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = list(bound.arguments.items())[1:]
+        fill = Color.getRGBAColor(bound.arguments["fill"])
+        key = (method.__name__, repr([value for name, value in arguments[1:] if name != "fill"]))
+        return self.drawSprite(key, flatXY(arguments[0][1]), fill, method, self, *args, **kwargs)
+    return wrapper
+
+class SignDraw:
+    """ The <code>ImageDraw</code> of a sign, it records the drawn area and draws relative to the canvas origin """
+    def __init__(self, sign: "Sign"):
+        self.sign = sign
+        self.draw = None if sign.recordOnly else sign.backend.draw() if sign.backend is not None else ImageDraw.Draw(sign.img)
+    def shift(self, flat: list[float], pad: int = 1) -> list[float]:
+        """ Record the area of the points and move them to the canvas """
+        xList = flat[0::2]
+        yList = flat[1::2]
+        self.sign.markBox((floor(min(xList)) - pad, floor(min(yList)) - pad, ceil(max(xList)) + 1 + pad, ceil(max(yList)) + 1 + pad))
+        x0, y0 = self.sign.origin
+        if x0 == 0 and y0 == 0:
+            return flat
+        return [value - (x0 if i % 2 == 0 else y0) for i, value in enumerate(flat)]
+    def rectangle(self, xy, fill=None, outline=None, width=1):
+        xy = self.shift(flatXY(xy))
+        if self.draw:
+            self.draw.rectangle(xy, fill, outline, width)
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        xy = self.shift(flatXY(xy))
+        if self.draw:
+            self.draw.ellipse(xy, fill, outline, width)
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        xy = self.shift(flatXY(xy))
+        if self.draw:
+            self.draw.polygon(xy, fill, outline, width)
+    def arc(self, xy, start, end, fill=None, width=1):
+        xy = self.shift(flatXY(xy))
+        if self.draw:
+            self.draw.arc(xy, start, end, fill, width)
+    def circle(self, xy, radius, fill=None, outline=None, width=1):
+        x, y = flatXY(xy)
+        x0, y0, _, _ = self.shift([x - radius, y - radius, x + radius, y + radius])
+        if self.draw:
+            self.draw.circle((x0 + radius, y0 + radius), radius, fill, outline, width)
+
 class Sign:
     """ A sign """
     def __init__(self, scale: int):
         self.scale = scale
         self.img: Image.Image = None
+        self.canvas: np.ndarray = None
+        """ The RGBA array shared with <code>self.img</code> """
         self.info: dict[str,] = None
+        self._canvasImg: Image.Image = None
+        self.size: tuple[int, int] = (0, 0)
+        """ The pixel size of the whole sign """
+        self.origin: tuple[int, int] = (0, 0)
+        """ The pixel position of the canvas on the sign (not zero when redrawing a region) """
+        self.clip: tuple[int, int, int, int]|None = None
+        self.recordOnly = False
+        """ Only record the drawn area without drawing """
+        self.drawBox: tuple[int, int, int, int]|None = None
+        self.tracking = False
+        self.baseCanvas: np.ndarray = None
+        """ The canvas before drawing the elements, used to redraw a region """
+        self.elementBox: dict[str, tuple[int, int, int, int]|None] = {}
+        """ The pixel bounding box of the element drawn for each info key """
+        self.cancelCheck = None
+        """ Called while drawing, the render is cancelled (<code>RenderCancelled</code>) if it returns True """
+        self.backend = None
+        """ Records the drawing instead of the canvas (e.g. <code>signVector.VectorBackend</code>), no canvas is created if set """
+        self.makingSprite = False
+        """ Drawing a sprite, the nested elements are drawn directly """
+    def newCanvas(self, size: tuple[int, int], color: tuple = (0, 0, 0, 0)) -> Image.Image:
+        """ Create the transparent canvas of the sign, <code>self.img</code> and <code>self.canvas</code> share the same memory """
+        width, height = size
+        self.size = (max(0, width), max(0, height))
+        self.origin = (0, 0)
+        self.clip = None
+        self.baseCanvas = None
+        self.elementBox = {}
+        if self.backend is not None:
+            self.canvas = self.img = self._canvasImg = None
+            self.backend.begin(self.size, color)
+            return None
+        if width <= 0 or height <= 0:
+            self.canvas = None
+            self.img = Image.new("RGBA", (max(0, width), max(0, height)), color)
+            return self.img
+        self.canvas = np.empty((height, width, 4), np.uint8)
+        self.canvas[:] = color
+        self.img = Image.frombuffer("RGBA", (width, height), self.canvas, "raw", "RGBA", 0, 1)
+        self.img.readonly = 0  # Draw on the shared array instead of a copy
+        self._canvasImg = self.img
+        return self.img
+    def scaledCopy(self, scale: int) -> "Sign":
+        """ Copy the sign settings with another scale (not drawn), e.g. for a low resolution preview """
+        sign = copy(self)
+        sign.scale = scale
+        sign.info = deepcopy(self.info)
+        sign.img = sign.canvas = sign._canvasImg = sign.baseCanvas = sign.backend = None
+        sign.size = (0, 0)
+        sign.elementBox = {}
+        return sign
+    def getCanvas(self) -> np.ndarray|Image.Image:
+        """ Get the RGBA array to composite on (or the image if it is not created by <code>newCanvas</code>) """
+        if self.canvas is not None and self.img is self._canvasImg:
+            return self.canvas
+        return self.img
+    def checkCancel(self):
+        """ Raise <code>RenderCancelled</code> if the render is cancelled """
+        if self.cancelCheck is not None and self.cancelCheck():
+            raise RenderCancelled()
+    def getDraw(self) -> SignDraw:
+        """ Get the <code>ImageDraw</code> of the canvas """
+        self.checkCancel()
+        return SignDraw(self)
+    def markBox(self, box: tuple[int, int, int, int]):
+        """ Record the pixel area being drawn """
+        if self.tracking:
+            self.drawBox = unionBox(self.drawBox, box)
+    def trackBox(self, func, *args, recordOnly: bool = False) -> tuple[int, int, int, int]|None:
+        """ Run the drawing function and return the pixel bounding box of what it draws <p>Nothing is drawn if recordOnly</p> """
+        oldBox, oldTracking, oldRecordOnly = self.drawBox, self.tracking, self.recordOnly
+        self.drawBox, self.tracking, self.recordOnly = None, True, recordOnly or oldRecordOnly
+        try:
+            func(*args)
+            box = self.drawBox
+        finally:
+            self.drawBox, self.tracking, self.recordOnly = oldBox, oldTracking, oldRecordOnly
+        self.markBox(box)
+        return box
+    def drawElement(self, key: str, func, *args) -> tuple[int, int, int, int]|None:
+        """ Draw the element of the info key and record its bounding box, the backend tags what it draws with the key (see <code>signDisplay.DisplayList</code>) """
+        backend = self.backend if hasattr(self.backend, "element") else None
+        if backend is not None:
+            oldElement, backend.element = backend.element, key
+        try:
+            self.elementBox[key] = self.trackBox(func, *args)
+        finally:
+            if backend is not None:
+                backend.element = oldElement
+        return self.elementBox[key]
+    def redrawRegion(self, box: tuple[int, int, int, int], func, *args):
+        """ Restore the pixel region from <code>self.baseCanvas</code> and redraw it by the drawing function """
+        x0, y0, x1, y1 = box
+        # Keep the origin even so that the rounding of the shifted coordinates does not change
+        x0, y0 = max(0, x0 - x0 % 8), max(0, y0 - y0 % 8)
+        x1, y1 = min(self.size[0], x1), min(self.size[1], y1)
+        if x0 >= x1 or y0 >= y1:
+            return
+        region = self.baseCanvas[y0: y1, x0: x1].copy()
+        self.drawOnRegion(region, (x0, y0), func, *args)
+        self.canvas[y0: y1, x0: x1] = region
+    def drawOnRegion(self, region: np.ndarray, origin: tuple[int, int], func, /, *args, **kwargs):
+        """ Run the drawing function on the RGBA array as the region of the sign at the pixel origin (aligned to 8) """
+        canvas, img, canvasImg, oldOrigin, oldClip = self.canvas, self.img, self._canvasImg, self.origin, self.clip
+        self.canvas = region
+        self.img = Image.frombuffer("RGBA", (region.shape[1], region.shape[0]), region, "raw", "RGBA", 0, 1)
+        self.img.readonly = 0
+        self._canvasImg = self.img
+        self.origin, self.clip = origin, (origin[0], origin[1], origin[0] + region.shape[1], origin[1] + region.shape[0])
+        try:
+            func(*args, **kwargs)
+        finally:
+            self.canvas, self.img, self._canvasImg = canvas, img, canvasImg
+            self.origin, self.clip = oldOrigin, oldClip
+    def drawSprite(self, key: tuple, coords: list[float], fill: tuple|None, func, /, *args, **kwargs):
+        """
+            <h4>Draw an element by the drawing function, or copy it from <code>spriteCache</code></h4>
+            <p>The first two coordinates (in units) place the element, the sprite is drawn at the same pixel offsets from an origin aligned to 8 (like <code>redrawRegion</code>), so it is the same as drawing the element</p>
+            <p>Only the mask is kept if fill is given, all the drawn pixels must be the RGBA fill</p>
+            <p>Drawn directly by other backends, when only recording, the first time, or if the element is not inside the canvas</p>
+        """
+        canvas = self.getCanvas()
+        if not spriteCacheEnabled or self.recordOnly or self.makingSprite or self.backend is not None or not isinstance(canvas, np.ndarray):
+            return func(*args, **kwargs)
+        x, y = coords[0] * self.scale, coords[1] * self.scale
+        x0, y0 = floor(x) - floor(x) % 8, floor(y) - floor(y) % 8
+        key = (*key, self.scale, textGenerator.strokeTableEnabled, *[value * self.scale - (y0 if i % 2 else x0) for i, value in enumerate(coords)])
+        sprite = spriteCache.get(key)
+        if sprite is None:
+            spriteCache.put(key, SPRITE_SEEN)
+            return func(*args, **kwargs)
+        if sprite is SPRITE_SEEN:
+            sprite = self.makeSprite((x0, y0), fill, func, *args, **kwargs)
+            spriteCache.put(key, sprite)
+        if sprite is False:
+            return func(*args, **kwargs)
+        box, pixels, mask = sprite
+        left, top = x0 + box[0] - self.origin[0], y0 + box[1] - self.origin[1]
+        if left < 0 or top < 0 or left + mask.shape[1] > canvas.shape[1] or top + mask.shape[0] > canvas.shape[0]:
+            return func(*args, **kwargs)
+        self.checkCancel()
+        self.markBox((x0 + box[0], y0 + box[1], x0 + box[2], y0 + box[3]))
+        area = canvas[top: top + mask.shape[0], left: left + mask.shape[1]].view(np.uint32)[..., 0]
+        # One 32-bit copy per pixel
+        np.copyto(area, np.array(fill, np.uint8).view(np.uint32)[0] if pixels is None else pixels, where=mask)
+    def makeSprite(self, origin: tuple[int, int], fill: tuple|None, func, /, *args, **kwargs) -> tuple|bool:
+        """ Draw the element on two backgrounds, return <code>(box from origin, RGBA pixels as uint32 or None for fill, drawn mask)</code>, or False if a pixel depends on the background (or is not fill) """
+        box = self.trackBox(lambda: func(*args, **kwargs), recordOnly=True)
+        if box is None or box[0] >= box[2] or box[1] >= box[3] or box[0] < 0 or box[1] < 0 or box[2] > self.size[0] or box[3] > self.size[1]:
+            return False  # Not inside the sign (e.g. the whole circle of an arc), always drawn directly
+        # The region origin must stay aligned to 8
+        x0 = origin[0] - (-((origin[0] - box[0]) // -8) * 8 if box[0] < origin[0] else 0)
+        y0 = origin[1] - (-((origin[1] - box[1]) // -8) * 8 if box[1] < origin[1] else 0)
+        regionList = []
+        self.makingSprite = True
+        try:
+            for color in ((1, 2, 3, 4), (251, 252, 253, 254)):
+                region = np.empty((box[3] - y0, box[2] - x0, 4), np.uint8)
+                region[:] = color
+                self.drawOnRegion(region, (x0, y0), func, *args, **kwargs)
+                regionList.append(region[box[1] - y0:, box[0] - x0:])
+        finally:
+            self.makingSprite = False
+        drawn = np.all(regionList[0] == regionList[1], axis=2)
+        kept = np.all(regionList[0] == (1, 2, 3, 4), axis=2) & np.all(regionList[1] == (251, 252, 253, 254), axis=2)
+        if not np.all(drawn | kept):
+            return False
+        if fill is None:
+            pixels = np.ascontiguousarray(regionList[0]).view(np.uint32)[..., 0]
+            pixels.setflags(write=False)
+        elif np.all(regionList[0][drawn] == fill):
+            pixels = None
+        else:
+            return False
+        drawn.setflags(write=False)
+        return ((box[0] - origin[0], box[1] - origin[1], box[2] - origin[0], box[3] - origin[1]), pixels, drawn)
+    def placeText(self, pos: tuple[int, int], text: str, font_type: str, font_height: float, color: tuple, maxLen: int|None = None):
+        """ Put text on the canvas with pixel position and height, font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code>. """
+        if len(text) == 0:
+            return
+        self.checkCancel()
+        if self.tracking:
+            height, width = fontMaskSize(text, font_type, font_height, maxLen=maxLen)
+            self.markBox((int(pos[0]), int(pos[1]), int(pos[0]) + width, int(pos[1]) + height))
+        if self.recordOnly:
+            return
+        if self.backend is not None:
+            self.backend.placeText(pos, text, font_type, font_height, color, maxLen)
+        else:
+            placeText(self.getCanvas(), (pos[0] - self.origin[0], pos[1] - self.origin[1]), text, font_type, font_height, color, maxLen, self.clip is None)
+    def placeTextRun(self, pos: tuple[int, int], glyphList: list[tuple[int, str]], font_type: str, font_height: float, color: tuple):
+        """ Put a run of glyphs on the canvas with pixel position and height """
+        self.checkCancel()
+        if self.tracking:
+            sizeList = [(x, fontMaskSize(text, font_type, font_height)) for x, text in glyphList if len(text) > 0]
+            if len(sizeList) > 0:
+                self.markBox((int(pos[0]), int(pos[1]), int(pos[0]) + max([x + size[1] for x, size in sizeList]), int(pos[1]) + sizeList[0][1][0]))
+        if self.recordOnly:
+            return
+        if self.backend is not None:
+            self.backend.placeTextRun(pos, glyphList, font_type, font_height, color)
+        else:
+            placeTextRun(self.getCanvas(), (pos[0] - self.origin[0], pos[1] - self.origin[1]), glyphList, font_type, font_height, color, self.clip is None)
     def drawRoundRect(self, xy: tuple[float, float, float, float], rad: float, fill: tuple = None):
         """ Draw rounded rectangle on image """
         x0, y0, x1, y1 = xy
@@ -100,7 +449,7 @@ class Sign:
         x1 *= self.scale
         y1 *= self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         if rad == 0:
             draw.rectangle([x0, y0, x1, y1], fill=fill)
             return
@@ -114,14 +463,14 @@ class Sign:
     def drawBiRoundRect(self, xy: tuple[float, float, float, float], gap: float, fill1: tuple = None, fill2: tuple = None):
         """ Draw double rounded rectangle on image """
         if xy is None:
-            xy = (0, 0, self.img.size[0] / self.scale, self.img.size[1] / self.scale)
+            xy = (0, 0, self.size[0] / self.scale, self.size[1] / self.scale)
         x0, y0, x1, y1 = xy
         self.drawRoundRect(xy, gap * 3, fill2)
         self.drawRoundRect((x0 + gap, y0 + gap, x1 - gap, y1 - gap), gap * 2, fill1)
     def drawTriRoundRect(self, xy: tuple[float, float, float, float], gap: float, fill1: tuple = None, fill2: tuple = None):
         """ Draw triple rounded rectangle on image """
         if xy is None:
-            xy = (0, 0, self.img.size[0] / self.scale, self.img.size[1] / self.scale)
+            xy = (0, 0, self.size[0] / self.scale, self.size[1] / self.scale)
         x0, y0, x1, y1 = xy
         self.drawRoundRect(xy, gap * 4, fill1)
         self.drawRoundRect((x0 + gap, y0 + gap, x1 - gap, y1 - gap), gap * 3, fill2)
@@ -135,7 +484,7 @@ class Sign:
         y1 *= self.scale
         rad *= self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.ellipse([x0, y0, x0 + 2*rad, y0 + 2*rad], fill=fill)
         draw.ellipse([x1 - 2*rad, y0, x1, y0 + 2*rad], fill=fill)
         draw.ellipse([x0, y1 - 2*rad, x0 + 2*rad, y1], fill=fill)
@@ -147,7 +496,7 @@ class Sign:
         x, y = pos
         lineWidth /= 2
         color = Color.getRGBAColor(color)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         posList = [-lineWidth * text_height * cos(-angle), lineWidth * text_height * sin(-angle)]
         posList += [lineWidth * text_height * cos(-angle), -lineWidth * text_height * sin(-angle)]
         posList += [posList[2] + (lineLen - lineWidth + 0.1) * text_height * sin(angle), posList[3] - (lineLen - lineWidth + 0.1) * text_height * cos(angle)]
@@ -164,7 +513,7 @@ class Sign:
         y2 *= self.scale
         lineWidth *= text_height * self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         x3 = x2 + lineWidth * 1.732 / 2 if x1 < x2 else x2 - lineWidth * 1.732 / 2
         if y1 == y2:
             draw.polygon([round(x2), round(y2 - lineWidth / 2), round(x2), round(y2 + lineWidth / 2), round(x3), round(y2)], fill=fill)
@@ -183,6 +532,7 @@ class Sign:
             ang1 = 90
             draw.polygon([round(x2), round(y2), round(x2), round(y2 - lineWidth), round(x3), round(y2 - lineWidth / 2)], fill=fill)
         draw.arc((round(x2 - r), round(y0 - r), round(x2 + r), round(y0 + r)), min(ang0, ang1), max(ang0, ang1), fill=fill, width=round(lineWidth))
+    @arrowCached
     def drawLeftArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw left arrow on image """
         x0, y0, x1, y1 = xy
@@ -194,9 +544,10 @@ class Sign:
         h = (y1 - y0) / 3
         x = min(x1, x0 + 3 * h)
         y = (y0 + y1) / 2
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x, y0, x0 + 3/2 * h, y0, x0, y, x0 + 3/2 * h, y1, x, y1, x - 3/2 * h, y], fill=fill)
         draw.rectangle([x0 + h / 2, y - h / 2, x1, y + h / 2], fill=fill)
+    @arrowCached
     def drawUpLeftArrow(self, pos: tuple[float, float], height, arrowSize: float = 1/4, fill: tuple = (255)):
         """ Draw up-left arrow on image (arrowSize ∈ (0, 0.6)) """
         x, y = pos
@@ -205,9 +556,10 @@ class Sign:
         height *= self.scale
         fill = Color.getRGBAColor(fill)
         w0 = 2/3 * arrowSize
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x, y, x + height / 2, y, x + (1/2 + arrowSize) * height, y + arrowSize * height, x + (arrowSize + w0) * height, y + arrowSize * height, x + height, y + (1 - w0) * height, 
                       x + (1 - w0) * height, y + height, x + arrowSize * height, y + (arrowSize + w0) * height, x + arrowSize * height, y + (1/2 + arrowSize) * height, x, y + height / 2], fill=fill)
+    @arrowCached
     def drawUpArrow(self, xy: tuple[float, float, float, float], arrowSize: float = 1.0, fill: tuple = (255)):
         """ Draw up arrow on image """
         x0, y0, x1, y1 = xy
@@ -219,10 +571,11 @@ class Sign:
         w = (x1 - x0) / 3
         y = min(y1, y0 + (arrowSize + 3/2) * w * 1.2)
         x = (x0 + x1) / 2
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x0, y, x0, y0 + 3/2 * w, x, y0, x1, y0 + 3/2 * w, x1, y, x, y - 3/2 * w], fill=fill)
         w *= arrowSize
         draw.rectangle([x - w / 2, y0 + w, x + w / 2, y1], fill=fill)
+    @arrowCached
     def drawUpRightArrow(self, pos: tuple[float, float], height, arrowSize: float = 1/4, fill: tuple = (255)):
         """ Draw up-right arrow on image (arrowSize ∈ (0, 0.6)) """
         x, y = pos
@@ -231,9 +584,10 @@ class Sign:
         height *= self.scale
         fill = Color.getRGBAColor(fill)
         w0 = 2/3 * arrowSize
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x + height, y, x + height / 2, y, x + (1/2 - arrowSize) * height, y + arrowSize * height, x + (1 - arrowSize - w0) * height, y + arrowSize * height, x, y + (1 - w0) * height, 
                       x + w0 * height, y + height, x + (1 - arrowSize) * height, y + (arrowSize + w0) * height, x + (1 - arrowSize) * height, y + (1/2 + arrowSize) * height, x + height, y + height / 2], fill=fill)
+    @arrowCached
     def drawRightArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw right arrow on image """
         x0, y0, x1, y1 = xy
@@ -245,9 +599,10 @@ class Sign:
         h = (y1 - y0) / 3
         x = max(x0, x1 - 3 * h)
         y = (y0 + y1) / 2
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x, y0, x1 - 3/2 * h, y0, x1, y, x1 - 3/2 * h, y1, x, y1, x + 3/2 * h, y], fill=fill)
         draw.rectangle([x0, y - h / 2, x1 - h / 2, y + h / 2], fill=fill)
+    @arrowCached
     def drawDownRightArrow(self, pos: tuple[float, float], height, arrowSize: float = 1/4, fill: tuple = (255)):
         """ Draw down-right arrow on image (arrowSize ∈ (0, 0.6)) """
         x, y = pos
@@ -256,9 +611,10 @@ class Sign:
         height *= self.scale
         fill = Color.getRGBAColor(fill)
         w0 = 2/3 * arrowSize
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x + height, y + height, x + height / 2, y + height, x + (1/2 - arrowSize) * height, y + (1 - arrowSize) * height, x + (1 - arrowSize - w0) * height, y + (1 - arrowSize) * height, x, y + w0 * height, 
                       x + w0 * height, y, x + (1 - arrowSize) * height, y + (1 - arrowSize - w0) * height, x + (1 - arrowSize) * height, y + (1/2 - arrowSize) * height, x + height, y + height / 2], fill=fill)
+    @arrowCached
     def drawDownArrow(self, xy: tuple[float, float, float, float], arrowSize: float = 1.0, fill: tuple = (255)):
         """ Draw large down arrow on image """
         x0, y0, x1, y1 = xy
@@ -271,10 +627,11 @@ class Sign:
         w = (x1 - x0) / 3
         y = max(y0, y1 - (arrowSize + 3/2) * w * 1.2)
         x = (x0 + x1) / 2
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x0, y, x0, y1 - 3/2 * w, x, y1, x1, y1 - 3/2 * w, x1, y, x, y + 3/2 * w], fill=fill)
         w *= arrowSize
         draw.rectangle([x - w / 2, y0, x + w / 2, y1 - w], fill=fill)
+    @arrowCached
     def drawDownLeftArrow(self, pos: tuple[float, float], height, arrowSize: float = 1/4, fill: tuple = (255)):
         """ Draw down-left arrow on image (arrowSize ∈ (0, 0.6)) """
         x, y = pos
@@ -283,9 +640,10 @@ class Sign:
         height *= self.scale
         fill = Color.getRGBAColor(fill)
         w0 = 2/3 * arrowSize
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.polygon([x, y + height, x + height / 2, y + height, x + (1/2 + arrowSize) * height, y + (1 - arrowSize) * height, x + (arrowSize + w0) * height, y + (1 - arrowSize) * height, x + height, y + w0 * height, 
                       x + (1 - w0) * height, y, x + arrowSize * height, y + (1 - arrowSize - w0) * height, x + arrowSize * height, y + (1/2 - arrowSize) * height, x, y + height / 2], fill=fill)
+    @arrowCached
     def drawUTurnArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw an U-turn arrow on image """
         x0, y0, x1, y1 = xy
@@ -297,9 +655,10 @@ class Sign:
             x1 *= self.scale
             y1 *= self.scale
             lineWidth *= self.scale
-            draw = ImageDraw.Draw(self.img)
+            draw = self.getDraw()
             draw.arc([x0 + lineWidth, y0, x1, y0 + 4 * lineWidth], 180, 0, Color.getRGBAColor(fill), round(lineWidth))
             draw.rectangle([x1 - lineWidth, y0 + 2 * lineWidth, x1, y1], Color.getRGBAColor(fill))
+    @arrowCached
     def drawLeftTurnArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw an left turn arrow on image """
         x0, y0, x1, y1 = xy
@@ -311,9 +670,10 @@ class Sign:
             x1 *= self.scale
             y1 *= self.scale
             lineWidth *= self.scale
-            draw = ImageDraw.Draw(self.img)
+            draw = self.getDraw()
             draw.arc([x0 + lineWidth, y0 + lineWidth, x1, y0 + 5 * lineWidth], 270, 0, Color.getRGBAColor(fill), round(lineWidth))
             draw.rectangle([x1 - lineWidth, y0 + 3 * lineWidth, x1, y1], Color.getRGBAColor(fill))
+    @arrowCached
     def drawRightTurnArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw an right turn arrow on image """
         x0, y0, x1, y1 = xy
@@ -325,7 +685,7 @@ class Sign:
             x1 *= self.scale
             y1 *= self.scale
             lineWidth *= self.scale
-            draw = ImageDraw.Draw(self.img)
+            draw = self.getDraw()
             draw.arc([x0, y0 + lineWidth, x1 - lineWidth, y0 + 5 * lineWidth], 180, 270, Color.getRGBAColor(fill), round(lineWidth))
             draw.rectangle([x0, y0 + 3 * lineWidth, x0 + lineWidth, y1], Color.getRGBAColor(fill))
     def drawAutoStraightArrow(self, arrowType: str, pos: tuple[float, float], width: float, height: float = None, arrowSize: float|None = None, fill: tuple = (255)):
@@ -355,6 +715,7 @@ class Sign:
             self.drawLeftTurnArrow((x, y, x + width, y + height), fill)
         elif arrowType == "↱":
             self.drawRightTurnArrow((x, y, x + width, y + height), fill)
+    @arrowCached
     def drawLeftCurveArrow(self, xy: tuple[float, float, float, float], lineWidth: int|None = None, fill: tuple = (255)):
         """ Draw rounded left arrow """
         x1, y1, x2, y2 = xy
@@ -366,7 +727,7 @@ class Sign:
             lineWidth = min(x2 - x1, y2 - y1) / 50
         lineWidth *= self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         if x2 - x1 < y2 - y1:
             r = abs(((x1 - x2) ** 2 + (y1 - y2) ** 2) / (x1 - x2) / 2)
             x0, y0 = x2 - r, y2
@@ -394,6 +755,7 @@ class Sign:
         ang0 *= 180 / PI
         ang1 *= 180 / PI
         draw.arc((round(x0 - r), round(y0 - r), round(x0 + r), round(y0 + r)), min(ang0, ang1), max(ang0, ang1), fill=fill, width=round(lineWidth))
+    @arrowCached
     def drawRightCurveArrow(self, xy: tuple[float, float, float, float], lineWidth: int|None = None, fill: tuple = (255)):
         """ Draw rounded right arrow """
         x1, y1, x2, y2 = xy
@@ -405,7 +767,7 @@ class Sign:
             lineWidth = min(x2 - x1, y2 - y1) / 50
         lineWidth *= self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         if x2 - x1 < y2 - y1:
             r = abs(((x1 - x2) ** 2 + (y1 - y2) ** 2) / (x2 - x1) / 2)
             x0, y0 = x1 + r, y2
@@ -433,6 +795,7 @@ class Sign:
         ang0 *= 180 / PI
         ang1 *= 180 / PI
         draw.arc((round(x0 - r), round(y0 - r), round(x0 + r), round(y0 + r)), min(ang0, ang1), max(ang0, ang1), fill=fill, width=round(lineWidth))
+    @arrowCached
     def drawLeftRingArrow(self, xy: tuple[float, float, float, float], fill: tuple = (255)):
         """ Draw an overring left arrow on image """
         x0, y0, x1, y1 = xy
@@ -444,7 +807,7 @@ class Sign:
         y1 *= self.scale
         w *= self.scale
         fill = Color.getRGBAColor(fill)
-        draw = ImageDraw.Draw(self.img)
+        draw = self.getDraw()
         draw.arc([round(x0 + 4 * w), round(y0), round(x1), round(y0 + 4 * w)], -180, 90, fill, round(w))
         draw.rectangle([round(x0 + 4 * w), round(y0 + 2 * w), round(x0 + 5 * w), round(y0 + 2.5 * w)], fill=fill)
         draw.rectangle([round(x0 + 4 * w), round(y0 + 4.5 * w), round(x0 + 5 * w), round(y1)], fill=fill)
@@ -475,9 +838,18 @@ class Sign:
             self.drawLeftRingArrow((x, y, x + width, y + height), fill)
     def getTextLen(self, text: str, font_type: str, font_height: float, gap: float = 0.1):
         """ The total length of each echaracter, font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code>. """
-        if "#Tt" in text:
+        key = ("text", text, font_height, font_type, gap, self.scale)
+        textLen = measureCache.get(key)
+        if textLen is None:
+            textLen = self.measureTextLen(text, font_type, font_height, gap)
+            measureCache.put(key, textLen)
+        return textLen
+    def measureTextLen(self, text: str, font_type: str, font_height: float, gap: float = 0.1):
+        """ Measure the total length of each echaracter without the cache """
+        parsed = parseSharp(text)
+        if parsed.has("Tt"):
             return 0
-        if "#TT" in text:
+        if parsed.has("TT"):
             return fontLen([text], font_type, font_height, self.scale)
         textLen = fontLen([char for char in text if not isAlpha(char)], font_type, font_height, self.scale)
         textLen += fontLen([char for char in text if char in "gjpqy"], font_type, font_height * 0.9, self.scale)
@@ -490,34 +862,39 @@ class Sign:
         y *= self.scale
         if color is None:
             color = (255)
-        if "#" in text:
-            text = text.split("#", 1)[0]
+        text = parseSharp(text).text
+        # Layout the glyphs and group them to runs of the same height
+        runList: list[tuple[tuple[int, float], int, list[tuple[int, str]]]] = []
+        advanceDict: dict[tuple[str, float], float] = {}
         desmo = False
         for char in text:
             if desmo:
                 desmo = char.isdigit()
                 if desmo or isAlpha(char):
-                    placeText(self.img, (round(x), round(y + height * self.scale / 3)), char, font_type, height * 2/3 * self.scale, color)
-                    x += (fontLen(char, font_type, height * 2/3, self.scale) + height * gap) * self.scale
+                    glyphY, glyphH, advanceH = y + height * self.scale / 3, height * 2/3 * self.scale, height * 2/3
                 else:
-                    placeText(self.img, (round(x), round(y)), char, font_type, height * self.scale, color)
-                    x += (fontLen(char, font_type, height, self.scale) + height * gap) * self.scale
+                    glyphY, glyphH, advanceH = y, height * self.scale, height
             elif isAlpha(char):
                 desmo = False
-                y0 = y + height * self.scale / 3
                 h = 0.9 * height if char in "gjpqy" else 2/3 * height
-                placeText(self.img, (round(x), round(y0)), char, font_type, h * self.scale, color)
-                x += (fontLen(char, font_type, h * 2/3, self.scale) + height * gap) * self.scale
+                glyphY, glyphH, advanceH = y + height * self.scale / 3, h * self.scale, h * 2/3
             else:
                 if char == ".":
                     desmo = True
-                placeText(self.img, (round(x), round(y)), char, font_type, height * self.scale, color)
-                x += (fontLen(char, font_type, height, self.scale) + height * gap) * self.scale
+                glyphY, glyphH, advanceH = y, height * self.scale, height
+            runKey = (round(glyphY), round(glyphH))
+            if len(runList) == 0 or runList[-1][0] != runKey or round(x) < runList[-1][1]:
+                runList.append((runKey, round(x), []))
+            runList[-1][2].append((round(x) - runList[-1][1], char))
+            if (char, advanceH) not in advanceDict:
+                advanceDict[(char, advanceH)] = fontLen(char, font_type, advanceH, self.scale)
+            x += (advanceDict[(char, advanceH)] + height * gap) * self.scale
+        for (glyphY, glyphH), runX, glyphList in runList:
+            self.placeTextRun((runX, glyphY), glyphList, font_type, glyphH, color)
     def putCentralText(self, text: str, centralPos: tuple[float, float], font_type: str, height: int, gap: float = 0.1, color: tuple = (255)):
         """ Put text on sign with central pos (North side), font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code>. """
         x, y = centralPos
-        if "#" in text:
-            text = text.split("#", 1)[0]
+        text = parseSharp(text).text
         self.putText(text, (x - self.getTextLen(text, font_type, height, gap) / 2, y), font_type, height, gap, color)
     def putCentralString(self, string: str, centralPos: tuple[float, float], font_type: str, height: int, color: tuple|None = None, maxLen: float|None = None):
         """ Put a string on sign with central pos (North side), font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code>. """
@@ -532,7 +909,7 @@ class Sign:
         halfTextLen = fontLen([text], font_type, height, self.scale) / 2
         if maxLen is not None and maxLen < halfTextLen * 2:
             halfTextLen = maxLen / 2
-        placeText(self.img, (round((x - halfTextLen) * self.scale), round(y * self.scale)), text, font_type, height * self.scale, (255) if color is None else color, None if maxLen is None else round(maxLen * self.scale))
+        self.placeText((round((x - halfTextLen) * self.scale), round(y * self.scale)), text, font_type, height * self.scale, (255) if color is None else color, None if maxLen is None else round(maxLen * self.scale))
     def putAutoCentralString(self, string: str, centralPos: tuple[float, float], font_type: str, height: int, color1: tuple|None = None, color2: tuple|None = None, maxLen: float|None = None):
         """ Put a string on sign with central pos (North side) based on the sharp (#) infomation, <br>font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code>.</br> """
         x, y = centralPos
@@ -540,43 +917,47 @@ class Sign:
         if maxLen is not None and maxLen < halfTextLen * 2:
             halfTextLen = maxLen / 2
         x -= halfTextLen
-        text, sharp = splitSharp(string)
+        parsed = parseSharp(string)
+        text = parsed.text
         if isAlpha(text) and any([char in "gjpqy" for char in text]):
             if all([char in "acemnorsuvwxz -" for char in text]):
                 y += height / 2
                 height *= 2
             else:
                 height *= 4/3
-        if "#D" in sharp:
+        if parsed.has("D"):
             string, dStr = splitDSharpInfo(string)
             maxLen -= 1.1 * height
             self.putDirection(dStr, (x + min(self.getAutoLen(string, height, "A", 0), maxLen) + 0.1 * height, y), height, Color.BLUE if color2 is None else color2, (255) if color1 is None else color1)
-        if "#NW" in sharp:
+        if parsed.has("NW"):
             return self.putWayNo(string, (x, y - height / 6), 4/3 * height)
-        if "#NH" in sharp:
+        if parsed.has("NH"):
             return self.putHighwayNo(string, (x, y - height / 3), 5/3 * height)
-        if "#B" in sharp:
+        if parsed.has("B"):
             return self.putBoxedText(string, (x, y), height, font_type, maxLen= None if maxLen is None else maxLen)
-        placeText(self.img, (round(x * self.scale), round(y * self.scale)), text, font_type, height * self.scale, (255) if color1 is None else color1, None if maxLen is None else round(maxLen * self.scale))
+        self.placeText((round(x * self.scale), round(y * self.scale)), text, font_type, height * self.scale, (255) if color1 is None else color1, None if maxLen is None else round(maxLen * self.scale))
     def putDirection(self, text: str, pos: tuple[float, float], height: int, text_color: tuple, block_color = (255)):
         """ Put the direction block """
-        if "#D" in text:
-            char = getSharpText(text, "D")
+        parsed = parseSharp(text)
+        if parsed.has("D"):
+            char = parsed.direction
         else:
             char = text[0] if len(text) > 1 else text
         if char != "":
             x, y = pos
-            draw = ImageDraw.Draw(self.img)
+            draw = self.getDraw()
             draw.rectangle((round(x) * self.scale, round(y) * self.scale, round(x + height) * self.scale, round(y + height) * self.scale), fill=Color.getRGBAColor(block_color))
             self.putCentralString(char[0], (x + 0.5 * height, y + 0.1 * height), "A", 0.8 * height, Color.getRGBAColor(text_color))
+    @spriteCached
     def putBoxedText(self, text: str, pos: tuple[float, float], height: float, font_type: str, color1 : tuple|None = None, color2 : tuple|None = None, maxLen: float|None = None):
         """ Put boxed text on image """
         if font_type not in {"A", "B", "C"}:
             font_type = "A"
         x, y = pos
-        textStr, sharpStr = splitSharp(text)
-        if "#BC" in sharpStr:
-            colorList = getSharpText(sharpStr, "BC")
+        parsed = parseSharp(text)
+        textStr = parsed.text
+        if parsed.has("BC"):
+            colorList = parsed.boxColors
             if len(colorList) > 1:
                 color2 = colorList[1]
             if len(colorList) > 0:
@@ -596,18 +977,18 @@ class Sign:
     def getWayNoLen(self, numStr: str, height: float):
         """ Get the length of a road-number-sign """
         height /= 2
-        numStr, aidStr = splitSharp(numStr)
-        return max(height * 4, fontLen([numStr], "B", height, self.scale) + height) + (1.8 * height if "#D" in aidStr else 0)
+        parsed = parseSharp(numStr)
+        return max(height * 4, fontLen([parsed.text], "B", height, self.scale) + height) + (1.8 * height if parsed.has("D") else 0)
+    @spriteCached
     def putWayNo(self, numStr: str, pos: tuple[float, float], height: float, color1: tuple|None = None, color2: tuple|None = None, aidFirst: bool = False, outTextColor = Color.GREEN):
         """ Put a road-number-sign on the sign"""
-        numStr, aidStr = splitSharp(numStr)
+        parsed = parseSharp(numStr)
+        numStr = parsed.text
         width = self.getWayNoLen(numStr, height)
         height = height / 2
         x, y = pos
-        if "#C" in aidStr:
-            colorStr = aidStr[aidStr.find("#C") + 1:].split("#", 1)[0][1:]
-            if len(colorStr) >= 2:
-                color1, color2, *_ = [Color.getRGBAColor(color) for color in Color.getDefaultColor(colorStr)]
+        if len(parsed.colors) >= 2:
+            color1, color2, *_ = parsed.colors
         if color1 == None:
             if len(numStr) > 0:
                 if numStr[0] == "G":
@@ -637,22 +1018,25 @@ class Sign:
         self.putWayNo(numStr, (centralPos[0] - self.getWayNoLen(numStr, height) / 2 , centralPos[1]), height, color1, color2)
     def getHighwayNoLen(numStr: str, height: float):
         """ Get the length of the highway sign """
-        numStr, aidStr = splitSharp(numStr)
+        parsed = parseSharp(numStr)
+        numStr = parsed.text
         sumLen = 0
-        if "#NHH" in aidStr:
+        if parsed.has("NHH"):
             return sumLen + max(0.5 + len(numStr) * 0.25, 0.375 * len(numStr)) * height
         return sumLen + (0.5 + len(numStr) * 0.25 if len(numStr) < 5 else 0.575 + 0.225 * len(numStr)) * height
+    @spriteCached
     def putHighwayNo(self, numStr: str, pos: tuple[float, float], height: float, typeStr: str|None = None, color: tuple|None = None):
         """ Put a highway-sign on the sign """
         width = Sign.getHighwayNoLen(numStr, height)
-        numStr, aidStr = splitSharp(numStr)
-        if (sharp := getSharpText(aidStr, "H")) != "":
-            typeStr = sharp
+        parsed = parseSharp(numStr)
+        numStr = parsed.text
+        if parsed.head != "":
+            typeStr = parsed.head
         x, y = pos
         if typeStr is None:
             typeStr = "国家高速" if len(numStr) > 0 and numStr[0] == "G" else "高速"
         textColor = (255) if typeStr == "国家高速" else (0)
-        if len(colorList := getSharpText(aidStr, "C")) > 0:
+        if len(colorList := parsed.colors) > 0:
             color = colorList[0]
             if len(colorList) > 1:
                 textColor = colorList[1]
@@ -667,7 +1051,7 @@ class Sign:
         self.drawhalfRoundRect((x + 0.03 * height, y + 0.03 * height, x + width - 0.03 * height, y + 0.23 * height), 0.06 * height, 0.03 * height, color)
         self.putCentralText(typeStr, (x + width / 2, y + 0.08 * height), "A", 0.1 * height, 10 / self.scale, textColor)
         text_height = 0.45 * height
-        if "#NHH" in aidStr:
+        if parsed.has("NHH"):
             self.putCentralString(numStr, (x + width / 2, y + 0.37 * height), "B", text_height)
         else:
             bigStr = numStr[:3]
@@ -675,32 +1059,44 @@ class Sign:
             bigStrLen = fontLen([bigStr], "B", text_height, self.scale)
             smallStrLen = fontLen([smallStr], "B", text_height * 2/3, self.scale)
             startPos = x + width / 2 - (bigStrLen + smallStrLen) / 2
-            placeText(self.img, (round(startPos * self.scale), round((y + 0.37 * height) * self.scale)), bigStr, "B", text_height * self.scale, Color.getRGBAColor((255)))
-            placeText(self.img, (round(startPos + bigStrLen) * self.scale, round(y + 0.37 * height + text_height / 3) * self.scale), smallStr, "B", text_height * 2/3 * self.scale, Color.getRGBAColor((255)))
+            self.placeText((round(startPos * self.scale), round((y + 0.37 * height) * self.scale)), bigStr, "B", text_height * self.scale, Color.getRGBAColor((255)))
+            self.placeText((round(startPos + bigStrLen) * self.scale, round(y + 0.37 * height + text_height / 3) * self.scale), smallStr, "B", text_height * 2/3 * self.scale, Color.getRGBAColor((255)))
     def putCentralHighwayNo(self, numStr: str, pos: tuple[float, float], height: float, typeStr: str|None = None, color: tuple|None = None):
         """ Put a highway-sign on the sign with pos (North pos) """
         self.putHighwayNo(numStr, (pos[0] - Sign.getHighwayNoLen(numStr, height) / 2, pos[1]), height, typeStr, color)
     def getAutoLen(self, text: str, height: float, font_type: str = "A", gap: float = 0.1) -> float:
         """ Get the length of the string based on the sharp (#) infomation """
+        key = ("auto", text, height, font_type, gap, self.scale)
+        textLen = measureCache.get(key)
+        if textLen is None:
+            textLen = self.measureAutoLen(text, height, font_type, gap)
+            measureCache.put(key, textLen)
+        return textLen
+    def preMeasure(self, textList: list[str], height: float, font_type: str = "A", gap: float = 0.1) -> list[float]:
+        """ Measure a batch of strings (based on the sharp (#) infomation) into the shared cache before drawing """
+        return [self.getAutoLen(text, height, font_type, gap) for text in textList]
+    def measureAutoLen(self, text: str, height: float, font_type: str = "A", gap: float = 0.1) -> float:
+        """ Measure the length of the string based on the sharp (#) infomation without the cache """
         if " " in text:
             textList = [textStr for textStr in text.split(" ") if textStr != ""]
             return sum([self.getAutoLen(textStr, height, font_type, gap) for textStr in textList]) + (len(textList) - 1) * height * gap
-        if "#" not in text:
+        parsed = parseSharp(text)
+        if parsed.sharp == "":
             return self.getTextLen(text, font_type, height, gap)
-        textStr, aidStr = splitSharp(text)
-        if "#Tt" in aidStr:
+        textStr = parsed.text
+        if parsed.has("Tt"):
             return 0
         aidLen = 0
-        if "#TT" in aidStr:
+        if parsed.has("TT"):
             gap = 0
-        if "#D" in aidStr:
+        if parsed.has("D"):
             aidLen += (1 + max(0.1, gap)) * height
-        if "#N" in aidStr:
-            if "#NW" in aidStr:
+        if parsed.has("N"):
+            if parsed.has("NW"):
                 return self.getWayNoLen(text, 4/3 * height) + aidLen
-            elif "#NH" in aidStr:
+            elif parsed.has("NH"):
                 return Sign.getHighwayNoLen(text, 5/3 * height) + aidLen
-        if "#B" in aidStr:
+        if parsed.has("B"):
             return self.getTextLen(textStr, font_type, 0.75 * height, 0) + 0.25 * height + aidLen * 4/3
         return self.getTextLen(textStr, font_type, height, gap) + aidLen
     def putAutoText(self, text: str, pos: tuple[float, float], height: int, typeStr: str|None = None, gap: float = 0.1, color1: tuple|None = None, color2: tuple|None = None, aidFirst: bool = False, outTextColor = Color.GREEN):
@@ -719,37 +1115,38 @@ class Sign:
                     x += self.getAutoLen(textStr, height, typeStr, gap)
                 x += height * gap
         else:
-            if "#" not in text:
+            parsed = parseSharp(text)
+            if parsed.sharp == "":
                 return self.putText(text, pos, typeStr, height, gap, (255) if color1 is None else color1)
-            textStr, aidStr = splitSharp(text)
-            if "#D" in aidStr:
+            if parsed.has("D"):
                 if aidFirst:
                     self.putDirection(text, pos, height, outTextColor, block_color=color1)
                     pos = (pos[0] + (1 + gap) * height, pos[1])
                 else:
                     self.putDirection(text, (pos[0] + self.getAutoLen(text[:text.find("#D")], height, "A", gap) + gap * height, pos[1]), height, outTextColor, block_color=color1)
-            if "#NW" in aidStr:
+            if parsed.has("NW"):
                 return self.putWayNo(text, pos, 4/3 * height)
-            if "#NH" in aidStr:
+            if parsed.has("NH"):
                 return self.putHighwayNo(text, pos, 5/3 * height)
-            if "#B" in aidStr:
+            if parsed.has("B"):
                 return self.putBoxedText(text, pos, 4/3 * height, typeStr)
-            self.putText(textStr, pos, typeStr, height, gap, color1)
+            self.putText(parsed.text, pos, typeStr, height, gap, color1)
     def putAutoCentralText(self, text: str, pos: tuple[float, float], height: int, typeStr: str|None = None, gap: float = 0.1, color1: tuple|None = None, color2: tuple|None = None, aidFirst: bool = False, outTextColor = Color.GREEN, maxLen: float | None = None):
         """ Put text on the image based on the sharp (#) infomation with pos (North pos) """
         if " " in text:
             return self.putAutoText(text, (pos[0] - self.getAutoLen(text, height, gap=gap) / 2, pos[1]), height, typeStr, gap, color1, color2, aidFirst, outTextColor)
-        if "#" not in text:
+        parsed = parseSharp(text)
+        if parsed.sharp == "":
             return self.putCentralText(text, pos, typeStr, height, gap, (255) if color1 is None else color1)
-        if "#NW" in text:
+        if parsed.has("NW"):
             return self.putCentralWayNo(text, pos, 4/3 * height)
-        if "#NH" in text:
+        if parsed.has("NH"):
             return self.putCentralHighwayNo(text, pos, 5/3 * height)
-        if "#T" in text:
-            if "#B" in text:
+        if parsed.has("T"):
+            if parsed.has("B"):
                 return self.putBoxedText(text, (pos[0] - self.getAutoLen(text, height, typeStr, 0) / 2), 4/3 * height, "A")
-            return self.putCentralString(text, pos, typeStr, height, (255) if color1 is None else color1, Color.BLUE if color2 is None else color2, maxLen if "#Tt" in text else None)
-        if "#B" in text:
+            return self.putCentralString(text, pos, typeStr, height, (255) if color1 is None else color1, Color.BLUE if color2 is None else color2, maxLen if parsed.has("Tt") else None)
+        if parsed.has("B"):
             return self.putBoxedText(text, (pos[0] - self.getAutoLen(text, height, typeStr, 0) / 2, pos[1]), 4/3 * height, "A")
         self.putAutoText(text, (pos[0] - self.getAutoLen(text, height, gap=gap) / 2, pos[1]), height, typeStr, gap, color1, color2, aidFirst, outTextColor)
     def putBiAutoText(self, text: str, enText: str, pos: tuple[float, float], text_height: int, english_scale: float|None, typeStr: str|None = None, gap: float = 0.1, color1: tuple|None = None, color2: tuple|None = None, minHeight: float = 0, aidFirst: bool = False, outTextColor = Color.GREEN):
@@ -774,19 +1171,19 @@ class Sign:
                 y += Sign.getAutoHeight(text, text_height) + gap * text_height
                 textLen = self.getTextLen(text, typeStr, text_height, gap)
                 return self.putCentralString(enText, (x + textLen / 2, y), typeStr, text_height, (255) if color1 is None else color1, Color.BLUE if color2 is None else color2, maxLen=textLen)
-            textStr, aidStr = splitSharp(text)
-            if "#D" in aidStr:
+            parsed = parseSharp(text)
+            if parsed.has("D"):
                 if aidFirst:
-                    self.putDirection(getSharpText(aidStr, "D"), (x, y), text_height, outTextColor, block_color=color1)
+                    self.putDirection(parsed.direction, (x, y), text_height, outTextColor, block_color=color1)
                     x += (1 + gap) * text_height
                 else:
-                    self.putDirection(getSharpText(aidStr, "D"), (x + self.getAutoLen(text[:text.find("#D")], text_height, "A", gap) + gap * text_height, y), text_height, outTextColor, block_color=color1)
-            if "#N" in aidStr:
-                if "#NW" in aidStr:
+                    self.putDirection(parsed.direction, (x + self.getAutoLen(text[:text.find("#D")], text_height, "A", gap) + gap * text_height, y), text_height, outTextColor, block_color=color1)
+            if parsed.has("N"):
+                if parsed.has("NW"):
                     return self.putWayNo(text, (x, y), 4/3 * text_height)
-                elif "#NH" in aidStr:
+                elif parsed.has("NH"):
                     return self.putHighwayNo(text, (x, y), 5/3 * text_height)
-            if "#B" in aidStr:
+            if parsed.has("B"):
                 return self.putBoxedText(text, pos, 4/3 * text_height, typeStr)
             self.putText(text, pos, typeStr, text_height, gap, color1)
             y += Sign.getAutoHeight(text, text_height) + gap * text_height
@@ -794,14 +1191,15 @@ class Sign:
             self.putCentralString(enText, (x + textLen / 2, y), typeStr, text_height, (255) if color1 is None else color1, Color.BLUE if color2 is None else color2, maxLen=textLen)
     def getAutoHeight(text: str, height: float, english_scale: float|None = None, enGap: float = 0.4):
         """ Get the height of a line """
-        if "#NH" in text:
+        parsed = parseSharp(text)
+        if parsed.has("NH"):
             return 5/3 * height
-        if "#NW" in text or "#B" in text:
+        if parsed.has("NW") or parsed.has("B"):
             return 4/3 * height
         return height if english_scale is None else (1 + english_scale + enGap) * height
     def getAutoEnHeight(text: str, height: float, english_scale: float, gap: float = 0.2):
         """ Get the height of a line """
-        if text == "" or "#N" in text:
+        if text == "" or parseSharp(text).has("N"):
             return 0
         return (english_scale + gap) * height
     def getDirectionBbox(self, textDict: dict[str,], text_height: int, lineLen: float = 1.5, lineGap: float = 0.3, enGap: float = 0.2) -> tuple[float, float, float, float]:
@@ -882,26 +1280,29 @@ class Sign:
                 x += lineGap * text_height + boxW / 2
                 y -= boxW / tan(angle) / 2
         y -= boxH / 2
-        self.putAutoCentralString(textDict["text"], (x, y), "A", text_height, color, bgColor, None if "#B" in textDict["text"] and self.getAutoLen(textDict["text"], text_height, "A", 0) < boxW else boxW)
+        self.putAutoCentralString(textDict["text"], (x, y), "A", text_height, color, bgColor, None if parseSharp(textDict["text"]).has("B") and self.getAutoLen(textDict["text"], text_height, "A", 0) < boxW else boxW)
         y += (1 + enGap) * text_height
         if "textEn" in textDict and hasattr(self, "english_scale") and self.english_scale is not None and self.english_scale > 0 and textDict["textEn"] != "":
             self.putCentralString(textDict["textEn"], (x, y), "B", self.english_scale * text_height, color, boxW)
             y += (self.english_scale + enGap) * text_height
         if len(nextList) > 0:
             nextH = (2/3 * len(nextList) + enGap * (len(nextList) - 1)) * text_height
-            placeText(self.img, (round((x - nextLen / 2) * self.scale), round(y * self.scale)), "(", "B", nextH * self.scale, color, round(0.3 * text_height * self.scale))
-            placeText(self.img, (round((x + nextLen / 2 - 0.3 * text_height) * self.scale), round(y * self.scale)), ")", "B", nextH * self.scale, color, round(0.3 * text_height * self.scale))
+            self.placeText((round((x - nextLen / 2) * self.scale), round(y * self.scale)), "(", "B", nextH * self.scale, color, round(0.3 * text_height * self.scale))
+            self.placeText((round((x + nextLen / 2 - 0.3 * text_height) * self.scale), round(y * self.scale)), ")", "B", nextH * self.scale, color, round(0.3 * text_height * self.scale))
             for text in nextList:
-                self.putAutoCentralString(text, (x, y), "A", 2/3 * text_height, color, bgColor, None if "#B" in text and self.getAutoLen(text, 2/3 * text_height, "A", 0) < boxW else boxW)
+                self.putAutoCentralString(text, (x, y), "A", 2/3 * text_height, color, bgColor, None if parseSharp(text).has("B") and self.getAutoLen(text, 2/3 * text_height, "A", 0) < boxW else boxW)
                 y += (2/3 + enGap) * text_height
     def update(self):
         """ Sign image generator """
         pass
+    def refresh(self, keys: list[str]):
+        """ Redraw the sign after the info keys changed <p>Redraw the whole sign by default, should be override to redraw the affected region only</p> """
+        self.update()
     def autoSet(self, key: str, value, refresh = True):
         """ Set data based on infomation (unsafe) <p> Safe type should be override</p> """
         self.info[key] = value
         if refresh:
-            self.update()
+            self.refresh([key])
     def save(self, path: str):
         """ Save the sign """
         if self.img:
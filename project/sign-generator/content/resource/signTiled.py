@@ -0,0 +1,100 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+from signDisplay import DisplayList, layoutSign
+from signTemplate import Sign
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+class PngRowWriter:
+    """ Write an RGBA PNG row by row, only the compressor state is kept in memory """
+    def __init__(self, path: str, size: tuple[int, int], level: int = 6):
+        self.size = size
+        self.rows = 0
+        self.file = open(path, "wb")
+        self.compressor = zlib.compressobj(level)
+        self.file.write(b"\x89PNG\r\n\x1a\n")
+        self.writeChunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], 8, 6, 0, 0, 0))
+    def writeChunk(self, kind: bytes, data: bytes):
+        self.file.write(struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data)))
+    def writeRows(self, rows: np.ndarray):
+        """ Append the rows of an <code>(height, width, 4)</code> uint8 array """
+        flat = rows.reshape(rows.shape[0], -1)
+        # Filter "Sub": the difference to the pixel on the left
+        filtered = np.empty((flat.shape[0], flat.shape[1] + 1), np.uint8)
+        filtered[:, 0] = 1
+        filtered[:, 1:5] = flat[:, :4]
+        np.subtract(flat[:, 4:], flat[:, :-4], out=filtered[:, 5:])
+        data = self.compressor.compress(filtered.tobytes())
+        if len(data) > 0:
+            self.writeChunk(b"IDAT", data)
+        self.rows += rows.shape[0]
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            if self.rows != self.size[1]:
+                raise ValueError(f"{self.rows} rows written, {self.size[1]} expected")
+            self.writeChunk(b"IDAT", self.compressor.flush())
+            self.writeChunk(b"IEND", b"")
+        finally:
+            self.file.close()
+
+def tileSize(size: int) -> int:
+    """ Align the tile size to 8 pixels (the region origin must not change the rounding of the coordinates) """
+    return max(8, size - size % 8)
+
+def iterTiles(displayList: DisplayList, size: int = 512):
+    """ Iterate the tiles <code>(x, y, RGBA array)</code> row by row, the tiles on the right and bottom edges are smaller """
+    size = tileSize(size)
+    width, height = displayList.size
+    for y in range(0, height, size):
+        for x in range(0, width, size):
+            yield (x, y, displayList.paint(np.empty((min(size, height - y), min(size, width - x), 4), np.uint8), (x, y)))
+
+def iterBands(displayList: DisplayList, size: int = 512):
+    """ Iterate the rows of tiles as <code>(y, RGBA array)</code> """
+    width, height = displayList.size
+    band = None
+    for x, y, tile in iterTiles(displayList, size):
+        if x == 0:
+            if band is not None:
+                yield band
+            band = (y, np.empty((tile.shape[0], width, 4), np.uint8))
+        band[1][:, x: x + tile.shape[1]] = tile
+    if band is not None:
+        yield band
+
+def recordSign(sign: Sign, scale: int|None = None) -> DisplayList:
+    """ Record the drawing of the sign at scale (the sign scale by default) without a canvas """
+    return layoutSign(sign if scale is None else sign.scaledCopy(scale))
+
+def saveTiled(sign: Sign, path: str, scale: int|None = None, size: int = 512):
+    """
+        <h4>Render the sign by tiles and stream it to a PNG (or a tiled TIFF with tifffile)</h4>
+        <p>Only one row of tiles (one tile for TIFF) is in memory, size is the tile size in pixels</p>
+        <p>The pixels are the same as <code>update()</code>, except the text taller than <code>signDisplay.SUPERSAMPLE_HEIGHT</code> (rasterized with less supersampling)</p>
+    """
+    displayList = recordSign(sign, scale)
+    width, height = displayList.size
+    if os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        if tifffile is None:
+            raise ImportError("tifffile is required to write TIFF")
+        size = max(16, size - size % 16)  # TIFF tiles are multiples of 16
+        def paddedTiles():
+            for _, _, tile in iterTiles(displayList, size):
+                padded = np.zeros((size, size, 4), np.uint8)
+                padded[: tile.shape[0], : tile.shape[1]] = tile
+                yield padded
+        tifffile.imwrite(path, paddedTiles(), shape=(height, width, 4), dtype=np.uint8, tile=(size, size), photometric="rgb", extrasamples=["unassalpha"], compression="zlib")
+        return
+    writer = PngRowWriter(path, (width, height))
+    try:
+        for _, band in iterBands(displayList, size):
+            writer.writeRows(band)
+    finally:
+        writer.close()
@@ -0,0 +1,357 @@
+import base64
+import os
+import zlib
+from io import BytesIO
+from math import sin, cos, tan, radians, ceil
+
+import numpy as np
+from PIL import Image
+import textGenerator
+from textGenerator import FONT_FILES, LRUCache, registerCache, getFilePath, getFont, getColor, fontMaskSize, generateFontMaskArray
+from signTemplate import Sign, flatXY
+try:
+    from fontTools.ttLib import TTFont
+    from fontTools.pens.basePen import BasePen
+except ImportError:
+    TTFont = None
+    BasePen = object
+
+UNITS = {"mm": 72 / 25.4, "cm": 72 / 2.54, "m": 7200 / 2.54, "in": 72, "pt": 1}
+""" The points (1/72 inch) of each physical unit """
+STROKE_RATIOS = {"A": 0.1, "B": 1/6, "C": 0.1}
+""" The stroke width of each font type relative to the font height (same as <code>renderFontMask</code>) """
+
+outlineCache = LRUCache(4096)
+""" Text outlines keyed by <code>(text, font_type, font_height, scale_factor, maxLen, strokeTableEnabled)</code> """
+_ttFonts: dict[str,] = {}
+registerCache("outline", outlineCache.clear)
+registerCache("ttFont", _ttFonts.clear)
+
+def num(value: float) -> str:
+    """ Format the coordinate with at most 2 decimals """
+    text = f"{value:.2f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+def arcCurves(cx: float, cy: float, rx: float, ry: float, start: float, end: float) -> list[tuple]:
+    """ The bezier curves of the elliptical arc, angles in degrees clockwise from 3 o'clock (same as <code>ImageDraw.arc</code>) """
+    count = max(1, ceil(abs(end - start) / 90))
+    step = radians(end - start) / count
+    k = 4 / 3 * tan(step / 4)
+    commands = []
+    a = radians(start)
+    for _ in range(count):
+        b = a + step
+        commands.append(("C", cx + rx * (cos(a) - k * sin(a)), cy + ry * (sin(a) + k * cos(a)),
+                              cx + rx * (cos(b) + k * sin(b)), cy + ry * (sin(b) - k * cos(b)), cx + rx * cos(b), cy + ry * sin(b)))
+        a = b
+    return commands
+
+def ellipsePath(x0: float, y0: float, x1: float, y1: float) -> list[tuple]:
+    cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, abs(x1 - x0) / 2, abs(y1 - y0) / 2
+    return [("M", cx + rx, cy)] + arcCurves(cx, cy, rx, ry, 0, 360) + [("Z",)]
+
+class OutlinePen(BasePen):
+    """ Collect the glyph outline as path commands through a point transform """
+    def __init__(self, glyphSet, transform):
+        super().__init__(glyphSet)
+        self.transform = transform
+        self.commands: list[tuple] = []
+    def _moveTo(self, pt):
+        self.commands.append(("M", *self.transform(pt)))
+    def _lineTo(self, pt):
+        self.commands.append(("L", *self.transform(pt)))
+    def _curveToOne(self, pt1, pt2, pt3):
+        self.commands.append(("C", *self.transform(pt1), *self.transform(pt2), *self.transform(pt3)))
+    def _closePath(self):
+        self.commands.append(("Z",))
+
+def getTTFont(font_type: str):
+    if font_type not in _ttFonts:
+        _ttFonts[font_type] = TTFont(getFilePath(FONT_FILES[font_type]), lazy=True)
+    return _ttFonts[font_type]
+
+def textOutline(text: str, font_type: str, font_height: float, maxLen: int|None = None, scale_factor: int = 4) -> tuple[list[tuple], float]|None:
+    """
+        <h4>Get the outline of the text in the pixel coordinates of its mask</h4>
+        <p>Return <code>(commands, stroke width)</code>, the stroke thickens the outline like the mask does, None without fontTools</p>
+    """
+    if TTFont is None or len(text) == 0:
+        return None
+    if font_type not in FONT_FILES:
+        font_type = "A"
+    font_height = round(font_height)
+    key = (text, font_type, font_height, scale_factor, maxLen, textGenerator.strokeTableEnabled)
+    outline = outlineCache.get(key)
+    if outline is None:
+        outline = buildOutline(text, font_type, font_height, maxLen, scale_factor)
+        outlineCache.put(key, outline)
+    return outline
+
+def buildOutline(text: str, font_type: str, font_height: int, maxLen: int|None, scale_factor: int) -> tuple[list[tuple], float]:
+    """ Map the font outline to the mask of <code>renderFontMask</code> (the crop and resize of the rasterized text) """
+    size = int(font_height * scale_factor)
+    font = getFont(font_type, size)
+    ttFont = getTTFont(font_type)
+    glyphSet = ttFont.getGlyphSet()
+    cmap = ttFont.getBestCmap()
+    unit = size / ttFont["head"].unitsPerEm
+    ascender = font.getmetrics()[0]
+    bbox = font.getbbox(text)
+    height, width = fontMaskSize(text, font_type, font_height, scale_factor, maxLen)
+    top = round((0.09 if any(['\u4e00' <= char <= '\u9fff' for char in text]) else 0.727) * scale_factor / 4 * font_height) - 20
+    sx = width / max(1, bbox[2] - bbox[0])
+    sy = height / max(1, bbox[3] + 20 - top)
+    commands = []
+    penX = 0.0
+    for char in text:
+        glyphName = cmap.get(ord(char), ".notdef")
+        if glyphName not in glyphSet:
+            glyphName = ".notdef"
+        transform = lambda pt, penX=penX: ((penX + pt[0] * unit - bbox[0]) * sx, (ascender - pt[1] * unit - top) * sy)
+        pen = OutlinePen(glyphSet, transform)
+        glyphSet[glyphName].draw(pen)
+        commands += pen.commands
+        penX += ttFont["hmtx"][glyphName][0] * unit
+    # Thicken like the dilation of the mask (thinning is not possible on the outline)
+    target = STROKE_RATIOS[font_type] * size
+    current = textGenerator.tableStrokeWidth(text, font_type, size) if textGenerator.strokeTableEnabled else None
+    if current is None:
+        # Measured at a bounded size
+        measureSize = min(size, 512)
+        current = textGenerator.strokeWidth(textGenerator.rasterizeText(text, getFont(font_type, measureSize), measureSize)) * size / measureSize
+    stroke = 0.0
+    if 0 < current < target:
+        stroke = (max(1, min(int((target - current) / 2), 15)) - 1) * (sx + sy) / 2
+    return (commands, stroke)
+
+def shiftPath(commands: list[tuple], dx: float, dy: float) -> list[tuple]:
+    return [(command[0], *[value + (dx if i % 2 == 0 else dy) for i, value in enumerate(command[1:])]) for command in commands]
+
+class VectorDraw:
+    """ An <code>ImageDraw</code> replacement recording the shapes to a <code>VectorBackend</code> """
+    def __init__(self, backend: "VectorBackend"):
+        self.backend = backend
+    def rectangle(self, xy, fill=None, outline=None, width=1):
+        x0, y0, x1, y1 = flatXY(xy)
+        self.backend.addPath([("M", x0, y0), ("L", x1, y0), ("L", x1, y1), ("L", x0, y1), ("Z",)], fill, outline, width)
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        self.backend.addPath(ellipsePath(*flatXY(xy)), fill, outline, width)
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        flat = flatXY(xy)
+        if len(flat) < 4:
+            return
+        self.backend.addPath([("M", flat[0], flat[1])] + [("L", flat[i], flat[i + 1]) for i in range(2, len(flat) - 1, 2)] + [("Z",)], fill, outline, width)
+    def arc(self, xy, start, end, fill=None, width=1):
+        """ The arc band inside the ellipse, like <code>ImageDraw.arc</code> """
+        x0, y0, x1, y1 = flatXY(xy)
+        while end < start:
+            end += 360
+        end = min(end, start + 360)
+        cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, abs(x1 - x0) / 2, abs(y1 - y0) / 2
+        inner = (max(0, rx - width), max(0, ry - width))
+        commands = [("M", cx + rx * cos(radians(start)), cy + ry * sin(radians(start)))] + arcCurves(cx, cy, rx, ry, start, end)
+        if end - start >= 360:
+            commands += [("Z",), ("M", cx + inner[0] * cos(radians(end)), cy + inner[1] * sin(radians(end)))]
+        else:
+            commands.append(("L", cx + inner[0] * cos(radians(end)), cy + inner[1] * sin(radians(end))))
+        commands += arcCurves(cx, cy, *inner, end, start) + [("Z",)]
+        self.backend.addPath(commands, fill, None, 0, True)
+    def circle(self, xy, radius, fill=None, outline=None, width=1):
+        x, y = flatXY(xy)
+        self.ellipse([x - radius, y - radius, x + radius, y + radius], fill, outline, width)
+
+class VectorBackend:
+    """
+        <h4>Record the drawing of a sign and save it as SVG or PDF</h4>
+        <p>Set it as <code>sign.backend</code> before <code>update()</code>, nothing is rasterized except the text without fontTools</p>
+    """
+    def __init__(self, maskHeight: int = 256):
+        self.maskHeight = maskHeight
+        """ The maximum pixel height of the text masks embedded without fontTools, they are stretched to the text size """
+        self.size: tuple[int, int] = (0, 0)
+        self.background: tuple|None = None
+        self.items: list[tuple] = []
+        """ <code>("path", commands, fill, outline, width, evenOdd)</code> or <code>("text", pos, glyphList, font_type, font_height, color, maxLen)</code> in sign pixels """
+    def begin(self, size: tuple[int, int], color: tuple = (0, 0, 0, 0)):
+        """ Start a new drawing (called by <code>Sign.newCanvas</code>) """
+        self.size = size
+        color = getColor(color)
+        self.background = color if color[3] > 0 else None
+        self.items = []
+    def draw(self) -> VectorDraw:
+        return VectorDraw(self)
+    def addPath(self, commands: list[tuple], fill=None, outline=None, width: float = 1, evenOdd: bool = False):
+        if fill is None and (outline is None or width <= 0):
+            return
+        self.items.append(("path", commands, None if fill is None else getColor(fill), None if outline is None else getColor(outline), width, evenOdd))
+    def placeText(self, pos: tuple[int, int], text: str, font_type: str, font_height: float, color: tuple, maxLen: int|None = None):
+        self.items.append(("text", (int(pos[0]), int(pos[1])), [(0, text)], font_type, font_height, getColor(color), maxLen))
+    def placeTextRun(self, pos: tuple[int, int], glyphList: list[tuple[int, str]], font_type: str, font_height: float, color: tuple):
+        self.items.append(("text", (int(pos[0]), int(pos[1])), [(x, text) for x, text in glyphList if len(text) > 0], font_type, font_height, getColor(color), None))
+    def glyphs(self, item: tuple):
+        """
+            Iterate <code>(x, y, width, height, text, outline, mask)</code> of the text item
+            <p>The mask is only generated without the outline, at most <code>self.maskHeight</code> pixels high</p>
+        """
+        _, (x, y), glyphList, font_type, font_height, _, maxLen = item
+        for dx, text in glyphList:
+            height, width = fontMaskSize(text, font_type, font_height, maxLen=maxLen)
+            if width <= 0 or height <= 0:
+                continue
+            outline = textOutline(text, font_type, font_height, maxLen)
+            mask = None
+            if outline is None:
+                maskHeight = min(round(font_height), self.maskHeight)
+                mask = generateFontMaskArray(text, font_type, maskHeight, maxLen=None if maxLen is None else max(1, round(maxLen * maskHeight / round(font_height))))
+            yield (x + dx, y, width, height, text, outline, mask)
+    def save(self, path: str, scale: float, unit: str = "cm"):
+        """ Save as SVG or PDF by the extension, scale is the pixels per unit of the drawing """
+        if os.path.splitext(path)[1].lower() == ".pdf":
+            self.savePdf(path, scale, unit)
+        else:
+            self.saveSvg(path, scale, unit)
+    def saveSvg(self, path: str, scale: float, unit: str = "cm"):
+        """ Write the SVG, the physical size is the pixel size / scale in unit """
+        width, height = self.size
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f'<svg xmlns="http://www.w3.org/2000/svg" width="{num(width / scale)}{unit}" height="{num(height / scale)}{unit}" viewBox="0 0 {width} {height}">\n')
+            if self.background:
+                file.write(f'<rect width="{width}" height="{height}"{svgPaint("fill", self.background)}/>\n')
+            for item in self.items:
+                if item[0] == "path":
+                    _, commands, fill, outline, lineWidth, evenOdd = item
+                    paint = svgPaint("fill", fill) if fill else ' fill="none"'
+                    if outline and lineWidth > 0:
+                        paint += svgPaint("stroke", outline) + f' stroke-width="{num(lineWidth)}"'
+                    file.write(f'<path d="{svgPath(commands)}"{paint}{' fill-rule="evenodd"' if evenOdd else ""}/>\n')
+                    continue
+                color = item[5]
+                for x, y, textWidth, textHeight, text, outline, mask in self.glyphs(item):
+                    if outline:
+                        commands, stroke = outline
+                        paint = svgPaint("fill", color) + (svgPaint("stroke", color) + f' stroke-width="{num(stroke)}" stroke-linejoin="miter"' if stroke > 0 else "")
+                        file.write(f'<path d="{svgPath(shiftPath(commands, x, y))}"{paint}/>\n')
+                    else:
+                        file.write(f'<image x="{x}" y="{y}" width="{textWidth}" height="{textHeight}" preserveAspectRatio="none" href="data:image/png;base64,{base64.b64encode(maskPng(mask, color)).decode("ascii")}"/>\n')
+            file.write("</svg>\n")
+    def savePdf(self, path: str, scale: float, unit: str = "cm"):
+        """ Write the single page PDF, the physical size is the pixel size / scale in unit """
+        width, height = self.size
+        k = UNITS[unit] / scale
+        writer = PdfWriter(path)
+        try:
+            images: dict[str, int] = {}
+            imageNames: dict[tuple, str] = {}
+            states: dict[int, str] = {}
+            content = [f"{num(k)} 0 0 {num(-k)} 0 {num(height * k)} cm".encode()]
+            if self.background:
+                content.append(pdfPaint(self.background, states) + f"0 0 {width} {height} re f".encode())
+            for item in self.items:
+                if item[0] == "path":
+                    _, commands, fill, outline, lineWidth, evenOdd = item
+                    paint = b""
+                    if fill:
+                        paint += pdfPaint(fill, states)
+                    if outline and lineWidth > 0:
+                        paint += pdfPaint(outline, states, True) + f"{num(lineWidth)} w ".encode()
+                    op = ("B" if outline and lineWidth > 0 else "f") if fill else "S"
+                    content.append(b"q " + paint + pdfPath(commands) + (op + ("*" if evenOdd and op != "S" else "")).encode() + b" Q")
+                    continue
+                color = item[5]
+                for x, y, textWidth, textHeight, text, outline, mask in self.glyphs(item):
+                    if outline:
+                        commands, stroke = outline
+                        paint = pdfPaint(color, states) + (pdfPaint(color, states, True) + f"{num(stroke)} w ".encode() if stroke > 0 else b"")
+                        content.append(b"q " + paint + pdfPath(shiftPath(commands, x, y)) + (b"B" if stroke > 0 else b"f") + b" Q")
+                    else:
+                        imageKey = (text, *item[3:5], item[6], color)
+                        if imageKey not in imageNames:
+                            imageNames[imageKey] = f"Im{len(images)}"
+                            images[imageNames[imageKey]] = writer.writeImage(mask, color)
+                        name = imageNames[imageKey]
+                        content.append(f"q {textWidth} 0 0 {-textHeight} {x} {y + textHeight} cm /{name} Do Q".encode())
+            writer.writePage(width * k, height * k, b"\n".join(content), images, states)
+        finally:
+            writer.close()
+
+def svgPaint(attr: str, color: tuple) -> str:
+    paint = f' {attr}="#{color[0]:02x}{color[1]:02x}{color[2]:02x}"'
+    if color[3] < 255:
+        paint += f' {attr}-opacity="{num(color[3] / 255)}"'
+    return paint
+
+def svgPath(commands: list[tuple]) -> str:
+    return " ".join([command[0] + " ".join([num(value) for value in command[1:]]) for command in commands])
+
+def pdfPaint(color: tuple, states: dict[int, str], stroke: bool = False) -> bytes:
+    """ The color operators (and the alpha graphics state, named in states) """
+    paint = f"{num(color[0] / 255)} {num(color[1] / 255)} {num(color[2] / 255)} {"RG" if stroke else "rg"} "
+    if color[3] < 255:
+        states.setdefault(color[3], f"GS{len(states)}")
+        paint += f"/{states[color[3]]} gs "
+    return paint.encode()
+
+def pdfPath(commands: list[tuple]) -> bytes:
+    ops = {"M": "m", "L": "l", "C": "c", "Z": "h"}
+    return " ".join([" ".join([num(value) for value in command[1:]] + [ops[command[0]]]) for command in commands]).encode() + b" "
+
+def maskPng(mask: np.ndarray, color: tuple) -> bytes:
+    """ The PNG of the colored text through the mask """
+    img = Image.new("RGBA", (mask.shape[1], mask.shape[0]), color)
+    img.putalpha(Image.fromarray((mask.astype(np.uint16) * color[3] // 255).astype(np.uint8)))
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+class PdfWriter:
+    """ Write the PDF objects to the file one by one and keep only their offsets """
+    def __init__(self, path: str):
+        self.file = open(path, "wb")
+        self.offsets: list[int] = []
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    def writeObject(self, body: bytes, stream: bytes|None = None) -> int:
+        self.offsets.append(self.file.tell())
+        self.file.write(f"{len(self.offsets)} 0 obj\n".encode() + body)
+        if stream is not None:
+            self.file.write(b"\nstream\n" + stream + b"\nendstream")
+        self.file.write(b"\nendobj\n")
+        return len(self.offsets)
+    def writeStream(self, dictBody: str, data: bytes) -> int:
+        data = zlib.compress(data)
+        return self.writeObject(f"<< {dictBody} /Filter /FlateDecode /Length {len(data)} >>".encode(), data)
+    def writeImage(self, mask: np.ndarray, color: tuple) -> int:
+        """ Write the text mask as the soft mask of a colored image, return the object number """
+        height, width = mask.shape
+        smask = self.writeStream(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceGray /BitsPerComponent 8",
+                                 (mask.astype(np.uint16) * color[3] // 255).astype(np.uint8).tobytes())
+        return self.writeStream(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceRGB /BitsPerComponent 8 /SMask {smask} 0 R",
+                                bytes(color[:3]) * (width * height))
+    def writePage(self, width: float, height: float, content: bytes, images: dict[str, int], states: dict[int, str]):
+        """ Write the page with the content and the catalog """
+        contentNo = self.writeStream("", content)
+        xObjects = " ".join([f"/{name} {no} 0 R" for name, no in images.items()])
+        extGStates = " ".join([f"/{name} << /ca {num(alpha / 255)} /CA {num(alpha / 255)} >>" for alpha, name in states.items()])
+        pagesNo = len(self.offsets) + 2
+        pageNo = self.writeObject(f"<< /Type /Page /Parent {pagesNo} 0 R /MediaBox [0 0 {num(width)} {num(height)}] /Contents {contentNo} 0 R "
+                                  f"/Resources << /XObject << {xObjects} >> /ExtGState << {extGStates} >> >> >>".encode())
+        self.writeObject(f"<< /Type /Pages /Kids [{pageNo} 0 R] /Count 1 >>".encode())
+        self.writeObject(f"<< /Type /Catalog /Pages {pagesNo} 0 R >>".encode())
+    def close(self):
+        if self.file.closed:
+            return
+        xref = self.file.tell()
+        self.file.write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode())
+        for offset in self.offsets:
+            self.file.write(f"{offset:010d} 00000 n \n".encode())
+        self.file.write(f"trailer\n<< /Size {len(self.offsets) + 1} /Root {len(self.offsets)} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+        self.file.close()
+
+def saveVector(sign: Sign, path: str, scale: int = 10, unit: str = "cm"):
+    """
+        <h4>Save the sign as SVG or PDF (by the extension)</h4>
+        <p>The sign is drawn again at scale (pixels per unit, only the precision of the coordinates), the physical size is given by unit so the memory does not depend on it</p>
+    """
+    vectorSign = sign.scaledCopy(scale)
+    vectorSign.backend = VectorBackend()
+    vectorSign.update()
+    vectorSign.backend.save(path, scale, unit)
@@ -1,12 +1,145 @@
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
+from collections import OrderedDict
+import json
 import os
+import threading
+
+FONT_FILES = {"A": "交通标志专用字体.ttf", "B": "HWYGOTH-4.ttf", "C": "HWYGNRRW-3.ttf"}
 
 def getFilePath(path: str):
     """ Return the path from the code file """
     return os.path.join(os.path.dirname(__file__), path)
 
+class LRUCache:
+    """ A thread-safe cache with LRU eviction and hit/miss counters <p>Bounded by the number of entries and/or the bytes given by <code>sizeOf</code></p> """
+    def __init__(self, maxSize: int|None = 64, maxBytes: int|None = None, sizeOf = None):
+        self.maxSize = maxSize
+        self.maxBytes = maxBytes
+        self.sizeOf = sizeOf
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._data)
+    def get(self, key, default = None):
+        """ Get the value of the key and mark it as recently used """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+    def put(self, key, value):
+        """ Add the value and evict the least recently used ones """
+        size = self.sizeOf(value) if self.sizeOf else 0
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self.sizeOf(self._data.pop(key)) if self.sizeOf else 0
+            if self.maxBytes is not None and size > self.maxBytes:
+                return
+            self._data[key] = value
+            self.bytes += size
+            while (self.maxSize is not None and len(self._data) > self.maxSize) or (self.maxBytes is not None and self.bytes > self.maxBytes):
+                _, oldValue = self._data.popitem(last=False)
+                self.bytes -= self.sizeOf(oldValue) if self.sizeOf else 0
+    def keys(self) -> list:
+        """ A snapshot of the keys, the least recently used first """
+        with self._lock:
+            return list(self._data.keys())
+    def resize(self, maxSize: int|None = None, maxBytes: int|None = None):
+        """ Change the bounds of the cache and evict the overflowed values """
+        with self._lock:
+            self.maxSize = maxSize
+            self.maxBytes = maxBytes
+            while (self.maxSize is not None and len(self._data) > self.maxSize) or (self.maxBytes is not None and self.bytes > self.maxBytes):
+                _, oldValue = self._data.popitem(last=False)
+                self.bytes -= self.sizeOf(oldValue) if self.sizeOf else 0
+    def clear(self):
+        """ Remove all the values and reset the counters """
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+    def stats(self) -> dict[str, int|float]:
+        """ Get the size and the hit rate of the cache """
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxSize": self.maxSize, "bytes": self.bytes, "maxBytes": self.maxBytes, "hits": self.hits, "misses": self.misses, "hitRate": self.hits / total if total > 0 else 0.0}
+
+CACHES: dict[str,] = {}
+""" The clear functions of the in-memory caches by name, called together by <code>clearCaches</code> """
+
+def registerCache(name: str, clear):
+    """ Add the clear function of a cache to <code>clearCaches</code> (modules register their caches when imported) """
+    CACHES[name] = clear
+
+def clearCaches():
+    """ Clear every registered cache (e.g. for a cold benchmark) """
+    for clear in list(CACHES.values()):
+        clear()
+
+fontCache = LRUCache(64)
+""" Loaded fonts keyed by <code>(font_type, size)</code> """
+registerCache("font", fontCache.clear)
+fontData: dict[str, bytes] = {}
+""" The font files read into memory, only for the paths FreeType cannot open (see <code>fontInMemory</code>) """
+_fontDataLock = threading.Lock()
+
+def fontInMemory(font_type: str) -> bool:
+    """ Whether the font is loaded from memory: FreeType cannot open a non-ASCII path on Windows """
+    return os.name == "nt" and not getFilePath(FONT_FILES[font_type]).isascii()
+
+class FontDataReader:
+    """ The file object given to Pillow to load a font from the data read once (Pillow still copies it into each face) """
+    def __init__(self, data: bytes):
+        self.data = data
+    def read(self) -> bytes:
+        return self.data
+
+def getFontData(font_type: str) -> bytes:
+    """ Read the font file of font_type once """
+    with _fontDataLock:
+        data = fontData.get(font_type)
+        if data is None:
+            with open(getFilePath(FONT_FILES[font_type]), "rb") as file:
+                data = file.read()
+            fontData[font_type] = data
+        return data
+
+def getFont(font_type: str, size: float) -> ImageFont.FreeTypeFont:
+    """ Get the font of the pixel size from the cache, font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code> """
+    if font_type not in FONT_FILES:
+        font_type = "A"
+    key = (font_type, size)
+    font = fontCache.get(key)
+    if font is None:
+        if fontInMemory(font_type):
+            # Pillow would read the whole file again for every size
+            font = ImageFont.truetype(FontDataReader(getFontData(font_type)), size)
+        else:
+            # FreeType opens the file itself, the faces do not copy it
+            font = ImageFont.truetype(getFilePath(FONT_FILES[font_type]), size)
+        fontCache.put(key, font)
+    return font
+
+maskCache = LRUCache(None, 256 * 1024 * 1024, lambda mask: mask.nbytes)
+""" Generated glyph masks keyed by <code>(text, font_type, font_height, scale_factor, maxLen, strokeTableEnabled)</code>, bounded by bytes """
+registerCache("mask", maskCache.clear)
+
+def setMaskCacheBudget(maxBytes: int):
+    """ Set the memory budget (in bytes) of the glyph mask cache, <code>0</code> disables the cache """
+    maskCache.resize(None, max(0, maxBytes))
+
+def cacheStats() -> dict[str, dict]:
+    """ Get the statistics of the font and glyph mask caches """
+    return {"font": fontCache.stats(), "mask": maskCache.stats()}
+
 def strokeWidth(binary_img):
     """使用距离变换估算笔画宽度"""
     dist = cv2.distanceTransform(binary_img, cv2.DIST_L2, cv2.DIST_MASK_PRECISE)
@@ -18,12 +151,120 @@ def strokeWidth(binary_img):
     except Exception:
         return 0
 
+STROKE_TABLE_FILE = "strokeTable.json"
+STROKE_TABLE_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.-()" \
+                     "高速公路国家省道县乡出口入口收费站服务区停车场机桥隧隧道东南西北中左右前方米里城区环岛街大立交枢纽互通港铁火车"
+""" The characters measured in the calibration pass """
+strokeTableEnabled = True
+""" Use the calibrated stroke widths instead of the per-call distance transform """
+_strokeTable: dict[str, dict[str, dict[str, float]]]|None = None
+_strokeLock = threading.Lock()
+
+STROKE_BUCKET_MAX = 2048
+""" The largest calibrated size, the stroke ratio of larger fonts is taken from it """
+STROKE_EXACT_SIZE = 512
+""" The stroke of smaller fonts is measured on the text, a bucketed ratio would change the dilation of the small masks by a whole step """
+
+def strokeBucket(size: int) -> int:
+    """ Get the calibration size bucket (quarter-octave steps) of the pixel font size """
+    return max(16, min(round(2 ** (round(4 * np.log2(max(size, 1))) / 4)), STROKE_BUCKET_MAX))
+
+def loadStrokeTable() -> dict[str, dict[str, dict[str, float]]]:
+    """ Load the stroke-width table (stroke / pixel size) from the sidecar next to the fonts """
+    global _strokeTable
+    if _strokeTable is None:
+        try:
+            with open(getFilePath(STROKE_TABLE_FILE), "r", encoding="utf-8") as file:
+                _strokeTable = json.load(file)
+        except (OSError, ValueError):
+            _strokeTable = {}
+    return _strokeTable
+
+def unloadStrokeTable():
+    """ Forget the loaded table, it is loaded from the sidecar again when needed """
+    global _strokeTable
+    with _strokeLock:
+        _strokeTable = None
+
+registerCache("stroke", unloadStrokeTable)
+
+def saveStrokeTable():
+    """ Save the stroke-width table to the sidecar (ignored on read-only installs) """
+    path = getFilePath(STROKE_TABLE_FILE)
+    try:
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(loadStrokeTable(), file, ensure_ascii=False, sort_keys=True)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def prewarm(fontTypes: str = "ABC", heights: tuple[float, ...]|list[float] = (), texts: tuple[str, ...]|list[str] = ()):
+    """
+        <h4>Load the stroke table, the font data (see <code>fontInMemory</code>) and the fonts before rendering (e.g. in the parent process before forking the workers)</h4>
+        <p>The glyph masks of texts are generated at heights, forked workers share all of them copy-on-write</p>
+    """
+    loadStrokeTable()
+    for font_type in fontTypes:
+        if fontInMemory(font_type):
+            getFontData(font_type)
+        for height in heights:
+            getFont(font_type, int(height * 4))
+            for text in texts:
+                generateFontMaskArray(text, font_type, height)
+
+def rasterizeText(text: str, font: ImageFont.FreeTypeFont, size: int) -> np.ndarray:
+    """ Draw the text on a padded canvas and return the binary image """
+    bbox = (0, 0, 0, 0)
+    try:
+        bbox = font.getbbox(text)
+        width = bbox[2] - bbox[0]
+        height = bbox[3]
+    except AttributeError:
+        width = int(font.getlength(text))
+        height = size
+    img = Image.new('RGBA', (width + 100, height + 100), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.text((50 - bbox[0], 50), text, font=font, fill=(255, 255, 255, 255))
+    img_gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGBA2GRAY)
+    _, binary = cv2.threshold(img_gray, 128, 255, cv2.THRESH_BINARY)
+    return binary
+
+def calibrateStroke(font_type: str, bucket: int, chars: str = STROKE_TABLE_CHARS, save: bool = True) -> dict[str, float]:
+    """ Measure the stroke width of each character at the bucket size (one-time pass) """
+    if font_type not in FONT_FILES:
+        font_type = "A"
+    font = getFont(font_type, bucket)
+    with _strokeLock:
+        row = loadStrokeTable().setdefault(font_type, {}).setdefault(str(bucket), {})
+        for char in chars:
+            if char not in row and not char.isspace():
+                row[char] = round(float(strokeWidth(rasterizeText(char, font, bucket))) / bucket, 6)
+        if save:
+            saveStrokeTable()
+    return row
+
+def tableStrokeWidth(text: str, font_type: str, size: int) -> float|None:
+    """ Get the stroke width of the text from the calibrated table, <code>None</code> if any glyph is unusual or the size is below <code>STROKE_EXACT_SIZE</code> """
+    if size < STROKE_EXACT_SIZE:
+        return None
+    bucket = strokeBucket(size)
+    row = loadStrokeTable().get(font_type, {}).get(str(bucket))
+    if row is None:
+        row = calibrateStroke(font_type, bucket)
+    ratio = 0
+    for char in text:
+        if char.isspace():
+            continue
+        if char not in row:
+            return None
+        ratio = max(ratio, row[char])
+    return ratio * size
+
 def fontLen(textList: list[str], font_type: str, font_height: float, scale: int, scale_factor: int = 4):
     """ get the length of some text in pixle, font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code> """
-    if font_type not in {"A", "B", "C"}:
+    if font_type not in FONT_FILES:
         font_type = "A"
-    font_path = getFilePath({"A": "交通标志专用字体.ttf", "B": "HWYGOTH-4.ttf", "C": "HWYGNRRW-3.ttf"}[font_type])
-    font = ImageFont.truetype(font_path, font_height * scale * scale_factor)
+    font = getFont(font_type, font_height * scale * scale_factor)
     sumLen = 0
     for text in textList:
         try:
@@ -42,30 +283,51 @@ def generateFontMask(text: str, font_type: str, font_height: int, scale_factor:
         <h4>Generate sign-font mask based on GB5768</h4>
         <p> font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code></p>
     """
-    if font_type not in {"A", "B", "C"}:
+    return Image.fromarray(generateFontMaskArray(text, font_type, font_height, scale_factor, maxLen))
+
+def generateFontMaskArray(text: str, font_type: str, font_height: int, scale_factor: int = 4, maxLen: int|None = None) -> np.ndarray:
+    """
+        <h4>Get the (cached) sign-font mask as a read-only array</h4>
+        <p> font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code></p>
+    """
+    if font_type not in FONT_FILES:
         font_type = "A"
     font_height = round(font_height)
-    # Draw text
-    font_path = getFilePath({"A": "交通标志专用字体.ttf", "B": "HWYGOTH-4.ttf", "C": "HWYGNRRW-3.ttf"}[font_type])
-    font = ImageFont.truetype(font_path, int(font_height * scale_factor))
-    bbox = (0, 0, 0, 0)
+    key = (text, font_type, font_height, scale_factor, maxLen, strokeTableEnabled)
+    mask = maskCache.get(key)
+    if mask is None:
+        mask = renderFontMask(text, font_type, font_height, scale_factor, maxLen)
+        mask.setflags(write=False)
+        maskCache.put(key, mask)
+    return mask
+
+def fontMaskSize(text: str, font_type: str, font_height: int, scale_factor: int = 4, maxLen: int|None = None) -> tuple[int, int]:
+    """ Get the <code>(height, width)</code> of the sign-font mask from the font metrics without rasterizing """
+    if font_type not in FONT_FILES:
+        font_type = "A"
+    font_height = round(font_height)
+    font = getFont(font_type, int(font_height * scale_factor))
     try:
         bbox = font.getbbox(text)
-        width = bbox[2] - bbox[0]
-        height = bbox[3]
     except AttributeError:
-        width = int(font.getlength(text))
-        height = int(font_height * scale_factor)
-    img = Image.new('RGBA', (width + 100, height + 100), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(img)
-    draw.text((50 - bbox[0], 50), text, font=font, fill=(255, 255, 255, 255))
-    # Convert to cv2 (np)
-    img_gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGBA2GRAY)
-    _, binary = cv2.threshold(img_gray, 128, 255, cv2.THRESH_BINARY)
+        return generateFontMaskArray(text, font_type, font_height, scale_factor, maxLen).shape
+    cropHeight = bbox[3] + 40 - round((0.09 if any('\u4e00' <= char <= '\u9fff'for char in text) else 0.727) * scale_factor/4 * font_height)
+    target_width = int(font_height / cropHeight * (bbox[2] - bbox[0]))
+    if maxLen is not None and 0 < maxLen < target_width:
+        target_width = maxLen
+    return (font_height, target_width)
+
+def renderFontMask(text: str, font_type: str, font_height: int, scale_factor: int = 4, maxLen: int|None = None) -> np.ndarray:
+    """ Rasterize the sign-font mask without the cache """
+    # Draw text
+    font = getFont(font_type, int(font_height * scale_factor))
+    binary = rasterizeText(text, font, int(font_height * scale_factor))
     # Adjust stroke 
     stroke_ratios = {"A": 0.1, 'B': 1/6, 'C': 0.1}
     target_stroke = stroke_ratios[font_type] * font_height * scale_factor
-    current_stroke = strokeWidth(binary)
+    current_stroke = tableStrokeWidth(text, font_type, int(font_height * scale_factor)) if strokeTableEnabled else None
+    if current_stroke is None:
+        current_stroke = strokeWidth(binary)
     if current_stroke > 0 and target_stroke > 0:
         kernel_size = int(abs(current_stroke - target_stroke) / 2)
         kernel_size = max(1, min(kernel_size, 15))        
@@ -82,34 +344,106 @@ def generateFontMask(text: str, font_type: str, font_height: int, scale_factor:
     target_width = int(font_height / processed.shape[0] * processed.shape[1])
     if maxLen is not None and 0 < maxLen < target_width:
         target_width = maxLen
-    resized = cv2.resize(processed, (target_width, font_height), interpolation=cv2.INTER_AREA)
-    return Image.fromarray(resized)
+    return cv2.resize(processed, (target_width, font_height), interpolation=cv2.INTER_AREA)
 
-def placeText(img: Image.Image, pos: tuple[int, int], text: str, font_type: str, font_height: int, color: tuple, maxLen: int|None = None) -> Image.Image:
-    """
-        <h4>Put text on image</h4>
-        <p> font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code></p>
-    """
-    if len(text) == 0:
-        return img
+def getColor(color: tuple) -> tuple:
+    """ Convert color to RGBA color """
     if isinstance(color, int):
         color = (color, color, color, 255)
     elif len(color) == 1:
         color = (color[0], color[0], color[0], 255)
     elif len(color) == 3:
         color = (*color, 255)
-    if img.mode != 'RGBA':
-        img = img.convert('RGBA')
-    # Paste colored text by mask
-    mask = generateFontMask(text, font_type, font_height, maxLen=maxLen)
-    xMax, yMax = mask.size
+    return color
+
+def blendMask(canvas: np.ndarray, pos: tuple[int, int], mask: np.ndarray, color: tuple) -> np.ndarray:
+    """ Blend the color into the RGBA array through the mask in place (same result as <code>Image.paste</code>) """
+    x, y = int(pos[0]), int(pos[1])
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + mask.shape[1], canvas.shape[1]), min(y + mask.shape[0], canvas.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return canvas
+    alpha = mask[y0 - y: y1 - y, x0 - x: x1 - x, None].astype(np.uint32)
+    area = canvas[y0: y1, x0: x1]
+    value = area * (255 - alpha)
+    value += np.array(color, np.uint32) * alpha
+    value += 128
+    value += value >> 8
+    value >>= 8
+    area[:] = value
+    return canvas
+
+def downsampleArea(canvas: np.ndarray, factor: int, size: tuple[int, int]|None = None, rows: int = 256) -> np.ndarray:
+    """
+        <h4>Downsample the RGBA array by the integer factor with area averaging</h4>
+        <p>The colors are averaged with premultiplied alpha (transparent pixels do not darken the edges), size is the <code>(width, height)</code> of the result, the missing pixels are transparent</p>
+    """
+    height, width = canvas.shape[:2]
+    if size is None:
+        size = (round(width / factor), round(height / factor))
+    result = np.empty((size[1], size[0], 4), np.uint8)
+    for y0 in range(0, size[1], rows):
+        y1 = min(y0 + rows, size[1])
+        # One band of rows at a time, the band edges are on the block edges so the bands do not affect each other
+        area = canvas[y0 * factor: y1 * factor, : size[0] * factor]
+        if area.shape[:2] == ((y1 - y0) * factor, size[0] * factor) and area[..., 3].min() == 255:
+            # Opaque: premultiplying changes nothing
+            result[y0: y1] = cv2.resize(area, (size[0], y1 - y0), interpolation=cv2.INTER_AREA)
+            continue
+        band = np.zeros(((y1 - y0) * factor, size[0] * factor, 4), np.float32)
+        band[: area.shape[0], : area.shape[1]] = area
+        band[..., :3] *= band[..., 3:] / 255
+        small = cv2.resize(band, (size[0], y1 - y0), interpolation=cv2.INTER_AREA)
+        alpha = small[..., 3:]
+        small[..., :3] *= np.divide(255, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+        result[y0: y1] = np.clip(small + 0.5, 0, 255)
+    return result
+
+def pasteMask(img: Image.Image|np.ndarray, pos: tuple[int, int], mask: np.ndarray, color: tuple, warn: bool = True) -> Image.Image|np.ndarray:
+    """ Paste the color on image (or RGBA array) through the mask <p>Warn if the mask is out of the image</p> """
+    if isinstance(img, np.ndarray):
+        size = (img.shape[1], img.shape[0])
+    else:
+        if img.mode != 'RGBA':
+            img = img.convert('RGBA')
+        size = img.size
+    yMax, xMax = mask.shape
     xMax += pos[0]
     yMax += pos[1]
-    if xMax > img.size[0] or yMax >img.size[1]:
-        print(f"Warning: text area ({xMax}, {yMax}) out of image size {img.size}.")
-    img.paste(Image.new('RGBA', mask.size, color), pos, mask.convert('L'))
+    if warn and (xMax > size[0] or yMax > size[1]):
+        print(f"Warning: text area ({xMax}, {yMax}) out of image size {size}.")
+    if isinstance(img, np.ndarray):
+        return blendMask(img, pos, mask, getColor(color))
+    img.paste(getColor(color), (int(pos[0]), int(pos[1])), Image.fromarray(mask))
     return img
 
+def placeText(img: Image.Image|np.ndarray, pos: tuple[int, int], text: str, font_type: str, font_height: int, color: tuple, maxLen: int|None = None, warn: bool = True) -> Image.Image|np.ndarray:
+    """
+        <h4>Put text on image (or RGBA array)</h4>
+        <p> font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code></p>
+    """
+    if len(text) == 0:
+        return img
+    # Paste colored text by mask
+    return pasteMask(img, pos, generateFontMaskArray(text, font_type, font_height, maxLen=maxLen), color, warn)
+
+def placeTextRun(img: Image.Image|np.ndarray, pos: tuple[int, int], glyphList: list[tuple[int, str]], font_type: str, font_height: int, color: tuple, warn: bool = True) -> Image.Image|np.ndarray:
+    """
+        <h4>Put a run of glyphs with the same height on image by one paste</h4>
+        <p> glyphList is the list of <code>(x offset, text)</code>, font_type should be <code>"A"</code>, <code>"B"</code>, or <code>"C"</code></p>
+    """
+    maskList = [(x, generateFontMaskArray(text, font_type, font_height)) for x, text in glyphList if len(text) > 0]
+    if len(maskList) == 0:
+        return img
+    if len(maskList) == 1 and maskList[0][0] == 0:
+        return pasteMask(img, pos, maskList[0][1], color, warn)
+    runMask = np.zeros((maskList[0][1].shape[0], max([x + mask.shape[1] for x, mask in maskList])), np.uint16)
+    for x, mask in maskList:
+        # Same result as pasting the glyphs one by one with the same color
+        area = runMask[:, x: x + mask.shape[1]]
+        area[:] = 255 - ((255 - area) * (255 - mask.astype(np.uint16)) + 127) // 255
+    return pasteMask(img, pos, runMask.astype(np.uint8), color, warn)
+
 """if __name__ == "__main__":
     # 示例1：
     background = Image.new('RGB', (1600, 600), (34,150,60))